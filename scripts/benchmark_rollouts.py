@@ -0,0 +1,41 @@
+import os
+import sys
+sys.path.insert(1, os.path.realpath('../src'))
+import numpy as np
+from time import time
+from mcts.mcts import rollout_batch, ROLLOUT_POLICIES
+
+# Positions with known values for the player to move
+POSITIONS = [
+    ('k7/2Q5/1K6/8/8/8/8/8 w - - 0 1', 1), # Mate in one
+    ('8/8/8/8/8/6k1/5q2/7K b - - 0 1', 1), # Mate in one for black
+    ('8/8/8/4k3/8/8/8/4KQ2 w - - 0 1', 1), # KQ vs K
+    ('8/8/8/4k3/8/8/8/R3K3 w - - 0 1', 1), # KR vs K
+    ('3qk3/8/8/8/8/8/8/4K3 w - - 0 1', -1), # K vs KQ
+    ('4k3/8/4K3/4P3/8/8/8/8 b - - 0 1', 0), # Drawn KP vs K
+    ('rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1', 0) # Start
+]
+
+if __name__ == '__main__':
+    rollouts_per_position = 200
+    num_threads = os.cpu_count()
+
+    fens, true_values = zip(*POSITIONS)
+    true_values = np.array(true_values)
+
+    for max_depth in [None, 50]:
+        for policy in ROLLOUT_POLICIES:
+            start_time = time()
+            stats = rollout_batch(fens, rollouts_per_position, max_depth=max_depth, policy=policy,
+                                  num_threads=num_threads)
+            elapsed_s = time() - start_time
+
+            values = stats[:, 0]
+            playouts_per_s = len(fens) * rollouts_per_position / elapsed_s
+            mean_abs_error = np.abs(values - true_values).mean()
+
+            print(f'Policy: {policy}, max depth: {max_depth}')
+            print(f'    Playouts/s: {playouts_per_s:.0f}')
+            print(f'    Mean playout length: {stats[:, 4].mean():.1f}')
+            print(f'    Mean absolute value error: {mean_abs_error:.3f}')
+            print(f'    Values: {np.round(values, 2)}')
@@ -3,4 +3,6 @@
 # Can also run g++ -std=c++20 -o mylib.so -shared rollout.cpp as is done here
 # https://stackoverflow.com/questions/30983220/ctypes-error-attributeerror-symbol-not-found-os-x-10-7-5
 
-python setup.py build
+# Builds the library next to rollout.cpp, where mcts/rollout_lib.py loads it from
+# Run once after cloning or changing the C++ code; importing the search never builds it
+cd "$(dirname "$0")" && python setup.py build_ext --inplace
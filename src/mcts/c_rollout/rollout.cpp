@@ -13,6 +13,9 @@
 #include <string>
 #include <random>
 #include <vector>
+#include <thread>
+#include <algorithm>
+#include <cmath>
 #include "thc.h"
 
 // Function declarations
@@ -20,7 +23,29 @@
 extern "C" bool isAutomaticDraw(thc::ChessRules&);
 extern "C" bool isTerminalAndValue(thc::ChessRules&, bool, int&);
 extern "C" int rollout(char*);
+extern "C" double rollout_capped(char*, int, int);
+extern "C" void rollout_batch(char**, int, int, int, int, int, double*);
+extern "C" double static_value(thc::ChessRules&, bool);
+extern "C" void seed_rollout(unsigned int);
 extern "C" void display_position(thc::ChessRules, std::string&);
+std::mt19937 & getThreadRng();
+double playout(thc::ChessRules, int, int, int&, bool&);
+thc::Move chooseMove(thc::ChessRules&, int, std::mt19937&);
+
+// Statistics written per position by rollout_batch
+const int N_ROLLOUT_STATS = 5; // Mean value, wins, draws, losses, mean playout length
+
+// Static evaluation of positions where depth-capped rollouts stop, in pawns
+const double MOBILITY_WEIGHT = 0.1; // Per legal move more than the opponent
+const double EVAL_SCALE = 4; // Advantage squashed to tanh(1) ~ 0.76
+
+// How playouts choose their moves
+enum ROLLOUT_POLICY {
+    POLICY_UNIFORM = 0, // Uniformly random legal moves
+    POLICY_CAPTURE_CHECK_FIRST, // Mates, then random captures, checks or promotions, then uniform
+    POLICY_SEE_WEIGHTED // Moves sampled with weight exp(SEE_TEMPERATURE * static exchange gain)
+};
+const double SEE_TEMPERATURE = 0.5;
 
 void display_position( thc::ChessRules &cr, const std::string &description )
 {
@@ -51,6 +76,112 @@ bool isTerminalAndValue(thc::ChessRules & cr, bool isOrigWhite, int & value) {
     return terminal != thc::NOT_TERMINAL || isAutomaticDraw(cr);
 }
 
+std::mt19937 & getThreadRng() {
+    // Each thread gets its own generator so concurrent rollouts don't race on its state
+    thread_local std::random_device rd;
+    thread_local std::mt19937 mt(rd());
+
+    return mt;
+}
+
+void seed_rollout(unsigned int seed) {
+    // Only reseeds the calling thread's generator, e.g. after forking a process
+    getThreadRng().seed(seed);
+}
+
+int pieceValue(char piece) {
+    switch (piece) {
+        case 'P': case 'p': return 1;
+        case 'N': case 'n': return 3;
+        case 'B': case 'b': return 3;
+        case 'R': case 'r': return 5;
+        case 'Q': case 'q': return 9;
+        default: return 0; // Kings and empty squares
+    }
+}
+
+double static_value(thc::ChessRules & cr, bool isOrigWhite) {
+    // Material and mobility balance of a non-terminal position squashed to (-1, 1),
+    // with the same sign convention as isTerminalAndValue
+    double advantage = 0; // From white's perspective
+    for (int square = 0; square < 64; square++) {
+        char piece = cr.squares[square];
+        int value = pieceValue(piece);
+        advantage += isupper(piece) ? value : -value;
+    }
+
+    // Legal move counts of both sides, the opponent's generated by toggling the player to move
+    thc::MOVELIST moves;
+    cr.GenLegalMoveList(&moves);
+    int mobility = moves.count;
+    cr.white = !cr.white;
+    cr.GenLegalMoveList(&moves);
+    mobility -= moves.count;
+    cr.white = !cr.white;
+
+    advantage += MOBILITY_WEIGHT * (cr.WhiteToPlay() ? mobility : -mobility);
+
+    return std::tanh((isOrigWhite ? advantage : -advantage) / EVAL_SCALE);
+}
+
+double exchangeGain(thc::ChessRules & cr, thc::Move & move) {
+    // Cheap static exchange estimate in pawns: the captured and promoted material, minus
+    // the moving piece if the destination square is defended
+    double gain = pieceValue(move.capture);
+    char piece = cr.squares[move.src];
+
+    if (move.special == thc::SPECIAL_PROMOTION_QUEEN) {
+        gain += pieceValue('Q') - pieceValue('P');
+        piece = 'Q';
+    }
+
+    if (cr.AttackedSquare(move.dst, !cr.WhiteToPlay())) {
+        gain -= pieceValue(piece);
+    }
+
+    return gain;
+}
+
+thc::Move chooseMove(thc::ChessRules & cr, int policy, std::mt19937 & mt) {
+    // Picks a legal move of a non-terminal position according to policy
+    thc::MOVELIST moves;
+    bool check[MAXMOVES], mate[MAXMOVES], stalemate[MAXMOVES];
+
+    if (policy == POLICY_CAPTURE_CHECK_FIRST) {
+        cr.GenLegalMoveList(&moves, check, mate, stalemate);
+
+        std::vector<int> forcing; // Captures, checks and promotions
+        for (int i = 0; i < moves.count; i++) {
+            if (mate[i]) {
+                return moves.moves[i];
+            }
+            if (moves.moves[i].capture != ' ' || check[i] || moves.moves[i].special == thc::SPECIAL_PROMOTION_QUEEN) {
+                forcing.push_back(i);
+            }
+        }
+
+        if (!forcing.empty()) {
+            std::uniform_int_distribution<> rand(0, forcing.size() - 1);
+            return moves.moves[forcing[rand(mt)]];
+        }
+    } else {
+        cr.GenLegalMoveList(&moves);
+    }
+
+    if (policy == POLICY_SEE_WEIGHTED) {
+        std::vector<double> weights(moves.count);
+        for (int i = 0; i < moves.count; i++) {
+            weights[i] = std::exp(SEE_TEMPERATURE * exchangeGain(cr, moves.moves[i]));
+        }
+
+        std::discrete_distribution<> rand(weights.begin(), weights.end());
+        return moves.moves[rand(mt)];
+    }
+
+    std::uniform_int_distribution<> rand(0, moves.count - 1);
+    return moves.moves[rand(mt)];
+}
+
 bool isAutomaticDraw(thc::ChessRules & cr) {
     // Check for 75 move no progress rule
     if (cr.half_move_clock >= 150) {
@@ -70,30 +201,116 @@ bool isAutomaticDraw(thc::ChessRules & cr) {
     return result == thc::DRAWTYPE_INSUFFICIENT_AUTO;
 }
 
-int rollout(char* fen) {
+double playout(thc::ChessRules cr, int maxDepth, int policy, int & length, bool & capped) {
+    // Plays moves chosen by policy until the game ends or, if maxDepth > 0, maxDepth moves
+    // were played, in which case the position is scored with static_value
     // Random number generator
-    static std::random_device rd;
-    static std::mt19937 mt(rd());
+    std::mt19937 & mt = getThreadRng();
 
-    thc::ChessRules cr;
-    cr.Forsyth(fen);
     bool isOrigWhite = cr.WhiteToPlay();
 
-    std::vector<thc::Move> moves;
     int value;
 
+    length = 0;
+    capped = false;
     while (true) {
         //display_position(cr, "");
         if (isTerminalAndValue(cr, isOrigWhite, value)) {
             return value;
         }
-        cr.GenLegalMoveList(moves);
+        if (maxDepth > 0 && length >= maxDepth) {
+            capped = true;
+            return static_value(cr, isOrigWhite);
+        }
+
+        cr.PlayMove(chooseMove(cr, policy, mt));
+        length++;
+    }
+}
+
+int rollout(char* fen) {
+    thc::ChessRules cr;
+    cr.Forsyth(fen);
+
+    int length;
+    bool capped;
+    return (int) playout(cr, 0, POLICY_UNIFORM, length, capped);
+}
+
+double rollout_capped(char* fen, int maxDepth, int policy) {
+    thc::ChessRules cr;
+    cr.Forsyth(fen);
+
+    int length;
+    bool capped;
+    return playout(cr, maxDepth, policy, length, capped);
+}
+
+void rollout_batch(char** fens, int nPositions, int rolloutsPerPosition, int maxDepth, int policy,
+                   int numThreads, double* out) {
+    // Plays rolloutsPerPosition playouts with policy, capped at maxDepth moves if maxDepth > 0,
+    // from each of the nPositions FENs, spread over numThreads threads. Writes
+    // N_ROLLOUT_STATS values per position to out, which must hold nPositions * N_ROLLOUT_STATS
+    // doubles. Wins, draws and losses only count playouts which reached the end of the game
+    // Each FEN is only parsed once; playouts start from copies of the parsed position
+    std::vector<thc::ChessRules> positions(nPositions);
+    for (int i = 0; i < nPositions; i++) {
+        positions[i].Forsyth(fens[i]);
+    }
+
+    int nRollouts = nPositions * rolloutsPerPosition;
+    std::vector<double> values(nRollouts);
+    std::vector<int> lengths(nRollouts);
+    std::vector<char> capped(nRollouts); // Not vector<bool>, which isn't safe to write from multiple threads
+
+    // Rollout k starts from position k / rolloutsPerPosition; thread t plays rollouts t, t + numThreads, ...
+    auto runRollouts = [&](int firstRollout, unsigned int seed, bool reseed) {
+        if (reseed) {
+            getThreadRng().seed(seed);
+        }
+
+        for (int k = firstRollout; k < nRollouts; k += numThreads) {
+            bool rolloutCapped;
+            values[k] = playout(positions[k / rolloutsPerPosition], maxDepth, policy, lengths[k], rolloutCapped);
+            capped[k] = rolloutCapped;
+        }
+    };
+
+    numThreads = std::max(1, std::min(numThreads, nRollouts));
+    if (numThreads == 1) {
+        runRollouts(0, 0, false);
+    } else {
+        // Seed the workers from the calling thread's generator so seed_rollout makes the batch reproducible
+        std::vector<std::thread> threads;
+        for (int t = 0; t < numThreads; t++) {
+            threads.emplace_back(runRollouts, t, getThreadRng()(), true);
+        }
+        for (std::thread & thread : threads) {
+            thread.join();
+        }
+    }
 
-        std::uniform_int_distribution<> rand(0, moves.size() - 1);
-        int randInd = rand(mt);
+    for (int i = 0; i < nPositions; i++) {
+        int wins = 0, draws = 0, losses = 0;
+        double totalValue = 0;
+        long totalLength = 0;
+
+        for (int k = i * rolloutsPerPosition; k < (i + 1) * rolloutsPerPosition; k++) {
+            if (!capped[k]) {
+                wins += values[k] == 1;
+                draws += values[k] == 0;
+                losses += values[k] == -1;
+            }
+            totalValue += values[k];
+            totalLength += lengths[k];
+        }
 
-        cr.PlayMove(moves[randInd]);
-        moves.clear();
+        double* stats = out + i * N_ROLLOUT_STATS;
+        stats[0] = totalValue / rolloutsPerPosition;
+        stats[1] = wins;
+        stats[2] = draws;
+        stats[3] = losses;
+        stats[4] = (double) totalLength / rolloutsPerPosition;
     }
 }
 
@@ -139,6 +356,41 @@ int main()
     value = rollout(fen);
     printf("Value should be arbitrary: %d\n", value);
 
+    // Batch of rollouts over multiple threads
+    char * fens[] = {"k7/1Q6/1K6/8/8/8/8/8 b - - 0 1", "k7/8/4K3/8/8/8/8/8 b - - 0 1"};
+    double stats[2 * N_ROLLOUT_STATS];
+    rollout_batch(fens, 2, 8, 0, POLICY_UNIFORM, 4, stats);
+    printf("Mean values should be -1 and 0: %f %f\n", stats[0], stats[N_ROLLOUT_STATS]);
+    assert(stats[0] == -1 && stats[3] == 8);
+    assert(stats[N_ROLLOUT_STATS] == 0 && stats[N_ROLLOUT_STATS + 2] == 8);
+
+    // Depth-capped rollouts from the start are scored statically
+    fen = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1";
+    rollout_batch(&fen, 1, 8, 10, POLICY_UNIFORM, 1, stats);
+    printf("Mean length should be at most 10: %f\n", stats[4]);
+    assert(stats[4] <= 10 && stats[0] > -1 && stats[0] < 1);
+
+    // Mate in one is always found by the capture/check-first policy
+    fen = "k7/2Q5/1K6/8/8/8/8/8 w - - 0 1";
+    rollout_batch(&fen, 1, 8, 0, POLICY_CAPTURE_CHECK_FIRST, 1, stats);
+    printf("Mean value should be 1: %f\n", stats[0]);
+    assert(stats[0] == 1 && stats[4] == 1);
+
+    // The SEE-weighted policy prefers winning the hanging queen
+    fen = "k7/8/8/3q4/8/8/8/K2R4 w - - 0 1";
+    cr.Forsyth(fen);
+    int nCaptures = 0;
+    for (int i = 0; i < 100; i++) {
+        nCaptures += chooseMove(cr, POLICY_SEE_WEIGHTED, getThreadRng()).capture == 'q';
+    }
+    printf("Queen captures out of 100: %d\n", nCaptures);
+    assert(nCaptures > 50);
+
+    // White is a queen up
+    cr.Forsyth("rnb1kbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1");
+    printf("Static value should be positive: %f\n", static_value(cr, true));
+    assert(static_value(cr, true) > 0 && static_value(cr, false) < 0);
+
     // Check draw condition counts increasing
     cr.Forsyth("rnbqkbnr/pp1ppppp/2p5/8/8/4P3/PPPP1PPP/RNBQKBNR w KQkq - 0 1");
     for (int i = 0; i < 5; i++) {
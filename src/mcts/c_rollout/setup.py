@@ -12,7 +12,9 @@ setup(
             extra_compile_args=[
                 '-std=c++14',
                 '-w', # Suppress warnings
-                '-O3'
-            ])
+                '-O3',
+                '-pthread' # rollout_batch runs rollouts on multiple threads
+            ],
+            extra_link_args=['-pthread'])
     ],
 )
@@ -1,127 +1,483 @@
 import chess
-from .tree import TreeNode
+from .tree import NodeArena, MAX_TABLE_ENTRIES
+from .rollout_lib import get_rollout_lib
 import logging
 from time import time
 from numpy.random import randint
+import numpy as np
+import multiprocessing
+import threading
 import ctypes
-import glob
-import os
+from concurrent.futures import ThreadPoolExecutor
 
 logger = logging.getLogger(__name__)
 
+# Whether to roll out with the C++ library when it has been built (see rollout_lib.py)
 USE_CPP_ROLLOUT = True
 
-if USE_CPP_ROLLOUT:
-    # Note that logs and prints don't occur during import on Google Colab
+# Columns of the statistics returned by rollout_batch
+ROLLOUT_STATS = ['mean_value', 'wins', 'draws', 'losses', 'mean_length']
 
-    # Hack to set up the C++ rollout library on any system
-    # Refer to test/test_lib.py for the code
-    orig_wd = os.getcwd()
-    dir_path = os.path.dirname(os.path.realpath(__file__))
-    os.chdir(os.path.join(dir_path, 'c_rollout'))
+# Move selection policies of the C++ rollouts, indexed by their ROLLOUT_POLICY value in rollout.cpp:
+# uniformly random, mates then captures/checks/promotions first, and static exchange weighted
+ROLLOUT_POLICIES = ['uniform', 'capture_check_first', 'see_weighted']
 
-    # Google Colab is okay with the script version for some reason
-    # os.system returns the exit code; exit code != 0 implies an error occurred
-    if not os.path.exists('./build'):
-        if os.system('chmod u+x ./build_lib.sh && ./build_lib.sh'):
-            raise RuntimeError('A problem occurred building the C++ rollout library')
-        logger.info('C++ rollout library built successfully')
-
-    libfile = glob.glob('build/*/*.so')[0]
-    rollout_lib = ctypes.CDLL(libfile)
+# Static evaluation of depth-capped rollouts, mirroring static_value in rollout.cpp
+PIECE_VALUES = {chess.PAWN: 1, chess.KNIGHT: 3, chess.BISHOP: 3, chess.ROOK: 5, chess.QUEEN: 9}
+MOBILITY_WEIGHT = .1
+EVAL_SCALE = 4
 
+def rollout_batch(fens, rollouts_per_position=1, max_depth=None, policy='uniform', num_threads=1, out=None):
+    '''
+        Plays rollouts_per_position playouts from each FEN, choosing moves with the
+        ROLLOUT_POLICIES entry policy, in a single call to the C++ library, which runs
+        them on num_threads threads without holding the GIL.
+        If max_depth is not None, playouts stop after max_depth moves and the position
+        is scored with a static material and mobility evaluation.
+
+        Returns an array with a row per FEN and a column per ROLLOUT_STATS entry. Values
+        are from the perspective of the player to move in each FEN; wins, draws and
+        losses only count playouts which reached the end of the game. If out is given,
+        the statistics are written into it instead of a new array.
+
+        Raises a RuntimeError if the C++ library hasn't been built.
     '''
-    # Google Colab doesn't seem to like the g++ version
-    LIB_FILE = 'rollout.so'
+    # The library divides by the number of rollouts, and treats depths of 0 as uncapped
+    assert rollouts_per_position >= 1, 'rollouts_per_position must be at least 1'
+    assert num_threads >= 1, 'num_threads must be at least 1'
+    assert max_depth is None or max_depth >= 1, 'max_depth must be None or at least 1'
+    assert policy in ROLLOUT_POLICIES, f'Unknown rollout policy {policy}'
 
-    if not os.path.exists(LIB_FILE):
-        if os.system(f'g++ -O3 -o {LIB_FILE} -w rollout.cpp thc.cpp'):
-            raise RuntimeError('A problem occurred building the C++ rollout library')
-        logger.info('C++ rollout library built successfully')
+    rollout_lib = get_rollout_lib()
+    if rollout_lib is None:
+        raise RuntimeError('The C++ rollout library has not been built')
 
-    rollout_lib = ctypes.CDLL(LIB_FILE)
-    '''
-    rollout_lib.rollout.restype = ctypes.c_int
-    rollout_lib.rollout.argtypes = [ctypes.c_char_p]
+    if out is None:
+        out = np.empty((len(fens), len(ROLLOUT_STATS)), dtype=np.float64)
+    assert out.shape == (len(fens), len(ROLLOUT_STATS)) and out.dtype == np.float64
+
+    if len(fens) > 0:
+        c_fens = (ctypes.c_char_p * len(fens))(*[fen.encode('ascii') for fen in fens])
+        rollout_lib.rollout_batch(c_fens, len(fens), rollouts_per_position, max_depth or 0,
+                                  ROLLOUT_POLICIES.index(policy), num_threads, out)
 
-    os.chdir(orig_wd)
+    return out
+
+# Search state of a root-parallel worker process, set by its pool's initializer
+_worker_search = None
 
 # Fantastic explanation of MCTS:
 # https://www.youtube.com/watch?v=UXW2yZndl7U
 
 class MCTSEvaluator:
-    def __init__(self, root_fen, prior_func_builder, subtree=None):
+    def __init__(self, root_fen, prior_func_builder, subtree=None,
+                 batch_prior_func_builder=None, max_table_entries=MAX_TABLE_ENTRIES,
+                 rollouts_per_leaf=1, rollout_threads=1, max_rollout_depth=None, rollout_policy='uniform'):
+        '''
+            prior_func_builder takes the board of a node, with the moves from the root
+            of the tree on its move stack, and the Zobrist keys of the positions from the
+            root up to and including the node. It returns the node's prior func, which maps
+            the list of legal moves of the node to a float32 array of their priors.
+        '''
         # TODO take in fen history of root_fen to pass into prior_func_builder
         self.root_fen = root_fen
-        self.curr_player = chess.Board(root_fen).turn # For terminal state eval
+        self.root_board = chess.Board(root_fen)
+        self.curr_player = self.root_board.turn # For terminal state eval
         self.prior_func_builder = prior_func_builder
         self.subtree = subtree # Whether to initialize the MCTS tree to this tree
 
-    def mcts(self, std_ucb=False, max_trials=500, max_time_s=float('inf')):
+        # Takes lists of boards and key paths and returns a list of prior funcs, ideally
+        # computing them in a single call to the network. Falls back to prior_func_builder if None
+        self.batch_prior_func_builder = batch_prior_func_builder
+
+        # Entry budget of the transposition table of a new tree
+        self.max_table_entries = max_table_entries
+
+        # A leaf's value is the mean of rollouts_per_leaf rollouts, which the C++ library
+        # spreads over rollout_threads threads (together with those of the rest of a batch)
+        self.rollouts_per_leaf = rollouts_per_leaf
+        self.rollout_threads = rollout_threads
+
+        # Rollouts stop after this many moves, scoring the position statically. None to play out to the end
+        self.max_rollout_depth = max_rollout_depth
+
+        # One of ROLLOUT_POLICIES; rollout_fast is always uniform
+        assert rollout_policy in ROLLOUT_POLICIES
+        self.rollout_policy = rollout_policy
+
+    def mcts(self, std_ucb=False, max_trials=500, max_time_s=float('inf'), batch_size=1,
+             num_threads=1, num_processes=1):
         '''
             max_time_s < 0 indicates all the time necessary to finish
             max_trials.
+
+            If batch_size > 1, each round selects batch_size leaves (using virtual loss
+            to spread the descents over different paths) and computes their priors
+            together before backing them all up.
+
+            If num_threads > 1, that many threads search the same tree at once, using
+            virtual loss to spread out over different paths. batch_size must then be 1.
+            The threads only overlap while the GIL is released, i.e. in the network's
+            forward passes and the C++ rollouts, so the search scales with threads only
+            as far as those dominate the trials.
+
+            If num_processes > 1, that many forked processes each search an independent
+            copy of the tree with their own seed, running up to max_trials trials each.
+            The statistics of their root edges are then summed into the returned root.
+            prior_func_builder must be usable after a fork (e.g. not use CUDA).
         '''
-        logger.debug(f'Starting MCTS in state:\n{chess.Board(self.root_fen)}')
-        fen_to_node = {} # Index of all TreeNodes
+        logger.debug(f'Starting MCTS in state:\n{self.root_board}')
+        # Threads each evaluate one leaf per trial
+        assert num_threads == 1 or batch_size == 1, 'batch_size must be 1 when searching with several threads'
+
         if self.subtree is None:
-            root = TreeNode(self.root_fen, fen_to_node)
-            root.expand(self.prior_func_builder([self.root_fen]))
+            root = NodeArena(self.root_board, self.max_table_entries).root
         else:
             root = self.subtree
-            assert root.was_expanded()
+            if root.node_id != 0:
+                # Free the rest of the previous tree and replay boards from the new root
+                root.arena.compact(root.node_id)
+                root = root.arena.root
+
+        # Subtree roots visited only once aren't expanded yet
+        if not root.was_expanded():
+            root.expand(self.prior_func_builder(self.root_board.copy(), [root.key]),
+                        board=self.root_board.copy())
+
+        table = root.arena.table # Index of the tree's nodes, shared with reused subtrees
+
+        search_args = (root, table, std_ucb, max_trials, max_time_s, batch_size, num_threads)
+        if num_processes > 1:
+            i = self.search_root_parallel(num_processes, *search_args)
+        else:
+            i = self.search(*search_args)
+
+        logger.debug(f'Completed {i} rounds of MCTS')
+        logger.debug(f'Transposition table stats: {table.get_stats()}')
+
+        return root
+
+    def search(self, root, table, std_ucb, max_trials, max_time_s, batch_size, num_threads):
+        '''
+            Runs MCTS trials from root, returning the number of trials run.
+        '''
+        if num_threads > 1:
+            return self.search_threaded(root, table, num_threads, std_ucb, max_trials, max_time_s)
 
         start_time = time()
         out_of_time = False
 
         i = 0
         while i < max_trials and not out_of_time:
-            self.evaluate(root, fen_to_node, i, std_ucb=std_ucb)
-            i += 1
+            if batch_size > 1:
+                n_trials = min(batch_size, max_trials - i)
+                self.evaluate_batch(root, table, i, n_trials, std_ucb=std_ucb)
+                i += n_trials
+            else:
+                self.evaluate(root, table, i, std_ucb=std_ucb)
+                i += 1
+
+            # Free the nodes evicted from the table, between trials as ids change
+            if root.arena.is_over_budget():
+                root.arena.compact()
 
             if max_time_s > 0 and time() - start_time > max_time_s:
                 out_of_time = True
                 logger.debug(f'Out of time for MCTS evaluation')
 
-        logger.debug(f'Completed {i} rounds of MCTS')
+        return i
 
-        return root
+    def search_root_parallel(self, num_processes, root, *search_args):
+        '''
+            Searches independent copies of the tree rooted at root in num_processes
+            forked processes, then merges the visits and scores they added to the root
+            and its edges into root. Returns the total number of trials run.
+        '''
+        # Statistics the root already had (from subtree reuse) are shared by all workers
+        base_stats = _get_root_stats(root)
+
+        seeds = np.random.randint(2**31, size=num_processes)
+        # The forked workers inherit the initializer's arguments without pickling them,
+        # and concurrent searches each pass their own
+        with multiprocessing.get_context('fork').Pool(num_processes, initializer=_init_root_parallel_worker,
+                                                      initargs=(self, root, search_args)) as pool:
+            results = pool.map(_run_root_parallel_worker, seeds.tolist())
+
+        n_trials = 0
+        for worker_trials, worker_stats in results:
+            n_trials += worker_trials
+            root.merge_stats(*(
+                worker_stat - base_stat
+                for worker_stat, base_stat in zip(worker_stats, base_stats)
+            ))
+
+        return n_trials
+
+    def evaluate(self, root, table, trials_so_far, std_ucb=False):
+        path, board, keys = self.select(root, trials_so_far, std_ucb=std_ucb)
+        curr = path[-1]
+
+        if curr.is_terminal():
+            value = self.get_terminal_value(curr)
+        else:
+            if curr.n_visits > 0:
+                table.protect(keys)
+                curr.expand(self.prior_func_builder(board, keys), board=board)
+                self.extend_path(path, board, trials_so_far)
+
+            value = self.get_rollout_value(board)
+
+        self.backup(path, value)
 
-    def evaluate(self, root, fen_to_node, trials_so_far, std_ucb=False):
+    def evaluate_batch(self, root, table, trials_so_far, batch_size, std_ucb=False):
+        '''
+            Batched version of evaluate. Selects batch_size leaves, adding a virtual
+            loss to the edges of each path so that later descents pick different paths,
+            then expands the leaves with a single call to the batched prior builder
+            before rolling out and backing up every path.
+        '''
+        selections = []
+        to_expand = {} # Leaves reached by multiple descents are only expanded once
+
+        for _ in range(batch_size):
+            path, board, keys = self.select(root, trials_so_far, std_ucb=std_ucb)
+            self.add_virtual_loss(path)
+            selections.append((path, board))
+
+            leaf = path[-1]
+            if not leaf.is_terminal() and leaf.n_visits > 0:
+                to_expand.setdefault(leaf, (board, keys))
+
+        if to_expand:
+            leaves = list(to_expand)
+            boards, key_paths = zip(*to_expand.values())
+            table.protect(key for keys in key_paths for key in keys)
+
+            prior_funcs = self.build_prior_funcs(boards, key_paths)
+            for leaf, board, prior_func in zip(leaves, boards, prior_funcs):
+                leaf.expand(prior_func, board=board)
+
+        to_rollout = [] # Indices of the selections ending in a non-terminal leaf
+        values = np.zeros(len(selections))
+        for i, (path, board) in enumerate(selections):
+            leaf = path[-1]
+
+            if leaf.is_terminal():
+                values[i] = self.get_terminal_value(leaf)
+            else:
+                if leaf.was_expanded(): # Expanded above; step to a child as in evaluate
+                    self.extend_path(path, board, trials_so_far)
+                    path[-2].add_virtual_loss()
+
+                to_rollout.append(i)
+
+        # Roll out from all the leaves at once
+        values[to_rollout] = self.get_rollout_values([selections[i][1] for i in to_rollout])
+
+        for (path, board), value in zip(selections, values):
+            self.revert_virtual_loss(path)
+            self.backup(path, float(value))
+
+    def search_threaded(self, root, table, num_threads, std_ucb, max_trials, max_time_s):
+        '''
+            Runs trials in num_threads threads sharing the tree rooted at root until
+            max_trials trials have started or max_time_s has elapsed. Returns the number
+            of trials run.
+        '''
+        self.tree_lock = threading.Lock() # Guards all node and edge statistics
+        self.expanding = set() # Nodes whose priors are being computed by some thread
+        trials_done = threading.Condition(self.tree_lock)
+        start_time = time()
+        trials_started = 0
+        trials_running = 0
+
+        def run_trials():
+            nonlocal trials_started, trials_running
+            while True:
+                with self.tree_lock:
+                    # Free the nodes evicted from the table once no trial holds views of them
+                    while root.arena.is_over_budget() and trials_running > 0:
+                        trials_done.wait()
+                    if root.arena.is_over_budget():
+                        root.arena.compact()
+
+                    if trials_started >= max_trials or failed.is_set() \
+                       or max_time_s > 0 and time() - start_time > max_time_s:
+                        return
+
+                    trials_so_far = trials_started
+                    trials_started += 1
+                    trials_running += 1
+
+                try:
+                    self.evaluate_threaded(root, table, trials_so_far, std_ucb=std_ucb)
+                except Exception:
+                    failed.set() # Stop the other threads too
+                    raise
+                finally:
+                    with self.tree_lock:
+                        trials_running -= 1
+                        trials_done.notify_all()
+
+        failed = threading.Event()
+        with ThreadPoolExecutor(max_workers=num_threads) as executor:
+            futures = [executor.submit(run_trials) for _ in range(num_threads)]
+
+        # Raise the first error in the calling thread, as the sequential search would
+        for future in futures:
+            future.result()
+
+        return trials_started
+
+    def evaluate_threaded(self, root, table, trials_so_far, std_ucb=False):
+        '''
+            Version of evaluate safe to run from several threads at once. The tree is
+            only updated while holding the tree lock, which is released between the
+            steps of the descent, while computing priors and while rolling out.
+        '''
+        path, board, keys, should_expand = self.select_threaded(root, trials_so_far, std_ucb=std_ucb)
+        leaf = path[-1]
+
+        value = None
+        try:
+            if should_expand:
+                prior_func = self.prior_func_builder(board, keys)
+
+                with self.tree_lock:
+                    table.protect(keys)
+                    leaf.expand(prior_func, board=board)
+                    self.extend_path(path, board, trials_so_far)
+                    path[-2].add_virtual_loss()
+
+            if leaf.is_terminal():
+                value = self.get_terminal_value(leaf)
+            else:
+                value = self.get_rollout_value(board)
+
+        finally:
+            # Leave the tree consistent even if the trial failed, only backing up its value if it has one
+            with self.tree_lock:
+                if should_expand:
+                    self.expanding.discard(leaf)
+
+                self.revert_virtual_loss(path)
+                if value is not None:
+                    self.backup(path, value)
+
+    def select_threaded(self, root, trials_so_far, std_ucb=False):
+        '''
+            Version of select for evaluate_threaded, which adds virtual loss to each edge
+            as it is selected. The UCBs are computed without the tree lock, which is only
+            held to follow the selected edge, so that threads descend at the same time.
+
+            Also returns whether this thread should expand the leaf, in which case it is
+            added to expanding.
+        '''
+        path = [root]
+        board = self.root_board.copy()
+        keys = [root.key]
+
+        curr = root
+        while True:
+            # Edges are never removed, so an edge selected from a node stays valid
+            edge = None if curr.is_leaf() else curr.get_edge_to_explore(trials_so_far, std_ucb=std_ucb)
+
+            with self.tree_lock:
+                if edge is None:
+                    if not curr.is_leaf():
+                        continue # Expanded by another thread since
+
+                    # If another thread is already expanding the leaf, just roll out from it
+                    should_expand = not curr.is_terminal() and curr.n_visits > 0 \
+                                    and curr not in self.expanding
+                    if should_expand:
+                        self.expanding.add(curr)
+
+                    return path, board, keys, should_expand
+
+                edge.add_virtual_loss()
+                root.arena.get_child(edge.edge_id, board)
+                curr = edge.to_node
+                root.arena.table.touch(curr.key)
+
+            path.append(edge)
+            path.append(curr)
+            keys.append(curr.key)
+
+    def select(self, root, trials_so_far, std_ucb=False):
+        '''
+            Descends from root until reaching a leaf (a node which hasn't been expanded).
+
+            Returns the path of alternating nodes and edges from root to the leaf, the
+            board of the leaf with the moves of the path on its move stack, and the list
+            of Zobrist keys of the nodes on the path.
+        '''
         # Path will contain nodes and edges so we can update state values
         # though we technically only care about action values
         path = [root]
-        fen_path = [root.fen] # Keep track of just node path to compute priors
+        board = self.root_board.copy()
+        keys = [root.key] # Keep track of just node path to compute priors
 
-        # Descend until we find a leaf (a node which hasn't been expanded)
         curr = root
         while not curr.is_leaf():
-            edge = curr.get_edge_to_explore(trials_so_far, std_ucb=std_ucb)
+            edge = curr.get_edge_to_explore(trials_so_far, std_ucb=std_ucb, board=board)
             curr = edge.to_node
 
             path.append(edge)
             path.append(curr)
-            fen_path.append(curr.fen)
+            keys.append(curr.key)
+            root.arena.table.touch(keys[-1]) # Recently visited positions are evicted last
 
-        if curr.is_terminal():
-            value = self.get_terminal_value(curr)
-        else:
-            if curr.n_visits > 0:
-                curr.expand(self.prior_func_builder(fen_path))
+        return path, board, keys
 
-                edge = curr.get_edge_to_explore(trials_so_far)
-                curr = edge.to_node
+    def extend_path(self, path, board, trials_so_far):
+        '''
+            Extends a path ending in a newly expanded node by one edge, pushing
+            its move onto the path's board.
+        '''
+        edge = path[-1].get_edge_to_explore(trials_so_far, board=board)
+        path.append(edge)
+        path.append(edge.to_node)
 
-                path.append(edge)
-                path.append(curr)
-                fen_path.append(curr)
+    def build_prior_funcs(self, boards, key_paths):
+        if self.batch_prior_func_builder is None:
+            return [self.prior_func_builder(board, keys) for board, keys in zip(boards, key_paths)]
 
-            if USE_CPP_ROLLOUT:
-                value = rollout_lib.rollout(curr.fen.encode('ascii'))
-            else:
-                value = self.rollout_fast(curr)
+        return self.batch_prior_func_builder(boards, key_paths)
 
-        self.backup(path, value)
+    def get_rollout_value(self, board):
+        rollout_lib = get_rollout_lib() if USE_CPP_ROLLOUT else None
+        if rollout_lib is not None and self.rollouts_per_leaf == 1:
+            if self.max_rollout_depth is None and self.rollout_policy == 'uniform':
+                return rollout_lib.rollout(board.fen().encode('ascii'))
+
+            return rollout_lib.rollout_capped(board.fen().encode('ascii'), self.max_rollout_depth or 0,
+                                              ROLLOUT_POLICIES.index(self.rollout_policy))
+
+        return float(self.get_rollout_values([board])[0])
+
+    def get_rollout_values(self, boards):
+        '''
+            Returns the mean rollout value of each board, each from the perspective
+            of its player to move.
+        '''
+        if USE_CPP_ROLLOUT and get_rollout_lib() is not None:
+            fens = [board.fen() for board in boards]
+            return rollout_batch(fens, self.rollouts_per_leaf, self.max_rollout_depth, self.rollout_policy,
+                                 self.rollout_threads)[:, 0]
+
+        return np.array([
+            np.mean([self.rollout_fast(board, self.max_rollout_depth) for _ in range(self.rollouts_per_leaf)])
+            for board in boards
+        ])
+
+    def add_virtual_loss(self, path):
+        for edge in path[1::2]:
+            edge.add_virtual_loss()
+
+    def revert_virtual_loss(self, path):
+        for edge in path[1::2]:
+            edge.revert_virtual_loss()
 
     def backup(self, path, value):
         for node_or_edge in path:
@@ -134,15 +490,17 @@ class MCTSEvaluator:
         to_unexpand = None
 
         curr = to_rollout
+        board = to_rollout.board()
         while not curr.is_terminal():
             if not curr.was_expanded():
                 # Find the highest node to trim the rollout subtree from
                 if to_unexpand is None:
                     to_unexpand = curr
 
-                curr.expand(is_rollout=True) # No need to compute prior for state value evaluation
+                curr.expand(is_rollout=True, board=board) # No need to compute prior for state value evaluation
 
-            curr = curr.get_random_edge().to_node
+            edge = curr.get_random_edge(board=board)
+            curr = edge.to_node
 
         value = self.get_terminal_value(curr)
 
@@ -153,18 +511,24 @@ class MCTSEvaluator:
 
         return value
 
-    def rollout_fast(self, to_rollout):
+    def rollout_fast(self, board, max_depth=None):
         '''
             Much faster rollout version that doesn't construct the tree, since
             we're trimming it off anyways.
 
-            Just simulates with chess.Board
+            Just simulates with a copy of board, for at most max_depth moves
+            if max_depth is not None.
         '''
-        board = chess.Board(to_rollout.fen)
+        board = board.copy(stack=False)
         curr_player = board.turn
         outcome = board.outcome()
 
+        depth = 0
         while outcome is None:
+            if max_depth is not None and depth >= max_depth:
+                return get_static_value(board, curr_player)
+
+            depth += 1
             moves = list(board.legal_moves)
             rand_move = moves[randint(0, len(moves))]
             board.push(rand_move)
@@ -182,3 +546,45 @@ class MCTSEvaluator:
             return 0
 
         return 1 if self.curr_player == winner else -1
+
+def get_static_value(board, player):
+    '''
+        Scores a non-terminal board from the perspective of player with its material
+        and mobility balance (in pawns), squashed to (-1, 1).
+    '''
+    advantage = 0 # From white's perspective
+    for piece_type, value in PIECE_VALUES.items():
+        advantage += value * (len(board.pieces(piece_type, chess.WHITE))
+                              - len(board.pieces(piece_type, chess.BLACK)))
+
+    # Legal move counts of both sides, the opponent's generated by passing the turn
+    mobility = board.legal_moves.count()
+    board.turn = not board.turn
+    mobility -= board.legal_moves.count()
+    board.turn = not board.turn
+
+    advantage += MOBILITY_WEIGHT * (mobility if board.turn == chess.WHITE else -mobility)
+
+    return float(np.tanh((advantage if player == chess.WHITE else -advantage) / EVAL_SCALE))
+
+def _get_root_stats(root):
+    edge_visits = root.edge_visits.copy()
+    edge_scores = root.edge_scores.copy()
+
+    return root.n_visits, root.score, edge_visits, edge_scores
+
+def _init_root_parallel_worker(evaluator, root, search_args):
+    global _worker_search
+    _worker_search = (evaluator, root, search_args)
+
+def _run_root_parallel_worker(seed):
+    evaluator, root, search_args = _worker_search
+
+    np.random.seed(seed)
+    rollout_lib = get_rollout_lib() if USE_CPP_ROLLOUT else None
+    if rollout_lib is not None: # Otherwise the forked rollout generators would all be identical
+        rollout_lib.seed_rollout(seed)
+
+    n_trials = evaluator.search(root, *search_args)
+
+    return n_trials, _get_root_stats(root)
@@ -0,0 +1,94 @@
+import ctypes
+import glob
+import os
+import threading
+import logging
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+'''
+    Loader of the C++ rollout library in c_rollout.
+
+    The library must be built beforehand by running c_rollout/build_lib.sh, which
+    builds it in place. It is only loaded the first time it is needed, without changing
+    the working directory or building anything, so that concurrent processes importing
+    the search don't race on the build directory. If it isn't found, get_rollout_lib
+    returns None and the search falls back to rollouts in Python.
+'''
+LIB_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'c_rollout')
+
+# Only in place builds (build_lib.sh); those left in build/ by older `setup.py build` runs
+# predate the functions bound below
+LIB_PATTERNS = ['rollout*.so', 'rollout*.pyd']
+
+_lib = None
+_lib_loaded = False # Whether loading was attempted, successful or not
+_lib_lock = threading.Lock()
+
+def get_rollout_lib():
+    '''
+        Returns the loaded rollout library, or None if it hasn't been built.
+    '''
+    global _lib, _lib_loaded
+    if _lib_loaded:
+        return _lib
+
+    with _lib_lock:
+        if not _lib_loaded:
+            _lib = _load()
+            _lib_loaded = True
+
+    return _lib
+
+def find_lib_file():
+    for pattern in LIB_PATTERNS:
+        lib_files = sorted(glob.glob(os.path.join(LIB_DIR, pattern)))
+        if lib_files:
+            return lib_files[0]
+
+    return None
+
+def _load():
+    lib_file = find_lib_file()
+    if lib_file is None:
+        logger.warning(f'C++ rollout library not found in {LIB_DIR}; falling back to Python rollouts. '
+                       + 'Run build_lib.sh there to build it')
+        return None
+
+    try:
+        lib = ctypes.CDLL(lib_file)
+    except OSError:
+        logger.warning(f'Failed to load the C++ rollout library {lib_file}; falling back to Python rollouts',
+                       exc_info=True)
+        return None
+
+    try:
+        _bind(lib)
+    except AttributeError:
+        # Built from an older rollout.cpp, missing some of the functions
+        logger.warning(f'C++ rollout library {lib_file} is out of date; falling back to Python rollouts. '
+                       + f'Run build_lib.sh in {LIB_DIR} to rebuild it', exc_info=True)
+        return None
+
+    logger.debug(f'Loaded C++ rollout library {lib_file}')
+
+    return lib
+
+def _bind(lib):
+    lib.rollout.restype = ctypes.c_int
+    lib.rollout.argtypes = [ctypes.c_char_p]
+    lib.rollout_capped.restype = ctypes.c_double
+    lib.rollout_capped.argtypes = [ctypes.c_char_p, ctypes.c_int, ctypes.c_int]
+    lib.rollout_batch.restype = None
+    lib.rollout_batch.argtypes = [
+        ctypes.POINTER(ctypes.c_char_p),
+        ctypes.c_int,
+        ctypes.c_int,
+        ctypes.c_int,
+        ctypes.c_int,
+        ctypes.c_int,
+        np.ctypeslib.ndpointer(dtype=np.float64, ndim=2, flags='C_CONTIGUOUS')
+    ]
+    lib.seed_rollout.restype = None
+    lib.seed_rollout.argtypes = [ctypes.c_uint]
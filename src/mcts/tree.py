@@ -1,38 +1,345 @@
 import chess
 import numpy as np
+from .zobrist import zobrist_key, push_with_key
+from collections import OrderedDict
+from utils import LRUCache
 import logging
 
 logger = logging.getLogger(__name__)
 
 INLINE_UCB = True
+MAX_TABLE_ENTRIES = 200000 # Default entry budget of the transposition table
+COMPACT_RATIO = 2 # Arenas are compacted once they hold this many nodes per table entry of budget
+UNMATERIALIZED = -1 # Child id of edges whose child node hasn't been created yet
+
+def encode_move(move):
+    '''
+        Packs a chess.Move into 15 bits: from square, to square and promotion piece type.
+    '''
+    return move.from_square | move.to_square << 6 | (move.promotion or 0) << 12
+
+def decode_move(code):
+    code = int(code)
+    return chess.Move(code & 63, code >> 6 & 63, code >> 12 or None)
+
+class TranspositionTable(LRUCache):
+    '''
+        Bounded index from positions to node ids so that node statistics are reused
+        when multiple paths lead to the same state (as the graph is a DAG, not a
+        directed tree).
+
+        Once more than max_entries positions are indexed, the least recently visited
+        entries are evicted, skipping protected ones (e.g. the path from the root
+        currently being expanded). Evicted nodes stay in the tree, without being
+        shared with new transpositions, until their arena is compacted.
+    '''
+    def __init__(self, max_entries=MAX_TABLE_ENTRIES):
+        super().__init__(max_entries)
+
+    def remap(self, new_ids):
+        '''
+            Replaces the node ids of the entries once their arena was compacted, given
+            the dict from old to new ids. Entries of freed nodes are dropped.
+        '''
+        self.entries = OrderedDict(
+            (key, new_ids[node_id]) for key, node_id in self.entries.items() if node_id in new_ids
+        )
 
-class TreeNode:
-    def __init__(self, fen, fen_to_node, is_rollout=False):
+class NodeArena:
+    '''
+        Struct-of-arrays storage for the nodes and edges of an MCTS tree.
+
+        Nodes and edges are addressed by integer ids indexing into preallocated
+        NumPy arrays which double in size when full. The out edges of a node are
+        stored contiguously, starting at node_edge_start. TreeNode and TreeEdge are
+        thin views over an arena and an id.
+
+        Expanding a node only stores the moves and priors of its edges. The child of
+        an edge (UNMATERIALIZED until then) is only created, or looked up in the
+        transposition table, the first time the edge is selected.
+
+        Nodes are identified by the Zobrist keys of their positions. Boards and FENs
+        are only built on demand by replaying the moves from the root, node 0, along
+        the edges through which each node was first reached.
+
+        Storage is only reclaimed by compacting the arena, which keeps the nodes still
+        indexed by the transposition table, so the table's budget also bounds the arena.
+    '''
+    def __init__(self, root_board, max_table_entries=MAX_TABLE_ENTRIES, node_capacity=1024,
+                 edge_capacity=32768):
+        self.table = TranspositionTable(max_table_entries) # Indexes nodes by key
+        self.root_fen = root_board.fen()
+
+        self.n_nodes = 0
+        self.node_outcomes = {} # Only terminal nodes have an outcome
+        self.node_keys = np.zeros(node_capacity, dtype=np.uint64)
+        self.node_parent_edges = np.zeros(node_capacity, dtype=np.int32) # -1 for the root
+        self.node_visits = np.zeros(node_capacity, dtype=np.int32)
+        self.node_scores = np.zeros(node_capacity, dtype=np.float32)
+        self.node_edge_starts = np.zeros(node_capacity, dtype=np.int32)
+        self.node_n_edges = np.zeros(node_capacity, dtype=np.int32) # 0 until expanded
+        self.node_is_rollout = np.zeros(node_capacity, dtype=bool)
+        self.node_expanded_in_rollout = np.zeros(node_capacity, dtype=bool) # Children are rollout nodes
+
+        self.n_edges = 0
+        self.edge_priors = np.zeros(edge_capacity, dtype=np.float32)
+        self.edge_visits = np.zeros(edge_capacity, dtype=np.int32)
+        self.edge_scores = np.zeros(edge_capacity, dtype=np.float32)
+        self.edge_parents = np.zeros(edge_capacity, dtype=np.int32)
+        self.edge_children = np.zeros(edge_capacity, dtype=np.int32)
+        self.edge_moves = np.zeros(edge_capacity, dtype=np.uint16)
+
+        self.add_node(zobrist_key(root_board), root_board.outcome())
+
+    @property
+    def root(self):
+        return TreeNode(self, 0)
+
+    def add_node(self, key, outcome, parent_edge=-1, is_rollout=False):
         '''
-            fen_to_node is a dictionary mapping FENs to TreeNodes so that
-            we can reuse TreeNode statistics if multiple paths lead to the same
-            TreeNode state (as the graph is a DAG, not a directed tree).
+            Adds a node for the position with Zobrist key key, reached through
+            parent_edge. Returns the node's id.
 
-            If is_rollout, that means this node was created during a rollout and
-            shouldn't be added to the fen index (as it is temporary). All expanded
-            children will also have is_rollout set to true and not be added to the dict.
+            If is_rollout, the node was created during a rollout and won't be added
+            to the transposition table (as it is temporary).
         '''
-        self.fen = fen
-        self.out_edges = []
-        self.outcome = chess.Board(self.fen).outcome()
+        if self.n_nodes == len(self.node_visits):
+            self._grow_nodes()
+
+        node_id = self.n_nodes
+        self.n_nodes += 1
+
+        if outcome is not None:
+            self.node_outcomes[node_id] = outcome
+
+        self.node_keys[node_id] = key
+        self.node_parent_edges[node_id] = parent_edge
+        self.node_visits[node_id] = 0
+        self.node_scores[node_id] = 0
+        self.node_n_edges[node_id] = 0
+        self.node_is_rollout[node_id] = is_rollout
+        self.node_expanded_in_rollout[node_id] = False
+
+        # Add to the node index if not created from a rollout
+        if not is_rollout:
+            self.table.put(key, node_id)
+
+        return node_id
+
+    def get_board(self, node_id):
+        '''
+            Returns the board of node_id with the moves from the root on its move stack.
+        '''
+        moves = []
+        parent_edge = self.node_parent_edges[node_id]
+        while parent_edge >= 0:
+            moves.append(decode_move(self.edge_moves[parent_edge]))
+            parent_edge = self.node_parent_edges[self.edge_parents[parent_edge]]
+
+        board = chess.Board(self.root_fen)
+        for move in reversed(moves):
+            board.push(move)
+
+        return board
+
+    def get_child(self, edge_id, board):
+        '''
+            Returns the id of the child of edge_id, creating the child node (or reusing
+            a transposition) if this is the first time the edge is followed.
+
+            board must be the board of the edge's parent; the edge's move is pushed onto it.
+        '''
+        move = decode_move(self.edge_moves[edge_id])
+        child_id = int(self.edge_children[edge_id])
+        if child_id != UNMATERIALIZED:
+            board.push(move)
+            return child_id
+
+        parent_id = self.edge_parents[edge_id]
+        child_key = push_with_key(board, int(self.node_keys[parent_id]), move)
+
+        # Reuse the node of a transposition unless we're in a rollout
+        is_rollout = bool(self.node_expanded_in_rollout[parent_id])
+        child_id = None if is_rollout else self.table.get(child_key)
+        if child_id is None:
+            child_id = self.add_node(child_key, board.outcome(), parent_edge=edge_id, is_rollout=is_rollout)
+
+        self.edge_children[edge_id] = child_id
+
+        return child_id
+
+    def add_edges(self, node_id, moves, priors):
+        '''
+            Stores the out edges of node_id contiguously, with unmaterialized children.
+        '''
+        n_edges = len(moves)
+        while self.n_edges + n_edges > len(self.edge_visits):
+            self._grow_edges()
+
+        start = self.n_edges
+        end = start + n_edges
+        self.n_edges = end
+
+        self.edge_priors[start:end] = priors
+        self.edge_visits[start:end] = 0
+        self.edge_scores[start:end] = 0
+        self.edge_parents[start:end] = node_id
+        self.edge_children[start:end] = UNMATERIALIZED
+        self.edge_moves[start:end] = moves
+
+        self.node_edge_starts[node_id] = start
+        self.node_n_edges[node_id] = n_edges
+
+    def compact(self, node_id=0):
+        '''
+            Frees the nodes and edges which aren't reachable from node_id, which becomes
+            the root (node 0), e.g. to reuse the subtree of the move played without
+            keeping the rest of the previous tree. Boards are then rebuilt from the
+            position of node_id rather than from the old root.
+
+            Nodes evicted from the transposition table are freed too, along with the
+            nodes only reachable through them. The edges to them keep their statistics
+            but become unmaterialized, so the child is created again if followed.
+
+            Ids change, so views of any node but the new root, and of edges, are invalid
+            afterwards. Must not be called while a trial is in progress.
+        '''
+        board = self.get_board(node_id)
+
+        # Breadth first, so that each node is first reached through an edge that is kept
+        node_ids = [node_id]
+        new_ids = {node_id: 0}
+        parent_edges = [-1] # Old id of the edge through which each node is first reached
+        for parent_id in node_ids: # Grows while iterating
+            start = self.node_edge_starts[parent_id]
+            children = self.edge_children[start:start+self.node_n_edges[parent_id]]
+            for edge_ind in np.flatnonzero(children != UNMATERIALIZED):
+                child_id = int(children[edge_ind])
+                if child_id not in new_ids and self.table.peek(int(self.node_keys[child_id])) == child_id:
+                    new_ids[child_id] = len(node_ids)
+                    node_ids.append(child_id)
+                    parent_edges.append(start + edge_ind)
+
+        node_ids = np.array(node_ids)
+        n_edges = self.node_n_edges[node_ids]
+        edge_ids = np.concatenate([
+            np.arange(start, start + n) for start, n in zip(self.node_edge_starts[node_ids], n_edges)
+        ])
+
+        node_map = np.full(self.n_nodes, UNMATERIALIZED, dtype=np.int32)
+        node_map[node_ids] = np.arange(len(node_ids))
+        edge_map = np.full(self.n_edges, -1, dtype=np.int32)
+        edge_map[edge_ids] = np.arange(len(edge_ids))
+
+        children = self.edge_children[edge_ids]
+        children = np.where(children == UNMATERIALIZED, UNMATERIALIZED, node_map[children])
+        self.edge_children = _with_room(children.astype(np.int32))
+        self.edge_parents = _with_room(node_map[self.edge_parents[edge_ids]])
+        for name in ['edge_priors', 'edge_visits', 'edge_scores', 'edge_moves']:
+            setattr(self, name, _with_room(getattr(self, name)[edge_ids]))
+
+        parent_edges = np.array(parent_edges)
+        parent_edges = np.where(parent_edges < 0, -1, edge_map[parent_edges])
+        self.node_parent_edges = _with_room(parent_edges.astype(np.int32))
+        self.node_edge_starts = _with_room((np.cumsum(n_edges) - n_edges).astype(np.int32))
+        for name in ['node_keys', 'node_visits', 'node_scores', 'node_n_edges', 'node_is_rollout',
+                     'node_expanded_in_rollout']:
+            setattr(self, name, _with_room(getattr(self, name)[node_ids]))
+
+        self.node_outcomes = {new_ids[old_id]: outcome for old_id, outcome in self.node_outcomes.items()
+                              if old_id in new_ids}
+        self.table.remap(new_ids)
+
+        self.root_fen = board.fen()
+        self.n_nodes = len(node_ids)
+        self.n_edges = len(edge_ids)
+
+    def is_over_budget(self):
+        '''
+            Returns whether enough nodes were evicted from the transposition table,
+            or became unreachable, for the arena to be worth compacting.
+        '''
+        return self.n_nodes > COMPACT_RATIO * max(self.table.max_entries, 1)
+
+    def _grow_nodes(self):
+        for name in ['node_keys', 'node_parent_edges', 'node_visits', 'node_scores', 'node_edge_starts',
+                     'node_n_edges', 'node_is_rollout', 'node_expanded_in_rollout']:
+            setattr(self, name, _doubled(getattr(self, name)))
 
-        # Add self to node index if not created from a rollout
-        # Uses too much memory when saving the subtree from turn to turn
-        # if not is_rollout:
-        #     fen_to_node[fen] = self
-        self.is_rollout = is_rollout
-        self.fen_to_node = fen_to_node
+    def _grow_edges(self):
+        for name in ['edge_priors', 'edge_visits', 'edge_scores', 'edge_parents', 'edge_children', 'edge_moves']:
+            setattr(self, name, _doubled(getattr(self, name)))
 
-        # Not technically needed but nice to compute state value
-        self.n_visits = 0
-        self.score = 0
+def _with_room(array):
+    # Leaves as much room to grow as is used
+    grown = np.zeros(max(2 * len(array), 1), dtype=array.dtype)
+    grown[:len(array)] = array
 
-        # Inline UCB computations
+    return grown
+
+def _doubled(array):
+    grown = np.zeros(2 * len(array), dtype=array.dtype)
+    grown[:len(array)] = array
+
+    return grown
+
+class TreeNode:
+    '''
+        View of a node stored in a NodeArena.
+    '''
+    def __init__(self, arena, node_id):
+        self.arena = arena
+        self.node_id = node_id
+
+    @property
+    def key(self):
+        return int(self.arena.node_keys[self.node_id])
+
+    @property
+    def fen(self):
+        # Built on demand; avoid in the search loop
+        return self.board().fen()
+
+    def board(self):
+        return self.arena.get_board(self.node_id)
+
+    @property
+    def outcome(self):
+        return self.arena.node_outcomes.get(self.node_id)
+
+    @property
+    def is_rollout(self):
+        return bool(self.arena.node_is_rollout[self.node_id])
+
+    @property
+    def n_visits(self):
+        return int(self.arena.node_visits[self.node_id])
+
+    @property
+    def score(self):
+        return float(self.arena.node_scores[self.node_id])
+
+    @property
+    def out_edges(self):
+        start, end = self._edge_range()
+        return [TreeEdge(self.arena, edge_id) for edge_id in range(start, end)]
+
+    # Inline UCB arrays; these are views into the arena and become stale if it grows
+    @property
+    def edge_priors(self):
+        return self.arena.edge_priors[slice(*self._edge_range())]
+
+    @property
+    def edge_visits(self):
+        return self.arena.edge_visits[slice(*self._edge_range())]
+
+    @property
+    def edge_scores(self):
+        return self.arena.edge_scores[slice(*self._edge_range())]
+
+    def _edge_range(self):
+        start = self.arena.node_edge_starts[self.node_id]
+        return start, start + self.arena.node_n_edges[self.node_id]
 
     def is_terminal(self):
         return self.outcome is not None
@@ -41,92 +348,78 @@ class TreeNode:
         return self.is_terminal() and self.is_leaf() \
                or not self.is_terminal() and not self.is_leaf()
 
-    def expand(self, prior_func=None, is_rollout=False):
+    def expand(self, prior_func=None, is_rollout=False, board=None):
         '''
-            prior_func should take a chess.Move prior probability of selecting
-            the move in the state given by this node.
+            prior_func should take the list of legal chess.Moves in the state given by
+            this node and return an array of their prior probabilities of being selected.
 
             If prior_func is None or is_rollout the prior will be set to zero (for faster
             evaluation during rollouts which don't compute the UCB).
 
-            If is_rollout, nodes created during the expansion won't be added to
-            the fen dictionary and no nodes will be retrieved from the fen dictionary
+            If is_rollout, the children of the node won't be added to the
+            transposition table and no nodes will be retrieved from it
             to prevent modification of the tree.
+
+            Only the moves and priors are stored; the children are materialized when
+            first selected. board is the board of this node. If None, it is rebuilt
+            from the root.
         '''
         assert not self.was_expanded()
 
         # If this node was created in a rollout, doesn't matter what the user inputs
         # for is_rollout; we're still in a rollout
         is_rollout = is_rollout or self.is_rollout
+        self.arena.node_expanded_in_rollout[self.node_id] = is_rollout
+
+        if board is None:
+            board = self.board()
+
+        legal_moves = list(board.legal_moves)
+        assert len(legal_moves) > 0
+
+        moves = [encode_move(move) for move in legal_moves]
 
         # No need to compute prior if in a rollout
         if prior_func is None or is_rollout:
-            prior_func = lambda m: 0
-
-        # For each action, create a child node
-        board = chess.Board(self.fen)
-        for i, move in enumerate(board.legal_moves):
-            # Compute the next state from the move
-            board.push(move)
-            child_fen = board.fen()
-
-            # If we're in a rollout,
-            # This is currently disabled as takes up too much memory when the subtree is saved
-            if not is_rollout and child_fen in self.fen_to_node:
-                child_state = self.fen_to_node[child_fen]
-            else:
-                child_state = TreeNode(child_fen, self.fen_to_node, is_rollout=is_rollout)
-
-            # Add an edge to the new state from this node
-            prior = prior_func(move)
-            out_edge = TreeEdge(
-                move.uci(),
-                prior,
-                self,
-                child_state,
-                update_callback=self._build_inline_callback(i) if INLINE_UCB else None
-            )
-            self.out_edges.append(out_edge)
-
-            board.pop() # Reset state to expand more moves
-
-        num_edges = len(self.out_edges)
-
-        # For inline UCB computation
-        if INLINE_UCB:
-            self.edge_priors = np.array([edge.prior for edge in self.out_edges])
-            self.edge_visits = np.zeros(num_edges)
-            self.edge_scores = np.zeros(num_edges)
-            self.ones = np.ones(num_edges) # Alternative for edge_visits when edge_visits == 0
+            priors = 0
+        else:
+            priors = prior_func(legal_moves)
 
-        assert num_edges > 0
+        self.arena.add_edges(self.node_id, moves, priors)
 
     def unexpand(self):
-        self.out_edges = []
+        # The edges' storage isn't reclaimed, but they are no longer reachable
+        self.arena.node_n_edges[self.node_id] = 0
 
     def is_leaf(self):
-        return self.out_edges == []
+        return self.arena.node_n_edges[self.node_id] == 0
 
     def backup_update(self, score):
-        self.score += score
-        self.n_visits += 1
+        self.arena.node_scores[self.node_id] += score
+        self.arena.node_visits[self.node_id] += 1
 
-    def _build_inline_callback(self, update_ind):
-        def callback(score):
-            self.edge_scores[update_ind] += score
-            self.edge_visits[update_ind] += 1
-
-        return callback
+    def merge_stats(self, n_visits, score, edge_visits, edge_scores):
+        '''
+            Adds statistics gathered by a separate search of this node, with edge_visits
+            and edge_scores aligned with out_edges.
+        '''
+        self.arena.node_visits[self.node_id] += n_visits
+        self.arena.node_scores[self.node_id] += score
+        self.edge_visits[:] += edge_visits
+        self.edge_scores[:] += edge_scores
 
-    def get_edge_to_explore(self, trials_so_far=None, std_ucb=False):
+    def get_edge_to_explore(self, trials_so_far=None, std_ucb=False, board=None):
         '''
             If trials_so_far is not None, uses the standard sqrt(ln(...))
             and multiplies it by the AlphaGo prior.
+
+            If board (the board of this node) is given, the selected edge's move is
+            pushed onto it and the edge's child is materialized.
         '''
         if self.is_terminal():
             return None
 
-        if self.out_edges == []:
+        if self.is_leaf():
             raise RuntimeError('This node has not yet been expanded')
 
         # Don't compute for log message unless necessary
@@ -135,60 +428,74 @@ class TreeNode:
             pass
 
         if INLINE_UCB:
-            qs = self.edge_scores / np.maximum(self.edge_visits, self.ones)
-            us = np.sqrt(self.ones + trials_so_far) / (self.ones + self.edge_visits)
+            start, end = self._edge_range()
+            visits = self.arena.edge_visits[start:end]
 
-            assert len(qs.shape) == 1
-            assert len(us.shape) == 1
+            qs = self.arena.edge_scores[start:end] / np.maximum(visits, 1)
+            us = np.sqrt(1 + trials_so_far) / (1 + visits)
 
-            best_ind = np.argmax(qs + TreeEdge.UCB_FACTOR * self.edge_priors * us)
-            best_edge = self.out_edges[best_ind]
+            best_ind = np.argmax(qs + TreeEdge.UCB_FACTOR * self.arena.edge_priors[start:end] * us)
+            best_edge = TreeEdge(self.arena, start + best_ind)
         else:
-            best_edge = self.out_edges[0]
+            out_edges = self.out_edges
+            best_edge = out_edges[0]
             best_ucb = best_edge.get_ucb(trials_so_far, std_ucb=std_ucb)
 
-            for edge in self.out_edges[1:]:
+            for edge in out_edges[1:]:
                 curr_ucb = edge.get_ucb(trials_so_far, std_ucb=std_ucb)
                 if curr_ucb > best_ucb:
                     best_edge = edge
                     best_ucb = curr_ucb
 
+        if board is not None:
+            self.arena.get_child(best_edge.edge_id, board)
+
         return best_edge
 
-    def get_random_edge(self):
+    def get_random_edge(self, board=None):
+        '''
+            board is handled as in get_edge_to_explore.
+        '''
         if self.is_terminal():
             return None
 
-        if self.out_edges == []:
+        if self.is_leaf():
             raise RuntimeError('This node has not yet been expanded')
 
-        rand_ind = int(np.random.rand() * len(self.out_edges))
-        return self.out_edges[rand_ind]
+        start, end = self._edge_range()
+        rand_ind = int(np.random.rand() * (end - start))
+        if board is not None:
+            self.arena.get_child(start + rand_ind, board)
+
+        return TreeEdge(self.arena, start + rand_ind)
 
     def get_best_move(self):
         if self.is_terminal():
             return None
 
-        if self.out_edges == []:
+        if self.is_leaf():
             raise RuntimeError('This node has not yet been expanded')
 
-        best_edge = self.out_edges[0]
-        best_q_val = best_edge.get_action_value()
+        # Action values of unvisited edges are zero, as are their scores
+        start, end = self._edge_range()
+        q_vals = self.arena.edge_scores[start:end] / np.maximum(self.arena.edge_visits[start:end], 1)
 
-        for edge in self.out_edges[1:]:
-            curr_q_val = edge.get_action_value()
-            if curr_q_val > best_q_val:
-                best_edge = edge
-                best_q_val = curr_q_val
-
-        return best_edge
+        return TreeEdge(self.arena, start + np.argmax(q_vals))
 
     def get_state_value(self):
         return self.score / self.n_visits if self.n_visits > 0 else 0
 
+    def __eq__(self, other):
+        return isinstance(other, TreeNode) and self.arena is other.arena \
+               and self.node_id == other.node_id
+
+    def __hash__(self):
+        return hash((id(self.arena), self.node_id))
+
     def __str__(self):
         return (
             f'FEN: {self.fen}\n'
+            + f'Key: {self.key:016x}\n'
             + f'Score: {self.score}\n'
             + f'Visits: {self.n_visits}\n'
             + f'State value: {self.get_state_value()}\n'
@@ -199,18 +506,47 @@ class TreeNode:
         return str(self)
 
 class TreeEdge:
+    '''
+        View of an edge stored in a NodeArena.
+    '''
     UCB_FACTOR = 10
+    VIRTUAL_LOSS = 1 # Score subtracted per pending descent through an edge
+
+    def __init__(self, arena, edge_id):
+        self.arena = arena
+        self.edge_id = int(edge_id)
+
+    @property
+    def move(self):
+        return decode_move(self.arena.edge_moves[self.edge_id])
+
+    @property
+    def uci(self):
+        return self.move.uci()
 
-    def __init__(self, uci, prior, from_node, to_node, update_callback=None):
-        self.uci = uci
-        self.prior = prior
-        self.score = 0
-        self.n_visits = 0
+    @property
+    def prior(self):
+        return float(self.arena.edge_priors[self.edge_id])
 
-        self.from_node = from_node
-        self.to_node = to_node
+    @property
+    def score(self):
+        return float(self.arena.edge_scores[self.edge_id])
 
-        self.update_callback = update_callback
+    @property
+    def n_visits(self):
+        return int(self.arena.edge_visits[self.edge_id])
+
+    @property
+    def from_node(self):
+        return TreeNode(self.arena, int(self.arena.edge_parents[self.edge_id]))
+
+    @property
+    def to_node(self):
+        child_id = int(self.arena.edge_children[self.edge_id])
+        if child_id == UNMATERIALIZED: # Rebuild the parent's board to create the child
+            child_id = self.arena.get_child(self.edge_id, self.from_node.board())
+
+        return TreeNode(self.arena, child_id)
 
     def get_ucb(self, trials_so_far, std_ucb=False):
         q = self.get_action_value()
@@ -225,15 +561,32 @@ class TreeEdge:
         return q + u
 
     def backup_update(self, score):
-        self.score += score
-        self.n_visits += 1
+        self._update(score, 1)
 
-        if self.update_callback is not None: # For inline UCB computation
-            self.update_callback(score)
+    def add_virtual_loss(self):
+        '''
+            Makes the edge look visited and lost so that other descents of the
+            same batch prefer different edges until the loss is reverted.
+        '''
+        self._update(-TreeEdge.VIRTUAL_LOSS, 1)
+
+    def revert_virtual_loss(self):
+        self._update(TreeEdge.VIRTUAL_LOSS, -1)
+
+    def _update(self, score, n_visits):
+        self.arena.edge_scores[self.edge_id] += score
+        self.arena.edge_visits[self.edge_id] += n_visits
 
     def get_action_value(self):
         return self.score / self.n_visits if self.n_visits > 0 else 0
 
+    def __eq__(self, other):
+        return isinstance(other, TreeEdge) and self.arena is other.arena \
+               and self.edge_id == other.edge_id
+
+    def __hash__(self):
+        return hash((id(self.arena), self.edge_id))
+
     def __str__(self):
         return (
             f'UCI: {self.uci}\n'
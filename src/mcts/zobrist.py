@@ -0,0 +1,100 @@
+import chess
+import chess.polyglot
+import numpy as np
+
+'''
+    64-bit Zobrist keys identifying positions in the MCTS tree.
+
+    Keys are the Polyglot hashes of python-chess with the halfmove clock mixed in.
+    Including the clock means a repeated position never gets the key of one of its
+    ancestors, so the transposition DAG stays acyclic, while transpositions reached
+    in the same number of moves still share a key.
+'''
+PIECE_KEYS = chess.polyglot.POLYGLOT_RANDOM_ARRAY[:768]
+CASTLING_KEYS = chess.polyglot.POLYGLOT_RANDOM_ARRAY[768:772]
+EP_KEYS = chess.polyglot.POLYGLOT_RANDOM_ARRAY[772:780]
+TURN_KEY = chess.polyglot.POLYGLOT_RANDOM_ARRAY[780]
+
+N_CLOCK_KEYS = 512
+CLOCK_KEYS = [
+    int(key) for key in
+    np.random.default_rng(0).integers(0, 2**64, size=N_CLOCK_KEYS, dtype=np.uint64)
+]
+
+def zobrist_key(board):
+    '''
+        Computes the key of board from scratch.
+    '''
+    return chess.polyglot.zobrist_hash(board) ^ _clock_key(board.halfmove_clock)
+
+def push_with_key(board, key, move):
+    '''
+        Pushes move onto board, returning the key of the new position given the key
+        of the position before the move. Only the squares, castling rights and en
+        passant file the move changes are rehashed.
+    '''
+    color = board.turn
+    piece_type = board.piece_type_at(move.from_square)
+    castling_rights = board.castling_rights
+
+    key ^= _ep_key(board) ^ _clock_key(board.halfmove_clock) ^ TURN_KEY
+    key ^= _piece_key(piece_type, color, move.from_square)
+
+    if board.is_castling(move):
+        if board.is_kingside_castling(move):
+            rook_from, rook_to = move.to_square + 1, move.to_square - 1
+        else:
+            rook_from, rook_to = move.to_square - 2, move.to_square + 1
+
+        key ^= _piece_key(chess.ROOK, color, rook_from) ^ _piece_key(chess.ROOK, color, rook_to)
+    elif board.is_en_passant(move):
+        captured_square = move.to_square - 8 if color == chess.WHITE else move.to_square + 8
+        key ^= _piece_key(chess.PAWN, not color, captured_square)
+    else:
+        captured_type = board.piece_type_at(move.to_square)
+        if captured_type is not None:
+            key ^= _piece_key(captured_type, not color, move.to_square)
+
+    key ^= _piece_key(move.promotion or piece_type, color, move.to_square)
+
+    castling_key = _castling_key(board) if board.castling_rights else 0
+    board.push(move)
+    if board.castling_rights != castling_rights:
+        key ^= castling_key ^ _castling_key(board)
+
+    return key ^ _ep_key(board) ^ _clock_key(board.halfmove_clock)
+
+def _piece_key(piece_type, color, square):
+    return PIECE_KEYS[64 * (2 * (piece_type - 1) + color) + square]
+
+def _castling_key(board):
+    key = 0
+    if board.has_kingside_castling_rights(chess.WHITE):
+        key ^= CASTLING_KEYS[0]
+    if board.has_queenside_castling_rights(chess.WHITE):
+        key ^= CASTLING_KEYS[1]
+    if board.has_kingside_castling_rights(chess.BLACK):
+        key ^= CASTLING_KEYS[2]
+    if board.has_queenside_castling_rights(chess.BLACK):
+        key ^= CASTLING_KEYS[3]
+
+    return key
+
+def _ep_key(board):
+    # Follows Polyglot in only hashing en passant files a pawn could capture on
+    if board.ep_square is None:
+        return 0
+
+    if board.turn == chess.WHITE:
+        ep_mask = chess.shift_down(chess.BB_SQUARES[board.ep_square])
+    else:
+        ep_mask = chess.shift_up(chess.BB_SQUARES[board.ep_square])
+    ep_mask = chess.shift_left(ep_mask) | chess.shift_right(ep_mask)
+
+    if ep_mask & board.pawns & board.occupied_co[board.turn]:
+        return EP_KEYS[chess.square_file(board.ep_square)]
+
+    return 0
+
+def _clock_key(halfmove_clock):
+    return CLOCK_KEYS[halfmove_clock % N_CLOCK_KEYS]
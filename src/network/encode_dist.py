@@ -1,8 +1,6 @@
-from .mask_policy import square_move_to_index
-from utils import square_to_n_n
+from .mask_policy import moves_to_flat_indices
 import chess
-import torch
-from torch.nn import functional as F
+import numpy as np
 
 class MCTSDist:
     '''
@@ -10,34 +8,30 @@ class MCTSDist:
         to be stored in the replay memory.
     '''
     def __init__(self, root, temp):
+        self.key = root.key # Zobrist key identifying the state
         self.fen = root.fen
         self.value = root.get_state_value()
         self.move_data = [MoveData(edge) for edge in root.out_edges]
         self.temp = temp
 
 class MCTSPolicyEncoder:
-    def get_mcts_policy(self, mcts_dist):
+    def get_sparse_mcts_policy(self, mcts_dist):
         '''
-            Takes the MCTSDist and converts it to a gold
-            distribution in the shape of the network's policy.
+            Takes the MCTSDist and converts it to a gold distribution over the network's
+            policy, as the indices into the flattened policy of its moves and their
+            probabilities.
         '''
-        policy = torch.zeros(8,8,73)
+        moves = [
+            chess.Move(move.from_square, move.to_square, move.promotion)
+            for move in mcts_dist.move_data
+        ]
+        scores = np.array([move.n_visits for move in mcts_dist.move_data], dtype=np.float64)
+        scores = scores ** (1 / mcts_dist.temp) # Original AlphaZero score
 
-        for move in mcts_dist.move_data:
-            row, col = square_to_n_n(move.from_square)
-            index = square_move_to_index(move.from_square, move.to_square, move.promotion)
-            # Since MCTS is very expensive on a single core machine, use softmax instead
-            # of hard probabilities which are frequently zero as n_visits are sparse
-            # score = move.n_visits
-            score = move.n_visits ** (1 / mcts_dist.temp) # Original AlphaZero score
+        indices = moves_to_flat_indices(moves).astype(np.int64)
+        probs = (scores / scores.sum()).astype(np.float32) # Original AlphaZero normalization
 
-            policy[row,col,index] = score
-
-        # policy = F.softmax(policy.flatten() / mcts_dist.temp, dim=0) # Softer distribution than original AlphaZero
-        # policy = policy.reshape(8,8,73)
-        policy /= policy.sum() # Original AlphaZero normalization
-
-        return policy
+        return indices, probs
 
 class MoveData:
     def __init__(self, tree_edge):
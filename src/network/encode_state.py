@@ -1,11 +1,49 @@
 import torch
-import chess
-from utils import square_to_n_n
+import numpy as np
+from collections import OrderedDict
+import threading
+from utils import LRUCache
 # Pages 12-15 of paper https://arxiv.org/pdf/1712.01815.pdf are most relevant
 N = 8 # Board dimensions
 M = 14 # 6 p1 pieces, 6 p2 pieces, 2 repetition counts
 L = 7
 
+PLANE_CACHE_ENTRIES = 50000 # Default number of positions whose piece planes are cached (768 bytes each)
+
+class PiecePlaneCache(LRUCache):
+    '''
+        Bounded LRU cache from position keys (e.g. Zobrist keys) to the piece planes
+        of the position, shared by the threads encoding states.
+    '''
+    def __init__(self, max_entries=PLANE_CACHE_ENTRIES):
+        super().__init__(max_entries)
+        self.lock = threading.Lock()
+
+    def __getstate__(self):
+        # Locks can't be pickled, e.g. when sending a GameRunner to a spawned actor,
+        # and the copy starts with an empty cache
+        state = self.__dict__.copy()
+        del state['lock']
+        state['entries'] = OrderedDict()
+
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            return super().get(key)
+
+    def put(self, key, planes):
+        with self.lock:
+            super().put(key, planes)
+
+    def get_stats(self):
+        with self.lock:
+            return super().get_stats()
+
 class StateEncoder:
     '''
         Dimensions N x N x (MT + L)
@@ -18,19 +56,158 @@ class StateEncoder:
 
         L: 1 player color, 1 total move count, 2 p1 castling, 2 p2 castling, 1 no-progress count
     '''
-    def __init__(self, T=2):
+    def __init__(self, T=2, plane_cache_entries=PLANE_CACHE_ENTRIES):
         self.T = T # Length of history
 
+        # Piece planes of recently encoded positions, by key, for encode_search_states
+        self.plane_cache = PiecePlaneCache(plane_cache_entries)
+
     def encode_state_with_history(self, boards):
         '''
             Returns a state encoding of the final board in boards with
             a history from the previous boards in the iterable of length T - 1.
         '''
-        curr_state = self.get_empty_state()
-        for board in boards:
-            curr_state = self.encode_state(board, curr_state)
+        return self.encode_states_with_history([list(boards)])[0]
+
+    def encode_states_with_history(self, board_histories, out=None):
+        '''
+            Batched version of encode_state_with_history, encoding the final board of each
+            list of boards in board_histories. Returns a float32 tensor of shape
+            (len(board_histories), M*T+L, N, N).
+
+            If out is given, the states are written into it instead of a new tensor.
+        '''
+        T = self.T
+        n_states = len(board_histories)
+        if out is None:
+            out = torch.empty(n_states, M*T+L, N, N)
+        assert out.shape == (n_states, M*T+L, N, N) and out.dtype == torch.float32
+
+        states = out.numpy()
+        states[...] = 0
+
+        # Collect the boards of every state's history to encode all their pieces at once
+        state_inds, time_inds, boards = [], [], []
+        for i, history in enumerate(board_histories):
+            history = history[-T:] # Older boards fall out of the history
+            for t, board in enumerate(history, start=T-len(history)):
+                state_inds.append(i)
+                time_inds.append(t)
+                boards.append(board)
+
+        if boards:
+            history_planes = states[:, :M*T].reshape(n_states, T, M, N, N)
+            history_planes[state_inds, time_inds, :12] = self.encode_pieces(boards)
+
+        final_boards = [history[-1] for history in board_histories]
+        states[:, M*T:M*T+6] = self.encode_features(final_boards)[:, :, None, None]
+
+        return out
+
+    def encode_search_states(self, boards, key_paths, prefix_boards=(), prefix_keys=(), out=None):
+        '''
+            Encodes the states of boards reached by a search, like encode_states_with_history.
 
-        return curr_state
+            The move stack of each board holds the moves from the root of the search, and
+            key_paths holds the keys of the positions from the root up to and including each
+            board. The history of a state is made of the positions along the move stack,
+            preceded by the positions before the root, prefix_boards, with keys prefix_keys.
+
+            The piece planes of each position are cached by key, so a state is built by
+            copying the cached planes of its history and only encoding the positions not
+            seen before (usually just the board itself). As the boards' move stacks start
+            at the root, the move count plane is left at 0, as for boards built from FENs.
+        '''
+        T = self.T
+        n_states = len(boards)
+        if out is None:
+            out = torch.empty(n_states, M*T+L, N, N)
+        assert out.shape == (n_states, M*T+L, N, N) and out.dtype == torch.float32
+
+        states = out.numpy()
+        states[...] = 0
+        history_planes = states[:, :M*T].reshape(n_states, T, M, N, N)
+
+        misses = OrderedDict() # Key -> (position to encode, (state, time) indices of its planes)
+        for i, (board, keys) in enumerate(zip(boards, key_paths)):
+            history_keys = (list(prefix_keys) + list(keys))[-T:]
+            search_board = None # Copy of board popped back to earlier positions of the path
+
+            # Go back from the newest position so that search_board only needs popping
+            for n_back, key in enumerate(reversed(history_keys)):
+                t = T - 1 - n_back
+                if key in misses:
+                    misses[key][1].append((i, t))
+                    continue
+
+                planes = self.plane_cache.get(key)
+                if planes is not None:
+                    history_planes[i, t, :12] = planes
+                    continue
+
+                if n_back >= len(keys): # Before the root
+                    position = prefix_boards[len(prefix_boards) - 1 - (n_back - len(keys))]
+                elif n_back == 0:
+                    position = board
+                else:
+                    if search_board is None:
+                        search_board = board.copy()
+                    while len(board.move_stack) - len(search_board.move_stack) < n_back:
+                        search_board.pop()
+                    position = search_board.copy(stack=False)
+
+                misses[key] = (position, [(i, t)])
+
+        if misses:
+            all_planes = self.encode_pieces([position for position, _ in misses.values()])
+            for (key, (_, destinations)), planes in zip(misses.items(), all_planes):
+                planes = np.ascontiguousarray(planes) # Don't keep the whole batch alive
+                self.plane_cache.put(key, planes)
+
+                for i, t in destinations:
+                    history_planes[i, t, :12] = planes
+
+        states[:, M*T:M*T+6] = self.encode_features(boards, count_moves=False)[:, :, None, None]
+
+        return out
+
+    def encode_pieces(self, boards):
+        '''
+            Returns a (len(boards), 12, N, N) array of the piece planes of each board,
+            unpacked from its bitboards.
+        '''
+        # Piece type masks of all boards, ordered as chess.PIECE_TYPES, and color masks
+        # of the player and opponent
+        type_masks = np.array([
+            [board.pawns, board.knights, board.bishops, board.rooks, board.queens, board.kings]
+            for board in boards
+        ], dtype='<u8')
+        color_masks = np.array([
+            [board.occupied_co[board.turn], board.occupied_co[not board.turn]] for board in boards
+        ], dtype='<u8')
+        masks = color_masks[:, :, None] & type_masks[:, None, :] # Same as board.pieces_mask
+
+        # Bit i of a mask is square i, from a1 to h8; flip the ranks to put a8 at (0, 0)
+        bits = np.unpackbits(masks.view(np.uint8), bitorder='little')
+        return bits.reshape(len(boards), 12, N, N)[:, :, ::-1, :]
+
+    def encode_features(self, boards, count_moves=True):
+        '''
+            Returns a (len(boards), 6) array of the player color, total move count and
+            player and opponent castling rights of each board, the first 6 of the L planes.
+            If not count_moves, the move count is 0.
+        '''
+        return np.array([
+            [
+                board.turn,
+                len(board.move_stack) if count_moves else 0,
+                board.has_queenside_castling_rights(board.turn),
+                board.has_kingside_castling_rights(board.turn),
+                board.has_queenside_castling_rights(not board.turn),
+                board.has_kingside_castling_rights(not board.turn)
+            ]
+            for board in boards
+        ], dtype=np.float32).reshape(len(boards), 6)
 
     def piece_to_index(self, piece, board):
         '''
@@ -52,26 +229,12 @@ class StateEncoder:
 
         # Encode pieces
         t_offset = M*(T-1)
-        for square, piece in board.piece_map().items():
-            piece_ind = self.piece_to_index(piece, board)
-            row, col = square_to_n_n(square)
-            state[t_offset + piece_ind, row, col] = 1
+        state[t_offset:t_offset+12] = torch.from_numpy(self.encode_pieces([board])[0].copy())
 
         # TODO Potentially encode repeat count for both players
 
-        # Encode current player color
-        state[M*T, ...] += board.turn
-
-        # Encode total move count
-        state[M*T + 1, ...] += len(board.move_stack)
-
-        # Encode player castling
-        state[M*T + 2, ...] += board.has_queenside_castling_rights(board.turn)
-        state[M*T + 3, ...] += board.has_kingside_castling_rights(board.turn)
-
-        # Encode opponent castling
-        state[M*T + 4, ...] += board.has_queenside_castling_rights(not board.turn)
-        state[M*T + 5, ...] += board.has_kingside_castling_rights(not board.turn)
+        # Encode current player color, total move count and player and opponent castling
+        state[M*T:M*T+6] = torch.from_numpy(self.encode_features([board])[0])[:, None, None]
 
         # TODO Potentially encode progress count
 
@@ -1,6 +1,7 @@
 from .encode_dist import MCTSPolicyEncoder
 from .encode_state import StateEncoder
 import chess
+import numpy as np
 import torch.nn.functional as F
 import torch
 
@@ -22,34 +23,31 @@ class MCTSLoss:
             is for input to the neural network, with the final MCTSDist representing
             the final state in which the move probabilities were computed by MCTS.
         '''
-        # Compute network outputs
-        encodings = [
-            self._build_final_state_encoding(mcts_dists)
-            for mcts_dists in mcts_dist_histories
-        ]
-        encodings = torch.stack(encodings, dim=0).to(self.device)
-        net_vals, net_log_probs = network(encodings)
+        examples = [torch.from_numpy(array) for array in self.encode_examples(mcts_dist_histories)]
 
-        # Compute mcts outputs
-        mcts_vals = []
-        mcts_policies = []
-        for mcts_dists in mcts_dist_histories:
-            # Compute MCTS value, outputs for state
-            final_state = mcts_dists[-1]
-            mcts_val = final_state.value
-            mcts_policy = self.mcts_policy_encoder.get_mcts_policy(final_state)
+        return self.get_batch_loss(network, *examples)
 
-            mcts_vals.append(mcts_val)
-            mcts_policies.append(mcts_policy)
+    def get_batch_loss(self, network, states, policy_indices, policy_probs, mcts_vals):
+        '''
+            Computes the loss of network on a batch of training examples as returned
+            by encode_examples (or sampled from a ReplayMemory).
+
+            The MCTS policies are sparse, so the cross-entropy only gathers the network's
+            log-probabilities of the moves in them rather than using the whole policy.
+        '''
+        net_vals, net_log_probs = network(states.to(self.device, dtype=torch.float32, non_blocking=True))
 
-        mcts_vals = torch.tensor(mcts_vals).reshape(-1, 1).to(self.device)
-        mcts_policies = torch.stack(mcts_policies, dim=0).to(self.device)
+        mcts_vals = mcts_vals.reshape(-1, 1).to(self.device, non_blocking=True)
+        policy_indices = policy_indices.to(self.device, dtype=torch.int64, non_blocking=True)
+        policy_probs = policy_probs.to(self.device, non_blocking=True)
 
         assert mcts_vals.shape == net_vals.shape
-        assert mcts_policies.shape == net_log_probs.shape
+        assert policy_indices.shape == policy_probs.shape and len(policy_indices) == len(net_log_probs)
 
         mse = F.mse_loss(net_vals, mcts_vals)
-        ce = -(mcts_policies * net_log_probs).sum() / len(mcts_dist_histories)
+        # Padding entries have probability 0 so don't contribute
+        move_log_probs = net_log_probs.flatten(1).gather(1, policy_indices)
+        ce = -(policy_probs * move_log_probs).sum() / len(states)
 
         assert not torch.isnan(mse).any() and not torch.isinf(mse).any()
         assert not torch.isnan(ce).any() and not torch.isinf(ce).any()
@@ -58,10 +56,41 @@ class MCTSLoss:
 
         return mse + ce
 
-    def _build_final_state_encoding(self, mcts_dists):
+    def encode_examples(self, mcts_dist_histories):
         '''
-            Builds the final state encoding from a list of MCTSDists representing
-            a series of states.
+            Encodes the final state of each list of MCTSDists in mcts_dist_histories
+            (see get_loss) into training arrays, returning:
+            - the network input states, as uint8 as all their planes are 0 or 1 (the
+              boards are rebuilt from FENs, so the move count plane is 0)
+            - the MCTS policy targets, as sparse indices and probabilities (see
+              MCTSPolicyEncoder.get_sparse_mcts_policy) padded with index 0 and
+              probability 0 to the longest policy
+            - the MCTS state values
         '''
-        boards = (chess.Board(mcts_dist.fen) for mcts_dist in mcts_dists)
-        return self.state_encoder.encode_state_with_history(boards)
+        # Histories overlap, so only build each state's board once
+        boards = {}
+        for mcts_dists in mcts_dist_histories:
+            for mcts_dist in mcts_dists:
+                if mcts_dist.fen not in boards:
+                    boards[mcts_dist.fen] = chess.Board(mcts_dist.fen)
+
+        states = self.state_encoder.encode_states_with_history([
+            [boards[mcts_dist.fen] for mcts_dist in mcts_dists]
+            for mcts_dists in mcts_dist_histories
+        ])
+        assert states.max() <= 1
+        states = states.numpy().astype(np.uint8)
+
+        final_states = [mcts_dists[-1] for mcts_dists in mcts_dist_histories]
+        sparse_policies = [
+            self.mcts_policy_encoder.get_sparse_mcts_policy(final_state) for final_state in final_states
+        ]
+        policy_width = max(len(indices) for indices, _ in sparse_policies)
+        policy_indices = np.zeros((len(final_states), policy_width), dtype=np.int64)
+        policy_probs = np.zeros((len(final_states), policy_width), dtype=np.float32)
+        for i, (indices, probs) in enumerate(sparse_policies):
+            policy_indices[i, :len(indices)] = indices
+            policy_probs[i, :len(probs)] = probs
+        mcts_vals = np.array([final_state.value for final_state in final_states], dtype=np.float32)
+
+        return states, policy_indices, policy_probs, mcts_vals
@@ -1,7 +1,8 @@
 import chess
+import numpy as np
 import torch
 import constants as consts
-from utils import n_n_to_square
+from utils import n_n_to_square, square_to_n_n
 r'''
     Policy represented by 8x8x73
     8x8: which square to pick up a piece from
@@ -122,7 +123,57 @@ def square_move_to_index(from_square, to_square, promotion=None):
     else:
         raise RuntimeError('The promotion target is invalid')
 
-def mask_position(row, col, policy, legal_move_dict, device):
+POLICY_SHAPE = (8, 8, 73)
+POLICY_SIZE = 8 * 8 * 73
+
+def build_move_index_table():
+    '''
+        Precomputes the index into the flattened 8x8x73 policy of every move whose
+        from and to squares lie on a line or a knight jump apart, as an array indexed
+        by [from_square, to_square, promotion or 0]. Other entries are -1.
+    '''
+    table = np.full((64, 64, chess.QUEEN + 1), -1, dtype=np.int64)
+
+    for from_square in chess.SQUARES:
+        row, col = square_to_n_n(from_square)
+        for to_square in chess.SQUARES:
+            rank_diff = chess.square_rank(to_square) - chess.square_rank(from_square)
+            file_diff = chess.square_file(to_square) - chess.square_file(from_square)
+
+            is_line = rank_diff == 0 or file_diff == 0 or abs(rank_diff) == abs(file_diff)
+            is_knight = sorted([abs(rank_diff), abs(file_diff)]) == [1, 2]
+            if from_square == to_square or not (is_line or is_knight):
+                continue
+
+            # Promotions are one step forward or diagonally forward
+            promotions = [None]
+            if abs(rank_diff) == 1 and abs(file_diff) <= 1:
+                promotions += [chess.KNIGHT, chess.BISHOP, chess.ROOK, chess.QUEEN]
+
+            for promotion in promotions:
+                index = square_move_to_index(from_square, to_square, promotion)
+                table[from_square, to_square, promotion or 0] = (row * 8 + col) * 73 + index
+
+    return table
+
+MOVE_INDEX_TABLE = build_move_index_table()
+
+def move_to_flat_index(move):
+    '''
+        Returns the index of move into the flattened 8x8x73 policy.
+    '''
+    return MOVE_INDEX_TABLE[move.from_square, move.to_square, move.promotion or 0]
+
+def moves_to_flat_indices(moves):
+    '''
+        Returns an array of the indices of moves into the flattened 8x8x73 policy.
+    '''
+    squares = np.array([(move.from_square, move.to_square, move.promotion or 0) for move in moves],
+                       dtype=np.int64).reshape(-1, 3)
+
+    return MOVE_INDEX_TABLE[squares[:, 0], squares[:, 1], squares[:, 2]]
+
+def mask_position(row, col, policy, legal_move_dict, device='cpu'):
     mask = torch.zeros(73).to(device)
 
     from_square = n_n_to_square(row, col)
@@ -137,10 +188,30 @@ def mask_position(row, col, policy, legal_move_dict, device):
     policy[row,col,:] *= mask
 
 def mask_invalid_moves(policy, board, device='cpu'):
-    legal_move_dict = build_legal_move_dict(board)
+    '''
+        Zeroes the probabilities of the illegal moves of board in the 8x8x73 policy
+        (in place) and renormalizes it.
+    '''
+    indices = torch.from_numpy(moves_to_flat_indices(board.legal_moves)).to(device)
 
-    for row in range(policy.shape[0]):
-        for col in range(policy.shape[1]):
-            mask_position(row, col, policy, legal_move_dict, device)
+    # Gather the legal probabilities and scatter them back into a zeroed policy
+    flat_policy = policy.view(-1)
+    legal_probs = flat_policy[indices]
+    flat_policy.zero_()
+    flat_policy[indices] = legal_probs
 
     policy /= policy.sum() # Renormalize to 1
+
+def mask_invalid_moves_batch(policies, boards, device='cpu'):
+    '''
+        Batched version of mask_invalid_moves for a Bx8x8x73 tensor of the
+        policies of the B boards.
+    '''
+    indices = [moves_to_flat_indices(board.legal_moves) for board in boards]
+    batch_indices = np.repeat(np.arange(len(boards)), [len(board_indices) for board_indices in indices])
+
+    mask = torch.zeros(len(boards), POLICY_SIZE, dtype=torch.bool, device=device)
+    mask[torch.from_numpy(batch_indices).to(device), torch.from_numpy(np.concatenate(indices)).to(device)] = True
+
+    policies *= mask.view(policies.shape)
+    policies /= policies.sum(dim=(1, 2, 3), keepdim=True) # Renormalize each to 1
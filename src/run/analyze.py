@@ -1,11 +1,11 @@
-from network.mask_policy import mask_invalid_moves, square_move_to_index
+from network.mask_policy import mask_invalid_moves, moves_to_flat_indices
 from network.encode_state import StateEncoder
 from network.sample_policy import move_from_indices, from_flattened_index
 from mcts.mcts import MCTSEvaluator
 import torch
 from torch.nn import functional as F
 import chess
-from utils import square_to_n_n
+from utils import get_board_history
 
 def top_net_moves(fen, network, T=8, temp=2, k=5, device='cpu'):
     # Get the network's output policy
@@ -29,37 +29,38 @@ def top_net_moves(fen, network, T=8, temp=2, k=5, device='cpu'):
     return val, list(zip(top_ucis, top_probs))
 
 def top_mcts_moves(fen, network, T=8, temp=2, k=5, device='cpu',
-                   max_trials=1000, max_time_s=10):
+                   max_trials=1000, max_time_s=10, num_processes=1):
     # Build inputs for MCTS
     state_encoder = StateEncoder(T)
 
     # Modified from GameRunner
-    def prior_func_builder(fens):
+    def prior_func_builder(board, keys):
         '''
-            fens is a list of FEN strings detailing the path from the root
-            of the MCTS tree up to and INCLUDING the current state from which
-            a move will be selected.
+            board is the chess.Board of the current state from which a move will be
+            selected, with the moves from the root of the MCTS tree on its move stack.
+            keys are the Zobrist keys of the states from the root up to and INCLUDING
+            the current state.
         '''
         # Build the network's masked policy
-        boards = (chess.Board(fen) for fen in fens[-network.T:])
+        boards = get_board_history(board, network.T)
         curr_state = state_encoder.encode_state_with_history(boards)
         with torch.no_grad():
             curr_state = curr_state.unsqueeze(0).to(device)
             _, net_log_probs = network(curr_state)
 
         net_policy = net_log_probs.exp().squeeze()
-        mask_invalid_moves(net_policy, chess.Board(fens[-1]), device=device)
+        mask_invalid_moves(net_policy, board, device=device)
+        flat_policy = net_policy.flatten().cpu().numpy()
 
-        def prior_func(move):
-            row, col = square_to_n_n(move.from_square)
-            index = square_move_to_index(move.from_square, move.to_square, move.promotion)
-            return net_policy[row, col, index]
+        def prior_func(moves):
+            return flat_policy[moves_to_flat_indices(moves)]
 
         return prior_func
 
     # Run MCTS
     mcts_evaluator = MCTSEvaluator(fen, prior_func_builder)
-    root = mcts_evaluator.mcts(max_trials=max_trials, max_time_s=max_time_s)
+    root = mcts_evaluator.mcts(max_trials=max_trials, max_time_s=max_time_s,
+                               num_processes=num_processes)
 
     # Get move distribution; computation analogous to GameRunner._sample_move
     # All moves are legal so no need to remove probability 0 moves like in top_net_moves
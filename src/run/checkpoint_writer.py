@@ -0,0 +1,173 @@
+import torch
+from collections import OrderedDict
+from time import time
+import threading
+import os
+import logging
+
+logger = logging.getLogger(__name__)
+
+class CheckpointStats:
+    '''
+        Counters describing the checkpoints written by a CheckpointWriter.
+    '''
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.n_requests = 0
+        self.n_written = 0
+        self.n_coalesced = 0
+        self.n_failed = 0
+        self.total_snapshot_s = 0
+        self.total_write_s = 0
+        self.max_write_s = 0
+
+    def record_request(self, snapshot_s, coalesced):
+        with self.lock:
+            self.n_requests += 1
+            self.n_coalesced += coalesced
+            self.total_snapshot_s += snapshot_s
+
+    def record_write(self, write_s, failed=False):
+        with self.lock:
+            if failed:
+                self.n_failed += 1
+                return
+
+            self.n_written += 1
+            self.total_write_s += write_s
+            self.max_write_s = max(self.max_write_s, write_s)
+
+    def as_dict(self):
+        with self.lock:
+            return {
+                'requests': self.n_requests,
+                'written': self.n_written,
+                'coalesced': self.n_coalesced,
+                'failed': self.n_failed,
+                'mean_snapshot_s': self.total_snapshot_s / self.n_requests if self.n_requests else 0,
+                'mean_write_s': self.total_write_s / self.n_written if self.n_written else 0,
+                'max_write_s': self.max_write_s
+            }
+
+class CheckpointWriter:
+    '''
+        Writes checkpoints on a background thread so that the learner only pays for
+        copying the state to save, not for serializing it to disk.
+
+        Checkpoints are written to a temporary file which then replaces the checkpoint
+        atomically, so a crash never leaves a partial checkpoint behind. A checkpoint
+        saved with the same key as one waiting to be written replaces it, so
+        back-to-back saves to the same path are only written once.
+    '''
+    def __init__(self):
+        self.pending = OrderedDict() # Key -> (path, checkpoint) waiting to be written
+        self.writing = False
+        self.stopping = False
+        self.condition = threading.Condition()
+
+        self.stats = CheckpointStats()
+        self.thread = None
+
+    def start(self):
+        self.stopping = False
+        self.thread = threading.Thread(target=self._write_checkpoints, daemon=True)
+        self.thread.start()
+
+        return self
+
+    def stop(self):
+        '''
+            Writes the pending checkpoints and stops the writer thread.
+        '''
+        with self.condition:
+            self.stopping = True
+            self.condition.notify_all()
+        self.thread.join()
+        self.thread = None
+
+        logger.info(f'Checkpoint writer stats: {self.get_stats()}')
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def save(self, checkpoint, path, key=None):
+        '''
+            Queues the dict checkpoint to be saved to path with torch.save. Its tensors
+            are copied to the CPU first, so the caller can keep updating them.
+
+            If a checkpoint with the same key, by default its path, is still waiting to
+            be written, it is dropped in favor of this one.
+        '''
+        start = time()
+        checkpoint = snapshot(checkpoint)
+        key = path if key is None else key
+
+        with self.condition:
+            coalesced = key in self.pending
+            self.pending.pop(key, None) # Queue it last
+            self.pending[key] = (path, checkpoint)
+            self.condition.notify_all()
+
+        self.stats.record_request(time() - start, coalesced)
+
+    def flush(self):
+        '''
+            Blocks until all the queued checkpoints are written.
+        '''
+        with self.condition:
+            self.condition.wait_for(lambda: not self.pending and not self.writing)
+
+    def get_stats(self):
+        stats = self.stats.as_dict()
+        with self.condition:
+            stats['pending'] = len(self.pending)
+
+        return stats
+
+    def _write_checkpoints(self):
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.pending or self.stopping)
+                if not self.pending:
+                    return
+
+                _, (path, checkpoint) = self.pending.popitem(last=False)
+                self.writing = True
+
+            self._write(checkpoint, path)
+
+            with self.condition:
+                self.writing = False
+                self.condition.notify_all()
+
+    def _write(self, checkpoint, path):
+        start = time()
+        tmp_path = path + '.tmp'
+        try:
+            torch.save(checkpoint, tmp_path)
+            os.replace(tmp_path, path)
+        except Exception:
+            logger.exception(f'Failed to write checkpoint {path}')
+            self.stats.record_write(time() - start, failed=True)
+            return
+
+        write_s = time() - start
+        self.stats.record_write(write_s)
+        logger.debug(f'Wrote checkpoint {path} in {write_s:.2f}s')
+
+def snapshot(obj):
+    '''
+        Returns a copy of obj, a nest of dicts, lists and tuples such as a state dict,
+        with its tensors copied to the CPU.
+    '''
+    if torch.is_tensor(obj):
+        return obj.detach().to('cpu', copy=True)
+    if isinstance(obj, dict):
+        return type(obj)((key, snapshot(value)) for key, value in obj.items())
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(snapshot(value) for value in obj)
+
+    return obj
@@ -0,0 +1,192 @@
+import torch
+from network.mask_policy import mask_invalid_moves_batch
+from concurrent.futures import Future
+from time import time
+import queue
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+class InferenceRequest:
+    def __init__(self, state, board):
+        self.state = state
+        self.board = board # Board whose legal moves mask the policy
+        self.future = Future()
+        self.enqueue_time = time()
+
+class InferenceStats:
+    '''
+        Counters describing the load on an InferenceServer.
+    '''
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.n_requests = 0
+        self.n_batches = 0
+        self.max_batch_size = 0
+        self.max_queue_depth = 0
+        self.total_latency_s = 0
+        self.max_latency_s = 0
+
+    def record_batch(self, batch, queue_depth):
+        now = time()
+        latencies = [now - request.enqueue_time for request in batch]
+
+        with self.lock:
+            self.n_requests += len(batch)
+            self.n_batches += 1
+            self.max_batch_size = max(self.max_batch_size, len(batch))
+            self.max_queue_depth = max(self.max_queue_depth, queue_depth)
+            self.total_latency_s += sum(latencies)
+            self.max_latency_s = max(self.max_latency_s, max(latencies))
+
+    def as_dict(self):
+        with self.lock:
+            return {
+                'requests': self.n_requests,
+                'batches': self.n_batches,
+                'mean_batch_size': self.n_requests / self.n_batches if self.n_batches else 0,
+                'max_batch_size': self.max_batch_size,
+                'max_queue_depth': self.max_queue_depth,
+                'mean_latency_s': self.total_latency_s / self.n_requests if self.n_requests else 0,
+                'max_latency_s': self.max_latency_s
+            }
+
+class InferenceServer:
+    '''
+        Owns the network and evaluates encoded states submitted by any number of
+        concurrent searches. A server thread groups the queued states into batches
+        of at most max_batch_size, waiting up to max_wait_s after the first state of
+        a batch arrives for more to be submitted.
+
+        Stopping the server evaluates every state submitted before, and states can't be
+        submitted once it is stopping.
+    '''
+    def __init__(self, network, device='cpu', max_batch_size=64, max_wait_s=.005):
+        self.network = network
+        self.device = device
+        self.max_batch_size = max_batch_size
+        self.max_wait_s = max_wait_s
+
+        self.requests = queue.Queue()
+        self.stats = InferenceStats()
+        self.thread = None
+        self.stopping = False
+        self.stop_lock = threading.Lock() # Orders submissions with respect to the stop sentinel
+
+    def start(self):
+        self.network.eval()
+        self.stopping = False
+        self.thread = threading.Thread(target=self._serve, daemon=True)
+        self.thread.start()
+
+        return self
+
+    def stop(self):
+        with self.stop_lock:
+            self.stopping = True
+            self.requests.put(None) # Sentinel to stop the server thread
+
+        self.thread.join()
+        self.thread = None
+
+        logger.info(f'Inference server stats: {self.get_stats()}')
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def submit(self, state, board):
+        '''
+            Queues an encoded state for evaluation. Returns a Future resolving to the
+            network's value and policy for the state, with the policy masked to the legal
+            moves of board.
+
+            Raises a RuntimeError if the server is stopping.
+        '''
+        request = InferenceRequest(state, board)
+        with self.stop_lock:
+            if self.stopping:
+                raise RuntimeError('Inference server is stopping')
+
+            self.requests.put(request)
+
+        return request.future
+
+    def evaluate(self, states, boards):
+        '''
+            Submits all states and blocks until they are evaluated. Returns a list of
+            (value, masked policy) pairs.
+        '''
+        futures = [self.submit(state, board) for state, board in zip(states, boards)]
+        return [future.result() for future in futures]
+
+    def queue_depth(self):
+        return self.requests.qsize()
+
+    def get_stats(self):
+        stats = self.stats.as_dict()
+        stats['queue_depth'] = self.queue_depth()
+
+        return stats
+
+    def _serve(self):
+        stopping = False
+        while not stopping:
+            request = self.requests.get()
+            if request is None:
+                break
+
+            # Collect more requests until the batch is full or the wait time is exceeded
+            batch = [request]
+            deadline = time() + self.max_wait_s
+            while len(batch) < self.max_batch_size:
+                try:
+                    request = self.requests.get(timeout=max(deadline - time(), 0))
+                except queue.Empty:
+                    break
+
+                if request is None:
+                    stopping = True
+                    break
+
+                batch.append(request)
+
+            self.stats.record_batch(batch, len(batch) + self.queue_depth())
+            self._run_batch(batch)
+
+        # Evaluate anything left behind the sentinel so that no future is left pending
+        leftover = []
+        while True:
+            try:
+                request = self.requests.get_nowait()
+            except queue.Empty:
+                break
+
+            if request is not None:
+                leftover.append(request)
+
+        for start in range(0, len(leftover), self.max_batch_size):
+            batch = leftover[start:start+self.max_batch_size]
+            self.stats.record_batch(batch, len(leftover) - start)
+            self._run_batch(batch)
+
+    def _run_batch(self, batch):
+        try:
+            with torch.no_grad():
+                states = torch.stack([request.state for request in batch], dim=0).to(self.device)
+                values, log_probs = self.network(states)
+
+            policies = log_probs.exp()
+            mask_invalid_moves_batch(policies, [request.board for request in batch], device=self.device)
+
+            for request, value, policy in zip(batch, values, policies):
+                request.future.set_result((value.item(), policy))
+
+        except Exception as e:
+            logger.exception('Inference batch failed')
+            for request in batch:
+                if not request.future.done():
+                    request.future.set_exception(e)
@@ -0,0 +1,102 @@
+import torch
+import glob
+import os
+import re
+import logging
+
+logger = logging.getLogger(__name__)
+
+MODEL_FILE_FMT = 'model_%06d.pt'
+MODEL_FILE_RE = re.compile(r'model_(\d+)\.pt$')
+KEEP_VERSIONS = 3 # Number of most recent versions kept in a store
+
+VERSION_KEY = 'version'
+MODEL_KEY = 'model_state_dict'
+
+class ModelStore:
+    '''
+        Directory of numbered versions of the network's weights, published by the
+        learner and loaded by self-play actors.
+
+        Each version is a file holding its state dict and version number, moved into
+        place once fully written, so a version is complete as soon as it is visible.
+        Only the keep_versions most recent versions are kept.
+
+        If checkpoint_writer is given, versions are written by its background thread
+        and only become visible once written. A version still waiting to be written
+        when the next one is published is skipped.
+    '''
+    def __init__(self, store_dir, keep_versions=KEEP_VERSIONS, checkpoint_writer=None):
+        self.store_dir = store_dir
+        self.keep_versions = keep_versions
+        self.checkpoint_writer = checkpoint_writer
+
+        os.makedirs(store_dir, exist_ok=True)
+
+    def __getstate__(self):
+        # Processes reading the store don't need the writer thread
+        state = self.__dict__.copy()
+        state['checkpoint_writer'] = None
+
+        return state
+
+    def publish(self, state_dict, version):
+        '''
+            Publishes state_dict as the given version, which must be newer than
+            any version already published.
+        '''
+        assert version > self.get_latest_version(), f'Model version {version} was already published'
+
+        model = {VERSION_KEY: version, MODEL_KEY: state_dict}
+        path = os.path.join(self.store_dir, MODEL_FILE_FMT % version)
+        if self.checkpoint_writer is not None:
+            self.checkpoint_writer.save(model, path, key=self.store_dir)
+        else:
+            torch.save(model, path + '.tmp')
+            os.replace(path + '.tmp', path)
+
+        for old_version in self.get_versions():
+            if old_version > version - self.keep_versions:
+                break
+
+            try:
+                os.remove(os.path.join(self.store_dir, MODEL_FILE_FMT % old_version))
+            except FileNotFoundError:
+                pass # Removed by another publisher
+
+    def get_versions(self):
+        '''
+            Returns the sorted numbers of the versions in the store.
+        '''
+        versions = []
+        for path in glob.glob(os.path.join(self.store_dir, 'model_*.pt')):
+            match = MODEL_FILE_RE.search(path)
+            if match:
+                versions.append(int(match.group(1)))
+
+        return sorted(versions)
+
+    def get_latest_version(self):
+        '''
+            Returns the number of the most recent version, or -1 if the store is empty.
+        '''
+        versions = self.get_versions()
+        return versions[-1] if versions else -1
+
+    def load_latest(self, device='cpu'):
+        '''
+            Returns the number and state dict of the most recent version, or (-1, None)
+            if the store is empty.
+        '''
+        while True:
+            version = self.get_latest_version()
+            if version < 0:
+                return -1, None
+
+            try:
+                model = torch.load(os.path.join(self.store_dir, MODEL_FILE_FMT % version),
+                                   map_location=torch.device(device))
+            except FileNotFoundError:
+                continue # Removed since newer versions were published
+
+            return model[VERSION_KEY], model[MODEL_KEY]
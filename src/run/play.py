@@ -1,13 +1,14 @@
 import torch
 from network.encode_state import StateEncoder
-from network.mask_policy import mask_invalid_moves, square_move_to_index
+from network.mask_policy import mask_invalid_moves_batch, moves_to_flat_indices
 from network.network import Network
 from network.encode_dist import MCTSDist
 import network.sample_policy
 import chess
 from mcts.mcts import MCTSEvaluator
-from utils import square_to_n_n
+from mcts.zobrist import zobrist_key
 from torch.nn import functional as F
+from concurrent.futures import ThreadPoolExecutor
 import logging
 
 logger = logging.getLogger(__name__)
@@ -18,29 +19,49 @@ MAX_TURNS = float('inf')
 
 class GameRunner:
     def __init__(self, T, temp=1, temp_divisor=1.013, std_ucb=False, max_trials=1000, max_time_s=10,
-                 device='cpu'):
+                 batch_size=1, num_threads=1, num_processes=1, rollouts_per_leaf=1, rollout_threads=1,
+                 max_rollout_depth=None, rollout_policy='uniform', device='cpu', inference_server=None):
         self.T = T
         self.temp = temp
         self.temp_divisor = temp_divisor
         self.std_ucb = std_ucb
         self.max_trials = max_trials
         self.max_time_s = max_time_s
+        self.batch_size = batch_size # Number of MCTS leaves evaluated per network call
+        self.num_threads = num_threads # Number of threads searching each MCTS tree
+        self.num_processes = num_processes # Number of root-parallel processes per MCTS
+        self.rollouts_per_leaf = rollouts_per_leaf # Number of rollouts averaged per MCTS leaf
+        self.rollout_threads = rollout_threads # Number of native threads running the rollouts
+        self.max_rollout_depth = max_rollout_depth # Rollouts are scored statically after this many moves
+        self.rollout_policy = rollout_policy # How the C++ rollouts choose moves
         self.state_encoder = StateEncoder(T)
         self.device = device
 
-    def play_game(self, network, start_fen=START_FEN):
+        # If not None, an InferenceServer shared by concurrent games evaluates
+        # the network instead of calling it directly
+        self.inference_server = inference_server
+
+    def play_game(self, network, start_fen=START_FEN, before_turn=None):
+        '''
+            Plays a self-play game, returning the final board and its mcts_dist_histories.
+            If not None, before_turn is called before each turn, e.g. to update the
+            network's weights mid-game.
+        '''
         network.eval()
         board = chess.Board(start_fen)
-        fen_history = [] # Could use a deque here
+        board_history = [] # Could use a deque here
 
         mcts_dists = []
         subtree = None # The previous MCTS subtree from which MCTS will be started
         turn = 0
         logger.info(f'Starting FEN: {board.fen()}')
         while board.outcome() is None:
-            mcts_dist, subtree = self.play_turn(board, network, fen_history[-self.T:], subtree=subtree, turn=turn)
+            if before_turn is not None:
+                before_turn()
+
+            board_history.append(board.copy(stack=False))
+            mcts_dist, subtree = self.play_turn(board, network, board_history[-self.T:-1], subtree=subtree, turn=turn)
             mcts_dists.append(mcts_dist)
-            fen_history.append(board.fen())
 
             turn += 1
             logger.info(f'FEN after turn {turn}: {board.fen()}')
@@ -56,19 +77,41 @@ class GameRunner:
 
         return board, mcts_dist_histories
 
-    def play_turn(self, board, network, fen_history, subtree=None, turn=1):
+    def play_concurrent_games(self, network, num_games, start_fen=START_FEN):
+        '''
+            Plays num_games games at once in separate threads, returning a list of the
+            play_game outputs. Should be used with an inference server so that the
+            network evaluations of all games are batched together.
         '''
-            fen_history is a list of FEN strings detailing the history up until
+        with ThreadPoolExecutor(max_workers=num_games) as executor:
+            futures = [executor.submit(self.play_game, network, start_fen) for _ in range(num_games)]
+            return [future.result() for future in futures]
+
+    def play_turn(self, board, network, board_history, subtree=None, turn=1):
+        '''
+            board_history is a list of chess.Boards detailing the history up until
             and not including the current state.
 
             board is a chess.Board describing the current state.
         '''
-        prior_func_builder = self._get_prior_func_builder(network, fen_history)
-        mcts_evaluator = MCTSEvaluator(board.fen(), prior_func_builder, subtree=subtree)
+        batch_prior_func_builder = self._get_batch_prior_func_builder(network, board_history)
+        mcts_evaluator = MCTSEvaluator(
+            board.fen(),
+            self._get_prior_func_builder(batch_prior_func_builder),
+            subtree=subtree,
+            batch_prior_func_builder=batch_prior_func_builder,
+            rollouts_per_leaf=self.rollouts_per_leaf,
+            rollout_threads=self.rollout_threads,
+            max_rollout_depth=self.max_rollout_depth,
+            rollout_policy=self.rollout_policy
+        )
         root = mcts_evaluator.mcts(
             std_ucb=self.std_ucb,
             max_trials=self.max_trials,
-            max_time_s=self.max_time_s
+            max_time_s=self.max_time_s,
+            batch_size=self.batch_size,
+            num_threads=self.num_threads,
+            num_processes=self.num_processes
         )
         effective_temp = self.temp / self.temp_divisor ** turn
         sampled_move, sampled_ind = self._sample_move(root, effective_temp)
@@ -91,36 +134,60 @@ class GameRunner:
 
         return chess.Move.from_uci(sampled_edge.uci), sampled_ind
 
-    def _get_prior_func_builder(self, network, fen_history):
+    def _get_prior_func_builder(self, batch_prior_func_builder):
+        '''
+            Returns the prior_func_builder of single states, evaluated with
+            batch_prior_func_builder (see _get_batch_prior_func_builder).
         '''
-            fen_history is a list of FEN strings detailing the history up until
+        def prior_func_builder(board, keys):
+            '''
+                board is the chess.Board of the current state from which a move will be
+                selected, with the moves from the root of the MCTS tree on its move stack.
+                keys are the Zobrist keys of the states from the root up to and INCLUDING
+                the current state.
+            '''
+            return batch_prior_func_builder([board], [keys])[0]
+
+        return prior_func_builder
+
+    def _get_batch_prior_func_builder(self, network, board_history):
+        '''
+            board_history is a list of chess.Boards detailing the history up until
             and not including the root of the MCTS tree.
         '''
-        def prior_func_builder(fens):
+        history_keys = [zobrist_key(board) for board in board_history]
+
+        def batch_prior_func_builder(boards, key_paths):
             '''
-                fens is a list of FEN strings detailing the path from the root
-                of the MCTS tree up to and INCLUDING the current state from which
-                a move will be selected.
+                boards and key_paths are lists of the arguments taken by prior_func_builder.
+                The priors of all boards are computed with a single forward pass of the network.
             '''
-            # Build the network's masked policy
-            fens = fen_history + fens # Combine the history before the root of mcts and after
-            boards = (chess.Board(fen) for fen in fens[-self.T:])
-            curr_state = self.state_encoder.encode_state_with_history(boards)
+            # Build the network's masked policies, combining the history before the root of
+            # mcts and after, reusing the cached piece planes of the positions along the paths
+            states = self.state_encoder.encode_search_states(boards, key_paths, board_history, history_keys)
+
+            if self.inference_server is not None:
+                outputs = self.inference_server.evaluate(states, boards)
+                return [self._build_prior_func(net_policy) for _, net_policy in outputs]
+
             with torch.no_grad():
-                curr_state = curr_state.unsqueeze(0).to(self.device)
-                _, net_log_probs = network(curr_state)
+                _, net_log_probs = network(states.to(self.device))
 
-            net_policy = net_log_probs.exp().squeeze()
-            mask_invalid_moves(net_policy, chess.Board(fens[-1]), device=self.device)
+            net_policies = net_log_probs.exp()
+            mask_invalid_moves_batch(net_policies, boards, device=self.device)
 
-            def prior_func(move):
-                row, col = square_to_n_n(move.from_square)
-                index = square_move_to_index(move.from_square, move.to_square, move.promotion)
-                return net_policy[row, col, index]
+            return [self._build_prior_func(net_policy) for net_policy in net_policies]
 
-            return prior_func
+        return batch_prior_func_builder
 
-        return prior_func_builder
+    def _build_prior_func(self, net_policy):
+        flat_policy = net_policy.flatten().cpu().numpy()
+
+        def prior_func(moves):
+            # Gather the priors of all moves at once
+            return flat_policy[moves_to_flat_indices(moves)]
+
+        return prior_func
 
 if __name__ == '__main__':
     pass
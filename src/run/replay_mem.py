@@ -1,31 +1,445 @@
 import torch
-from collections import deque
+from torch.utils.data import IterableDataset, get_worker_info
+import numpy as np
+import json
+import os
+import time
+import logging
+from network.encode_state import M, L, N
+
+logger = logging.getLogger(__name__)
+
+MAX_POSITIONS = 50000 # Default capacity in positions, about 1.2KB each with T = 8
+SHARD_POSITIONS = 32768 # Default number of positions per shard file of an on-disk memory
+POLICY_MOVES_PER_POSITION = 40 # Policy moves stored per position of capacity (positions have ~30 legal moves)
+BATCH_SIZE = 50
+
+INDEX_FILE = 'index.json'
+SHARD_FILE_FMT = 'shard_%06d.npy'
+MOVE_SHARD_FILE_FMT = 'moves_%06d.npy'
+
+# Flat index into the network's policy and MCTS probability of a move of a policy
+POLICY_MOVE_DTYPE = np.dtype([('index', np.int16), ('prob', np.float32)])
+
+def get_record_dtype(T):
+    '''
+        Returns the numpy dtype of the fixed size record of a position: its input planes
+        packed into bits, the number of its first policy move and its number of policy
+        moves, its MCTS value, the id of its game and the version of the model that
+        played it.
+    '''
+    n_plane_bits = (M*T+L) * N * N
+    return np.dtype([
+        ('planes', np.uint8, int(np.ceil(n_plane_bits / 8))),
+        ('policy_start', np.int64),
+        ('policy_count', np.int16),
+        ('value', np.float32),
+        ('game_id', np.int64),
+        ('model_version', np.int32)
+    ])
+
+class RecordStore:
+    '''
+        Records of a numpy dtype numbered from 0, kept either in a preallocated ring
+        buffer of capacity records in RAM, where new records overwrite the oldest ones,
+        or appended to memory-mapped shard files of shard_size records in shard_dir,
+        named after file_fmt and the index of the shard.
+    '''
+    def __init__(self, dtype, capacity, shard_dir=None, file_fmt=None, shard_size=None, read_only=False):
+        self.dtype = dtype
+        self.capacity = capacity
+        self.shard_dir = shard_dir
+        self.file_fmt = file_fmt
+        self.read_only = read_only
+
+        if shard_dir is None:
+            self.shard_size = capacity
+            self.shards = [np.zeros(capacity, dtype=dtype)]
+        else:
+            self.shard_size = shard_size
+            self.shards = []
+
+    def write(self, first, records):
+        '''
+            Writes records as the records numbered from first.
+        '''
+        if self.shard_dir is None:
+            # Only the last capacity records fit
+            first += max(len(records) - self.capacity, 0)
+            records = records[-self.capacity:]
+            self.shards[0][(first + np.arange(len(records))) % self.capacity] = records
+            return
+
+        # Split the records at the ends of shards
+        number = first
+        while number < first + len(records):
+            shard_ind, offset = divmod(number, self.shard_size)
+            if shard_ind == len(self.shards):
+                self.shards.append(self._create_shard(shard_ind))
+
+            n_written = min(self.shard_size - offset, first + len(records) - number)
+            shard = self.shards[shard_ind]
+            shard[offset:offset+n_written] = records[number-first:number-first+n_written]
+            shard.flush()
+
+            number += n_written
+
+    def read(self, numbers, field=None):
+        '''
+            Returns a copy of the records numbered numbers, or of their field if not None.
+        '''
+        numbers = np.asarray(numbers)
+        if self.shard_dir is None:
+            records = self.shards[0] if field is None else self.shards[0][field]
+            return records[numbers % self.capacity]
+
+        records = np.empty(len(numbers), dtype=self.dtype if field is None else self.dtype[field])
+        shard_inds, offsets = np.divmod(numbers, self.shard_size)
+        for shard_ind in np.unique(shard_inds):
+            in_shard = shard_inds == shard_ind
+            shard = self.shards[shard_ind] if field is None else self.shards[shard_ind][field]
+            records[in_shard] = shard[offsets[in_shard]]
+
+        return records
+
+    def open(self, n_records):
+        '''
+            Opens the shards holding the first n_records records which aren't open yet.
+        '''
+        n_shards = int(np.ceil(n_records / self.shard_size))
+        mode = 'r' if self.read_only else 'r+'
+        for shard_ind in range(len(self.shards), n_shards):
+            shard = np.load(self._shard_path(shard_ind), mmap_mode=mode)
+            assert shard.dtype == self.dtype, f'Replay memory in {self.shard_dir} has different records'
+            self.shards.append(shard)
+
+    def truncate(self, n_records):
+        '''
+            Closes the shards past the first n_records records, which are recreated
+            when reached again.
+        '''
+        del self.shards[int(np.ceil(n_records / self.shard_size)):]
+
+    def _shard_path(self, shard_ind):
+        return os.path.join(self.shard_dir, self.file_fmt % shard_ind)
+
+    def _create_shard(self, shard_ind):
+        return np.lib.format.open_memmap(self._shard_path(shard_ind), mode='w+',
+                                         dtype=self.dtype, shape=(self.shard_size,))
 
 class ReplayMemory:
-    def __init__(self, last_k=5):
+    '''
+        Training examples of the most recently played positions, as fixed size records.
+
+        Every position saved gets the next position number. Only the last capacity
+        positions are sampled from.
+
+        The MCTS policy of a position is stored as a variable number of moves, its flat
+        indices into the network's policy and probabilities, in a separate store of moves
+        referenced by the position's record. Moves without visits are dropped, as they
+        don't contribute to the loss, so a policy of 30 moves takes 180 bytes instead of
+        the 18688 of a dense float32 policy.
+
+        By default, the records and moves are kept in preallocated ring buffers in RAM,
+        where new positions overwrite the oldest ones. The move buffer holds an average of
+        POLICY_MOVES_PER_POSITION moves per position of capacity. Positions whose moves
+        were overwritten by newer ones are no longer sampled from, so games with longer
+        policies leave fewer positions to sample from.
+
+        If shard_dir is given, the records and moves are instead appended to memory-mapped
+        shard files in shard_dir, with shard_positions records (and that many times
+        POLICY_MOVES_PER_POSITION moves) per file, along with an index of the number of
+        positions written. Sampling then reads them through the OS page cache, so the
+        memory can be much larger than RAM, and other processes can open the same shards
+        with read_only to sample from them.
+    '''
+    def __init__(self, T, capacity=MAX_POSITIONS, capacity_bytes=None, shard_dir=None,
+                 shard_positions=SHARD_POSITIONS, read_only=False):
+        '''
+            capacity is the number of positions to sample from. If capacity_bytes is not
+            None, the capacity is instead as many positions as fit in that many bytes.
+
+            If shard_dir already holds shards, they are opened and new positions are
+            appended to them. shard_positions is then read from their index.
+        '''
+        self.T = T
+        self.state_shape = (M*T+L, N, N)
+        self.record_dtype = get_record_dtype(T)
+
+        if capacity_bytes is not None:
+            capacity = max(capacity_bytes // self.record_bytes(), 1)
+        self.capacity = capacity
+
+        self.n_positions = 0 # Number of positions ever saved, also the number of the next one
+        self.n_games = 0 # Number of games ever saved, also the id of the next game
+        self.n_moves = 0 # Number of policy moves ever saved, also the number of the next one
+        self.first_position = 0 # First position whose policy moves weren't overwritten
+
+        self.shard_dir = shard_dir
+        self.read_only = read_only
+        if shard_dir is None:
+            assert not read_only, 'Only memories with shards can be opened read only'
+            self.shard_positions = capacity
+        else:
+            self.shard_positions = shard_positions
+
+        self._create_stores()
+        if shard_dir is not None:
+            self._open_shards()
+            logger.info(f'Opened replay memory in {shard_dir} with {self.n_positions} positions')
+
+    def record_bytes(self):
+        '''
+            Returns the number of bytes taken by each position of capacity, its record
+            and its share of the policy moves.
+        '''
+        return self.record_dtype.itemsize + POLICY_MOVES_PER_POSITION * POLICY_MOVE_DTYPE.itemsize
+
+    def save(self, examples, model_versions=-1):
+        '''
+            examples is the tuple of training arrays (states, policy indices, policy
+            probabilities, values) of the positions of a game, as returned by
+            MCTSLoss.encode_examples. model_versions is the version of the model that
+            played each position, or a single version for the whole game (-1 if unknown).
+            Returns the id of the game.
+        '''
+        assert not self.read_only, 'Can\'t save to a read only replay memory'
+        states, policy_indices, policy_probs, values = examples
+        assert states.shape[1:] == self.state_shape
+
+        # Only the last capacity positions of a very long game are sampled
+        n_positions = min(len(states), self.capacity)
+
+        # Padding entries, and moves without visits, have probability 0 and aren't stored
+        is_stored = policy_probs[-n_positions:] > 0
+        policy_counts = is_stored.sum(axis=1)
+        moves = np.empty(policy_counts.sum(), dtype=POLICY_MOVE_DTYPE)
+        moves['index'] = policy_indices[-n_positions:][is_stored]
+        moves['prob'] = policy_probs[-n_positions:][is_stored]
+
+        records = np.empty(n_positions, dtype=self.record_dtype)
+        records['planes'] = np.packbits(states[-n_positions:].reshape(n_positions, -1), axis=1)
+        records['policy_start'] = self.n_moves + np.cumsum(policy_counts) - policy_counts
+        records['policy_count'] = policy_counts
+        records['value'] = values[-n_positions:]
+        records['model_version'] = np.broadcast_to(model_versions, len(states))[-n_positions:]
+
+        game_id = self.n_games
+        records['game_id'] = game_id
+
+        self.moves.write(self.n_moves, moves)
+        self.records.write(self.n_positions, records)
+        self.n_positions += n_positions
+        self.n_games += 1
+        self.n_moves += len(moves)
+
+        if self.shard_dir is None:
+            self._skip_overwritten_policies()
+        else:
+            self._write_index()
+
+        return game_id
+
+    def __len__(self):
+        '''
+            Returns the number of positions sampled from.
+        '''
+        return self.n_positions - max(self.first_position, self.n_positions - self.capacity)
+
+    def sample(self, num_to_sample=BATCH_SIZE):
+        '''
+            Returns a tuple of training tensors (states, policy indices, policy
+            probabilities, values) of num_to_sample positions sampled uniformly from
+            the last capacity positions.
+        '''
+        positions = self.n_positions - len(self) + np.random.randint(len(self), size=num_to_sample)
+        return self.get_examples(positions)
+
+    def get_examples(self, positions):
+        '''
+            Returns the training tensors (states, policy indices, policy probabilities,
+            values) of the positions numbered positions, as taken by MCTSLoss.get_batch_loss.
+            The policies are padded with index 0 and probability 0 to the longest one.
+        '''
+        records = self.get_records(positions)
+
+        n_plane_bits = int(np.prod(self.state_shape))
+        states = np.unpackbits(records['planes'], axis=1, count=n_plane_bits)
+        states = torch.from_numpy(states.reshape(len(positions), *self.state_shape))
+
+        # Gather the moves of all the policies at once
+        policy_counts = records['policy_count'].astype(np.int64)
+        offsets = np.arange(max(policy_counts.max(), 1))
+        is_move = offsets < policy_counts[:, None]
+        moves = self.moves.read((records['policy_start'][:, None] + offsets)[is_move])
+
+        policy_indices = np.zeros(is_move.shape, dtype=np.int64)
+        policy_probs = np.zeros(is_move.shape, dtype=np.float32)
+        policy_indices[is_move] = moves['index']
+        policy_probs[is_move] = moves['prob']
+
+        # The records are packed, so their fields are copied to be aligned
+        values = torch.from_numpy(np.ascontiguousarray(records['value']))
+
+        return states, torch.from_numpy(policy_indices), torch.from_numpy(policy_probs), values
+
+    def get_records(self, positions):
+        '''
+            Returns a copy of the records of the positions numbered positions, which must
+            be among the positions sampled from.
+        '''
+        positions = np.asarray(positions)
+        assert (positions >= self.n_positions - len(self)).all() and (positions < self.n_positions).all()
+
+        return self.records.read(positions)
+
+    def open_reader(self):
         '''
-            last_k is the number of games to save in the memory.
+            Returns a new read only memory on the same shards, e.g. for another process.
         '''
-        self.last_k = last_k
-        self.memory = deque()
+        assert self.shard_dir is not None
+        return ReplayMemory(self.T, capacity=self.capacity, shard_dir=self.shard_dir, read_only=True)
 
-    def save(self, mcts_dist_histories):
-        while len(self.memory) >= self.last_k:
-            self.memory.popleft()
+    def refresh(self):
+        '''
+            Reads the index of the shards again to see the positions saved since by
+            the process writing them.
+        '''
+        assert self.shard_dir is not None
+        self._open_shards()
 
-        self.memory.append(mcts_dist_histories)
+    def get_offset(self):
+        '''
+            Returns the offset of the end of the shards, to be stored in checkpoints
+            instead of the records themselves.
+        '''
+        assert self.shard_dir is not None
+        return {'n_positions': self.n_positions, 'n_games': self.n_games, 'n_moves': self.n_moves}
 
-    def sample(self, num_to_sample=50):
+    def rewind(self, n_positions, n_games, n_moves):
         '''
-            Returns a list of mcts_dist_history lists of length num_to_sample.
+            Goes back to an offset returned by get_offset, dropping the positions saved
+            since, e.g. when resuming from the checkpoint that stored the offset.
         '''
-        # Flatten the memory of all previous games
-        flattened = [
-            mcts_dist_history for mcts_dist_histories in self.memory
-            for mcts_dist_history in mcts_dist_histories
-        ]
-        probs = torch.ones(len(flattened))
-        probs /= probs.sum() # Uniform
-        samples = torch.multinomial(probs, num_to_sample, replacement=True)
+        assert self.shard_dir is not None and not self.read_only
+        assert n_positions <= self.n_positions and n_games <= self.n_games and n_moves <= self.n_moves, \
+            f'Replay memory in {self.shard_dir} ends before offset {n_positions}'
+
+        if n_positions < self.n_positions:
+            logger.warning(f'Dropping the last {self.n_positions - n_positions} positions '
+                           + f'({self.n_games - n_games} games) of the replay memory in {self.shard_dir}')
+
+        self.n_positions = n_positions
+        self.n_games = n_games
+        self.n_moves = n_moves
+        self.records.truncate(n_positions)
+        self.moves.truncate(n_moves)
+        self._write_index()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+
+        if self.shard_dir is not None:
+            # The records are already on disk, only keep the path to the shards
+            del state['records'], state['moves']
+        else:
+            # Only pickle the sampled records and their moves, oldest first, rather than
+            # the whole capacity
+            positions = np.arange(self.n_positions - len(self), self.n_positions)
+            records = self.records.read(positions)
+            first_move = records['policy_start'][0] if len(records) else self.n_moves
+            state['records'] = records
+            state['moves'] = self.moves.read(np.arange(first_move, self.n_moves))
+
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+
+        if self.shard_dir is not None:
+            self._create_stores()
+            self._open_shards()
+        else:
+            records, moves = self.records, self.moves
+            self._create_stores()
+            self.records.write(self.n_positions - len(records), records)
+            self.moves.write(self.n_moves - len(moves), moves)
+
+    def _create_stores(self):
+        move_capacity = self.capacity * POLICY_MOVES_PER_POSITION
+        self.records = RecordStore(self.record_dtype, self.capacity, self.shard_dir, SHARD_FILE_FMT,
+                                   self.shard_positions, self.read_only)
+        self.moves = RecordStore(POLICY_MOVE_DTYPE, move_capacity, self.shard_dir, MOVE_SHARD_FILE_FMT,
+                                 self.shard_positions * POLICY_MOVES_PER_POSITION, self.read_only)
+
+    def _skip_overwritten_policies(self):
+        # Policies are stored in the order of their positions, so the positions whose
+        # moves were overwritten are the oldest ones
+        first_position = self.n_positions - len(self)
+        policy_starts = self.records.read(np.arange(first_position, self.n_positions), 'policy_start')
+        self.first_position = first_position + int(np.searchsorted(policy_starts, self.n_moves - self.moves.capacity))
+
+    def _open_shards(self):
+        index_path = os.path.join(self.shard_dir, INDEX_FILE)
+        if not os.path.exists(index_path):
+            assert not self.read_only, f'No replay memory index in {self.shard_dir}'
+            os.makedirs(self.shard_dir, exist_ok=True)
+            self._write_index()
+            return
+
+        with open(index_path) as f:
+            index = json.load(f)
+
+        assert index['T'] == self.T, f'Replay memory in {self.shard_dir} has T = {index["T"]}, not {self.T}'
+        assert 'n_moves' in index, f'Replay memory in {self.shard_dir} has different records'
+        self.shard_positions = index['shard_positions']
+        self.n_positions = index['n_positions']
+        self.n_games = index['n_games']
+        self.n_moves = index['n_moves']
+
+        self.records.shard_size = self.shard_positions
+        self.moves.shard_size = self.shard_positions * POLICY_MOVES_PER_POSITION
+        self.records.open(self.n_positions)
+        self.moves.open(self.n_moves)
+
+    def _write_index(self):
+        # Written once the records are, and replaced atomically, so that readers never
+        # see positions that haven't been written yet
+        index_path = os.path.join(self.shard_dir, INDEX_FILE)
+        with open(index_path + '.tmp', 'w') as f:
+            json.dump({
+                'T': self.T,
+                'shard_positions': self.shard_positions,
+                'n_positions': self.n_positions,
+                'n_games': self.n_games,
+                'n_moves': self.n_moves
+            }, f)
+        os.replace(index_path + '.tmp', index_path)
+
+class ReplayDataset(IterableDataset):
+    '''
+        Endless stream of training batches (states, policy indices, policy probabilities,
+        values) of batch_size positions sampled from replay_mem, to be loaded by a
+        DataLoader with batch_size=None.
+
+        DataLoader workers each open their own reader on the memory's shards and see
+        the games saved since they started, so replay_mem must have shards to be used
+        with workers. Without workers, the batches are sampled from replay_mem itself.
+    '''
+    def __init__(self, replay_mem, batch_size=BATCH_SIZE):
+        self.replay_mem = replay_mem
+        self.batch_size = batch_size
+
+    def __iter__(self):
+        in_worker = get_worker_info() is not None
+        replay_mem = self.replay_mem.open_reader() if in_worker else self.replay_mem
+
+        while True:
+            if in_worker:
+                replay_mem.refresh()
+
+            if len(replay_mem) == 0:
+                time.sleep(.1) # Wait for the first game
+                continue
 
-        return [flattened[i] for i in samples]
+            yield replay_mem.sample(self.batch_size)
@@ -0,0 +1,187 @@
+import torch
+import torch.multiprocessing as mp
+import numpy as np
+from .play import START_FEN
+import copy
+import queue
+import traceback
+import logging
+
+logger = logging.getLogger(__name__)
+
+ACTOR_POLL_S = 1 # Interval at which the learner checks on the actors while waiting for games
+
+class ActorError(RuntimeError):
+    '''
+        Raised by the learner when a self-play actor failed or exited.
+    '''
+
+class SelfPlayActorPool:
+    '''
+        Pool of worker processes each playing self-play games with its own copy
+        of the network and its own RNG seed.
+
+        The learner's weights are published to the actors as numbered versions in
+        model_store; actors poll the store before each move and load any newer version
+        mid-game. Finished games are returned through get_games, along with the model
+        version that played each of their positions.
+
+        Errors in the actors are sent back through the same queue as the games, and
+        get_games raises them, or an ActorError if an actor exited without one.
+    '''
+    def __init__(self, network, game_runner, num_actors, model_store, start_fen=START_FEN, seed=0):
+        self.game_runner = game_runner
+        self.num_actors = num_actors
+        self.model_store = model_store
+        self.start_fen = start_fen
+        self.seed = seed
+
+        # Spawn to avoid forking the learner's torch threads
+        self.ctx = mp.get_context('spawn')
+        self.network = copy.deepcopy(network).cpu() # Architecture for the actors to load the weights into
+
+        # Versions continue from those of previous runs in the store
+        self.version = model_store.get_latest_version()
+        self.publish_weights(network)
+
+        self.results = self.ctx.Queue()
+        self.stop_event = self.ctx.Event()
+        self.processes = []
+
+    def start(self):
+        for actor_id in range(self.num_actors):
+            process = self.ctx.Process(
+                target=_run_actor,
+                args=(
+                    actor_id,
+                    self.seed + actor_id,
+                    self.game_runner,
+                    self.network,
+                    self.version,
+                    self.model_store,
+                    self.results,
+                    self.stop_event,
+                    self.start_fen
+                ),
+                daemon=True
+            )
+            process.start()
+            self.processes.append(process)
+
+        logger.info(f'Started {self.num_actors} self-play actors')
+
+        return self
+
+    def stop(self):
+        '''
+            Stops the actors, discarding any games in progress.
+        '''
+        self.stop_event.set()
+        for process in self.processes:
+            process.terminate()
+            process.join()
+
+        self.processes = []
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def publish_weights(self, network):
+        '''
+            Publishes the weights of network to the model store as the next version,
+            which the actors pick up before their next move.
+        '''
+        self.version += 1
+        self.model_store.publish(network.state_dict(), self.version)
+
+    def get_staleness(self, model_versions):
+        '''
+            Returns the number of versions published since the oldest version that
+            played a game.
+        '''
+        return self.version - min(model_versions)
+
+    def get_games(self, block=False):
+        '''
+            Returns a (mcts_dist_histories, model_versions) pair for each game finished
+            since the last call, where model_versions holds the version of the model
+            that played the final position of each history. If block, waits for at
+            least one game to finish.
+
+            Raises an ActorError if an actor failed.
+        '''
+        games = []
+        while True:
+            try:
+                if block and not games:
+                    result = self.results.get(timeout=ACTOR_POLL_S)
+                else:
+                    result = self.results.get_nowait()
+            except queue.Empty:
+                self._check_actors()
+                if games or not block:
+                    return games
+
+                continue
+
+            if isinstance(result, ActorError):
+                raise result
+
+            games.append(result)
+
+    def _check_actors(self):
+        for actor_id, process in enumerate(self.processes):
+            if process.is_alive():
+                continue
+
+            # Prefer the error the actor sent, which may still be on its way
+            try:
+                while True:
+                    result = self.results.get(timeout=ACTOR_POLL_S)
+                    if isinstance(result, ActorError):
+                        raise result
+            except queue.Empty:
+                pass
+
+            raise ActorError(f'Self-play actor {actor_id} exited with code {process.exitcode}')
+
+def _run_actor(actor_id, seed, game_runner, net, version, model_store, results, stop_event, start_fen):
+    try:
+        _play_games(actor_id, seed, game_runner, net, version, model_store, results, stop_event, start_fen)
+    except Exception:
+        # Raised by the learner, as the actor's own traceback only goes to its stderr
+        results.put(ActorError(f'Self-play actor {actor_id} failed:\n{traceback.format_exc()}'))
+        raise
+
+def _play_games(actor_id, seed, game_runner, net, version, model_store, results, stop_event, start_fen):
+    torch.manual_seed(seed)
+    np.random.seed(seed)
+    torch.set_num_threads(1) # Actors each get a core rather than competing for all of them
+
+    # The network starts with the weights of version, which may not be written to the store yet
+    net = net.to(game_runner.device)
+    local_version = version
+    turn_versions = [] # Version that played each turn of the current game
+
+    def update_weights():
+        nonlocal local_version
+        if model_store.get_latest_version() > local_version:
+            version, state_dict = model_store.load_latest(game_runner.device)
+            if version > local_version:
+                net.load_state_dict(state_dict)
+                local_version = version
+                logger.debug(f'Actor {actor_id} loaded model version {version}')
+
+        turn_versions.append(local_version)
+
+    while not stop_event.is_set():
+        turn_versions.clear()
+        board, mcts_dist_histories = game_runner.play_game(net, start_fen=start_fen, before_turn=update_weights)
+        logger.info(f'Actor {actor_id} finished a game with result {board.result()}')
+
+        # The last history ends at the last turn, and histories end at consecutive turns
+        model_versions = turn_versions[len(turn_versions) - len(mcts_dist_histories):]
+        results.put((mcts_dist_histories, model_versions))
@@ -1,10 +1,15 @@
 import torch
 import torch.nn as nn
 from torch.optim import Adam
+from torch.utils.data import DataLoader
 from network.network import Network
 from network.loss import MCTSLoss
 from .play import GameRunner, START_FEN
-from .replay_mem import ReplayMemory
+from .replay_mem import ReplayMemory, ReplayDataset, BATCH_SIZE
+from .self_play import SelfPlayActorPool
+from .checkpoint_writer import CheckpointWriter
+from .model_store import ModelStore
+import numpy as np
 import os
 import logging
 import wandb
@@ -14,77 +19,228 @@ logger = logging.getLogger(__name__)
 GAMES_TRAINED_KEY = 'games_trained'
 MODEL_KEY = 'model_state_dict'
 OPTIMIZER_KEY = 'optimizer_state_dict'
-REPLAY_MEM_KEY = 'replay_mem'
+REPLAY_OFFSET_KEY = 'replay_offset'
 
 CHECKPOINT_DIR = 'checkpoints'
+REPLAY_DIR = os.path.join(CHECKPOINT_DIR, 'replay') # Shards of the replay memory, shared by all checkpoints
+MODEL_STORE_DIR = os.path.join(CHECKPOINT_DIR, 'models') # Model versions published to self-play actors
 LATEST_CHKPT_PATH = 'latest_chkpt.tar'
 CHKPT_NUM_FMT = 'chkpt_%d.tar'
 
+PREFETCH_BATCHES = 4 # Batches prepared ahead by each DataLoader worker
+
 def train(T, device='cpu', num_games=10, chkpt_path=None, start_fen=START_FEN,
-          max_trials=1000, max_time_s=30, network_temp=2):
-    net, optimizer, games_trained, replay_mem = load_state(T, chkpt_path, device, network_temp=network_temp)
+          max_trials=1000, max_time_s=30, network_temp=2, mcts_batch_size=1,
+          num_actors=0, weight_refresh_steps=1, replay_dir=REPLAY_DIR, batch_size=BATCH_SIZE,
+          steps_per_game=1, positions_per_step=None, num_loader_workers=0,
+          model_store_dir=MODEL_STORE_DIR, max_staleness=None, overwrite_replay=False):
+    '''
+        If num_actors > 0, games are played by a pool of num_actors self-play processes
+        while the learner keeps taking gradient steps on the replay memory, publishing
+        its weights to the actors as a new model version in model_store_dir every
+        weight_refresh_steps steps. Games are saved with the versions that played them,
+        and if max_staleness is not None, games played by a version more than
+        max_staleness versions older than the latest one are discarded. Otherwise, games
+        and gradient steps alternate in this process: each game is followed by
+        steps_per_game steps, or if positions_per_step is not None, by one step per
+        positions_per_step new positions.
+
+        Batches of batch_size positions are sampled from the replay memory by
+        num_loader_workers DataLoader worker processes, ahead of the steps using them,
+        or in this process if num_loader_workers is 0.
+
+        Each game is appended once to the replay memory's shards in replay_dir, and
+        checkpoints only store the offset of the end of the shards. A new run (without
+        a checkpoint) refuses to start if replay_dir already holds positions, unless
+        overwrite_replay, in which case they are dropped.
+    '''
+    net, optimizer, games_trained, replay_mem = load_state(T, chkpt_path, device, network_temp=network_temp,
+                                                           replay_dir=replay_dir, overwrite_replay=overwrite_replay)
 
     wandb.init(project='alphazero', entity='blume5', reinit=True)
     #wandb.watch(net, log_freq=1, log='all') # Slows down MCTS evaluation significantly (by approx a factor of 10)
 
-    game_runner = GameRunner(T, device=device, max_trials=max_trials, max_time_s=max_time_s)
+    game_runner = GameRunner(T, device=device, max_trials=max_trials, max_time_s=max_time_s,
+                             batch_size=mcts_batch_size)
     mcts_loss = MCTSLoss(T, device=device)
-
-    for game_num in range(games_trained + 1, num_games + games_trained + 1):
-        logger.info(f'Starting self-play game {game_num}')
-        board, mcts_dist_histories = game_runner.play_game(net, start_fen=start_fen)
-        logger.info(f'Completed self-play game {game_num}')
-
-        logger.info(f'Saving replay memory')
-        replay_mem.save(mcts_dist_histories)
-        save_state(net, optimizer, games_trained, replay_mem, LATEST_CHKPT_PATH)
-
-        logger.info(f'Performing gradient step')
-        mcts_dist_histories = replay_mem.sample()
-
-        net.train() # game_runner sets the network to eval
-        optimizer.zero_grad()
-        loss = mcts_loss.get_loss(net, mcts_dist_histories)
-        loss.backward()
-        optimizer.step()
-
-        games_trained += 1
-        wandb.log({
-            'Loss' : loss.item(),
-            'Games trained' : games_trained
-        })
-        logger.info(f'Saving updated network')
-        save_state(net, optimizer, games_trained, replay_mem, LATEST_CHKPT_PATH)
-
-        if game_num == 1 or game_num % 10 == 0:
-            save_state(net, optimizer, games_trained, replay_mem, CHKPT_NUM_FMT % game_num)
+    batches = iter(get_batch_loader(replay_mem, batch_size, num_loader_workers, device))
+    step_schedule = StepSchedule(steps_per_game, positions_per_step)
+
+    # Checkpoints are written in the background while training continues
+    with CheckpointWriter() as checkpoint_writer:
+        if num_actors > 0:
+            model_store = ModelStore(model_store_dir, checkpoint_writer=checkpoint_writer)
+            train_with_actors(net, optimizer, games_trained, replay_mem, batches, game_runner, mcts_loss,
+                              checkpoint_writer, model_store, num_games, num_actors, start_fen,
+                              weight_refresh_steps, max_staleness)
+            return net
+
+        for game_num in range(games_trained + 1, num_games + games_trained + 1):
+            logger.info(f'Starting self-play game {game_num}')
+            board, mcts_dist_histories = game_runner.play_game(net, start_fen=start_fen)
+            logger.info(f'Completed self-play game {game_num}')
+
+            logger.info(f'Saving replay memory')
+            n_positions = replay_mem.n_positions
+            replay_mem.save(mcts_loss.encode_examples(mcts_dist_histories))
+            save_state(checkpoint_writer, net, optimizer, games_trained, replay_mem, LATEST_CHKPT_PATH)
+
+            n_steps = step_schedule.get_num_steps(1, replay_mem.n_positions - n_positions)
+            logger.info(f'Performing {n_steps} gradient steps')
+            losses = [gradient_step(net, optimizer, mcts_loss, next(batches)).item() for _ in range(n_steps)]
+
+            games_trained += 1
+            log = {
+                'Gradient steps' : n_steps,
+                'Games trained' : games_trained,
+                'Checkpoint write time' : checkpoint_writer.get_stats()['mean_write_s']
+            }
+            if losses:
+                log['Loss'] = np.mean(losses)
+            wandb.log(log)
+            logger.info(f'Saving updated network')
+            save_state(checkpoint_writer, net, optimizer, games_trained, replay_mem, LATEST_CHKPT_PATH)
+
+            if game_num == 1 or game_num % 10 == 0:
+                save_state(checkpoint_writer, net, optimizer, games_trained, replay_mem, CHKPT_NUM_FMT % game_num)
 
     return net
 
-def save_state(net, optimizer, games_trained, replay_mem, chkpt_path):
+def train_with_actors(net, optimizer, games_trained, replay_mem, batches, game_runner, mcts_loss,
+                      checkpoint_writer, model_store, num_games, num_actors, start_fen,
+                      weight_refresh_steps, max_staleness):
+    '''
+        Trains on the games streamed from a SelfPlayActorPool until num_games more
+        games have been played. The learner only waits on the actors while the
+        replay memory is empty.
+    '''
+    final_games_trained = games_trained + num_games
+    n_steps = 0
+
+    with SelfPlayActorPool(net, game_runner, num_actors, model_store, start_fen=start_fen) as pool:
+        while games_trained < final_games_trained:
+            games = pool.get_games(block=len(replay_mem) == 0)
+            stalenesses = []
+            for mcts_dist_histories, model_versions in games:
+                staleness = pool.get_staleness(model_versions)
+                if max_staleness is not None and staleness > max_staleness:
+                    logger.info(f'Discarding self-play game with staleness {staleness}')
+                    continue
+
+                replay_mem.save(mcts_loss.encode_examples(mcts_dist_histories), model_versions)
+                stalenesses.append(staleness)
+                games_trained += 1
+                logger.info(f'Received self-play game {games_trained} with staleness {staleness}')
+
+                if games_trained == 1 or games_trained % 10 == 0:
+                    save_state(checkpoint_writer, net, optimizer, games_trained, replay_mem, CHKPT_NUM_FMT % games_trained)
+
+            if games:
+                save_state(checkpoint_writer, net, optimizer, games_trained, replay_mem, LATEST_CHKPT_PATH)
+
+            if len(replay_mem) == 0: # All the games were discarded
+                continue
+
+            loss = gradient_step(net, optimizer, mcts_loss, next(batches))
+            n_steps += 1
+            log = {
+                'Loss' : loss.item(),
+                'Games trained' : games_trained,
+                'Gradient steps' : n_steps,
+                'Model version' : pool.version,
+                'Checkpoint write time' : checkpoint_writer.get_stats()['mean_write_s']
+            }
+            if stalenesses:
+                log['Game staleness'] = np.mean(stalenesses)
+            wandb.log(log)
+
+            if n_steps % weight_refresh_steps == 0:
+                pool.publish_weights(net)
+
+    save_state(checkpoint_writer, net, optimizer, games_trained, replay_mem, LATEST_CHKPT_PATH)
+
+class StepSchedule:
+    '''
+        Number of gradient steps to take for the games saved to the replay memory:
+        steps_per_game per game or, if positions_per_step is not None, one step per
+        positions_per_step positions.
+    '''
+    def __init__(self, steps_per_game=1, positions_per_step=None):
+        self.steps_per_game = steps_per_game
+        self.positions_per_step = positions_per_step
+        self.n_positions = 0 # Positions saved since the last step
+
+    def get_num_steps(self, n_games, n_positions):
+        if self.positions_per_step is None:
+            return n_games * self.steps_per_game
+
+        self.n_positions += n_positions
+        n_steps, self.n_positions = divmod(self.n_positions, self.positions_per_step)
+
+        return n_steps
+
+def get_batch_loader(replay_mem, batch_size, num_workers, device):
+    '''
+        Returns a DataLoader of training batches sampled from replay_mem by num_workers
+        worker processes, each preparing PREFETCH_BATCHES batches ahead into pinned memory
+        when training on a GPU.
+    '''
+    return DataLoader(
+        ReplayDataset(replay_mem, batch_size),
+        batch_size=None, # The dataset yields whole batches
+        num_workers=num_workers,
+        pin_memory=device != 'cpu',
+        prefetch_factor=PREFETCH_BATCHES if num_workers > 0 else None,
+        persistent_workers=num_workers > 0
+    )
+
+def gradient_step(net, optimizer, mcts_loss, batch):
+    net.train() # game_runner sets the network to eval
+    optimizer.zero_grad()
+    loss = mcts_loss.get_batch_loss(net, *batch)
+    loss.backward()
+    optimizer.step()
+
+    return loss
+
+def save_state(checkpoint_writer, net, optimizer, games_trained, replay_mem, chkpt_path):
+    '''
+        Queues a checkpoint to checkpoint_writer, only blocking to copy the state.
+    '''
     if not os.path.exists(CHECKPOINT_DIR):
         os.mkdir(CHECKPOINT_DIR)
 
-    torch.save({
+    checkpoint_writer.save({
         GAMES_TRAINED_KEY: games_trained,
         MODEL_KEY: net.state_dict(),
         OPTIMIZER_KEY: optimizer.state_dict(),
-        REPLAY_MEM_KEY: replay_mem
+        REPLAY_OFFSET_KEY: replay_mem.get_offset()
     }, os.path.join(CHECKPOINT_DIR, chkpt_path))
 
-def load_state(T, chkpt_path, device, network_temp=2):
+def load_state(T, chkpt_path, device, network_temp=2, replay_dir=REPLAY_DIR, overwrite_replay=False):
+    '''
+        Resuming from a checkpoint drops the positions saved to the replay memory after
+        its offset. Starting a new run drops all of them, so it raises unless there are
+        none or overwrite_replay.
+    '''
     net = Network(T, temp=network_temp).to(device)
     optimizer = Adam(net.parameters(), lr=1e-4, weight_decay=1e-4)
+    replay_mem = ReplayMemory(T, shard_dir=replay_dir)
 
     if chkpt_path is not None and os.path.exists(chkpt_path):
         checkpoint = torch.load(chkpt_path, map_location=torch.device(device))
         net.load_state_dict(checkpoint[MODEL_KEY])
         optimizer.load_state_dict(checkpoint[OPTIMIZER_KEY])
         games_trained = checkpoint[GAMES_TRAINED_KEY]
-        replay_mem = checkpoint[REPLAY_MEM_KEY]
+        replay_mem.rewind(**checkpoint[REPLAY_OFFSET_KEY])
     else:
+        # New runs start from an empty replay memory
+        if replay_mem.n_positions > 0 and not overwrite_replay:
+            raise RuntimeError(f'Replay memory in {replay_dir} already holds {replay_mem.n_positions} positions; '
+                               + 'resume from a checkpoint, use another directory or pass overwrite_replay=True')
+
         games_trained = 0
-        replay_mem = ReplayMemory()
+        replay_mem.rewind(0, 0, 0)
 
     return net, optimizer, games_trained, replay_mem
 
@@ -1,4 +1,5 @@
 import chess
+from collections import OrderedDict
 
 N = 8
 
@@ -22,3 +23,97 @@ def n_n_to_square(row, col):
     file = col
 
     return chess.square(file, rank)
+
+def get_board_history(board, length):
+    '''
+        Returns the last length positions along board's move stack, ending with
+        board itself, as boards without move stacks (as if built from FENs).
+    '''
+    board = board.copy()
+    boards = [board.copy(stack=False)]
+
+    while len(boards) < length and board.move_stack:
+        board.pop()
+        boards.append(board.copy(stack=False))
+
+    return boards[::-1]
+
+class LRUCache:
+    '''
+        Bounded map which, once it holds more than max_entries, evicts its least
+        recently used entries, skipping protected ones.
+    '''
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = OrderedDict() # Ordered from least to most recently used
+        self.protected = set()
+
+        self.n_hits = 0
+        self.n_misses = 0
+        self.n_evictions = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        value = self.entries.get(key)
+        if value is None:
+            self.n_misses += 1
+            return None
+
+        self.n_hits += 1
+        self.entries.move_to_end(key)
+
+        return value
+
+    def peek(self, key):
+        '''
+            Returns the value of key like get, without counting a lookup or marking
+            the entry as used.
+        '''
+        return self.entries.get(key)
+
+    def put(self, key, value):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+
+        if len(self.entries) > self.max_entries:
+            self._evict()
+
+    def touch(self, key):
+        '''
+            Marks the entry as used so it is evicted last.
+        '''
+        if key in self.entries:
+            self.entries.move_to_end(key)
+
+    def protect(self, keys):
+        '''
+            Replaces the set of keys which can't be evicted.
+        '''
+        self.protected = set(keys)
+
+    def _evict(self):
+        n_to_evict = len(self.entries) - self.max_entries
+        evicted = []
+        for key in self.entries: # Least recently used first
+            if len(evicted) == n_to_evict:
+                break
+
+            if key not in self.protected:
+                evicted.append(key)
+
+        for key in evicted:
+            del self.entries[key]
+
+        self.n_evictions += len(evicted)
+
+    def get_stats(self):
+        n_lookups = self.n_hits + self.n_misses
+        return {
+            'entries': len(self.entries),
+            'hits': self.n_hits,
+            'misses': self.n_misses,
+            'hit_rate': self.n_hits / n_lookups if n_lookups else 0,
+            'evictions': self.n_evictions
+        }
@@ -0,0 +1,44 @@
+import unittest
+import os
+import sys
+sys.path.insert(1, os.path.realpath('../src'))
+from run.checkpoint_writer import CheckpointWriter
+import torch
+import tempfile
+
+class TestCheckpointWriter(unittest.TestCase):
+    def test_write(self):
+        with tempfile.TemporaryDirectory() as chkpt_dir:
+            path = os.path.join(chkpt_dir, 'chkpt.tar')
+            tensor = torch.zeros(3)
+
+            with CheckpointWriter() as writer:
+                writer.save({'step': 1, 'state': {'tensor': tensor}}, path)
+                tensor += 1 # The checkpoint holds a copy
+
+                writer.flush()
+                checkpoint = torch.load(path)
+                self.assertEqual(checkpoint['step'], 1)
+                self.assertTrue((checkpoint['state']['tensor'] == 0).all())
+
+            self.assertEqual(os.listdir(chkpt_dir), ['chkpt.tar'])
+
+    def test_coalesce(self):
+        with tempfile.TemporaryDirectory() as chkpt_dir:
+            writer = CheckpointWriter()
+
+            # Queue saves before the writer thread starts
+            for step in range(3):
+                writer.save({'step': step}, os.path.join(chkpt_dir, 'latest.tar'))
+            writer.save({'step': 0}, os.path.join(chkpt_dir, 'first.tar'))
+
+            writer.start()
+            writer.stop()
+
+            stats = writer.get_stats()
+            self.assertEqual(stats['requests'], 4)
+            self.assertEqual(stats['coalesced'], 2)
+            self.assertEqual(stats['written'], 2)
+            self.assertEqual(stats['pending'], 0)
+            self.assertEqual(torch.load(os.path.join(chkpt_dir, 'latest.tar'))['step'], 2)
+            self.assertEqual(torch.load(os.path.join(chkpt_dir, 'first.tar'))['step'], 0)
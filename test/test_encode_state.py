@@ -4,8 +4,11 @@ import sys
 sys.path.insert(1, os.path.realpath('../src'))
 import network.encode_state as encode_state
 from network.encode_state import StateEncoder
+from mcts.zobrist import zobrist_key
+import utils
 import chess
 import torch
+import pickle
 
 class TestEncodeState(unittest.TestCase):
     def setUp(self):
@@ -113,3 +116,81 @@ class TestEncodeState(unittest.TestCase):
         move_count = state[M*T+1, ...]
         expected_count = 1
         self.assertTrue((move_count == expected_count).all())
+
+    def test_encode_states_with_history(self):
+        encoder = StateEncoder(T=3)
+
+        # Histories of different lengths from a short game, including one longer than T
+        board = chess.Board()
+        boards = [board.copy()]
+        for uci in ['e2e4', 'e7e5', 'g1f3', 'b8c6', 'f1b5']:
+            board.push_uci(uci)
+            boards.append(board.copy())
+        histories = [boards[:1], boards[:2], boards[:4], boards]
+
+        expected = torch.stack([
+            encoder.encode_state_with_history(history) for history in histories
+        ])
+
+        # Reference encoding shifting in one board at a time
+        for state, history in zip(expected, histories):
+            curr_state = encoder.get_empty_state()
+            for board in history:
+                curr_state = encoder.encode_state(board, curr_state)
+
+            self.assertTrue((state == curr_state).all())
+
+        out = torch.empty(len(histories), *encoder.get_empty_state().shape)
+        states = encoder.encode_states_with_history(histories, out=out)
+
+        self.assertIs(states, out)
+        self.assertTrue((states == expected).all())
+
+    def test_encode_search_states(self):
+        encoder = StateEncoder(T=4)
+
+        # Two positions before the root of the search, then a path from the root
+        board = chess.Board()
+        prefix_boards = []
+        for uci in ['d2d4', 'g8f6']:
+            prefix_boards.append(board.copy(stack=False))
+            board.push_uci(uci)
+
+        root = board.copy(stack=False)
+        leaves = [root.copy(), root.copy()]
+        for uci in ['c2c4', 'e7e6', 'b1c3']:
+            leaves[0].push_uci(uci)
+        leaves[1].push_uci('g1f3')
+
+        def key_path(leaf):
+            keys = [zobrist_key(leaf)]
+            leaf = leaf.copy()
+            while leaf.move_stack:
+                leaf.pop()
+                keys.append(zobrist_key(leaf))
+
+            return keys[::-1]
+
+        prefix_keys = [zobrist_key(prefix_board) for prefix_board in prefix_boards]
+        expected = encoder.encode_states_with_history([
+            prefix_boards + utils.get_board_history(leaf, encoder.T) for leaf in leaves
+        ])
+
+        # The 7 distinct positions are only encoded the first time around
+        for _ in range(2):
+            states = encoder.encode_search_states(leaves, [key_path(leaf) for leaf in leaves],
+                                                  prefix_boards, prefix_keys)
+
+            self.assertTrue((states == expected).all())
+            self.assertEqual(encoder.plane_cache.get_stats()['misses'], 7)
+
+    def test_pickle_plane_cache(self):
+        # A GameRunner, holding a StateEncoder, is pickled when sent to a spawned actor
+        self.encoder.encode_search_states([chess.Board()], [[zobrist_key(chess.Board())]], [], [])
+        encoder = pickle.loads(pickle.dumps(self.encoder))
+
+        self.assertEqual(len(encoder.plane_cache), 0)
+        self.assertEqual(len(self.encoder.plane_cache), 1)
+
+        state = encoder.encode_search_states([chess.Board()], [[zobrist_key(chess.Board())]], [], [])
+        self.assertTrue((state == self.encoder.encode_states_with_history([[chess.Board()]])).all())
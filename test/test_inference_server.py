@@ -0,0 +1,143 @@
+import unittest
+import os
+import sys
+sys.path.insert(1, os.path.realpath('../src'))
+from run.inference_server import InferenceServer
+from run.play import GameRunner
+import chess
+import torch
+import numpy as np
+import torch.nn.functional as F
+from time import time
+
+class StubNetwork:
+    '''
+        Stands in for Network, recording the size of each batch it evaluates.
+    '''
+    def __init__(self, error=None):
+        self.error = error
+        self.batch_sizes = []
+
+    def eval(self):
+        pass
+
+    def __call__(self, states):
+        self.batch_sizes.append(len(states))
+        if self.error is not None:
+            raise self.error
+
+        values = states[:, 0, 0, :1] # The value of each state is its first entry
+        log_probs = F.log_softmax(torch.zeros(len(states), 8*8*73), dim=1).reshape(-1, 8, 8, 73)
+
+        return values, log_probs
+
+def submit_states(server, n_states):
+    return [server.submit(torch.full((3, 8, 8), float(i)), chess.Board()) for i in range(n_states)]
+
+class TestInferenceServer(unittest.TestCase):
+    def test_batches_capped(self):
+        network = StubNetwork()
+        server = InferenceServer(network, max_batch_size=4, max_wait_s=.01)
+
+        # Queued before the server starts, so batches are only limited by their size
+        futures = submit_states(server, 10)
+        with server:
+            results = [future.result(timeout=5) for future in futures]
+
+        self.assertEqual(network.batch_sizes, [4, 4, 2])
+        self.assertEqual([value for value, _ in results], list(range(10)))
+
+        # Policies are masked to the legal moves
+        policy = results[0][1]
+        self.assertEqual((policy > 0).sum(), 20)
+        self.assertAlmostEqual(policy.sum().item(), 1, places=5)
+
+        stats = server.get_stats()
+        self.assertEqual(stats['requests'], 10)
+        self.assertEqual(stats['batches'], 3)
+        self.assertEqual(stats['max_batch_size'], 4)
+        self.assertAlmostEqual(stats['mean_batch_size'], 10 / 3)
+        self.assertEqual(stats['max_queue_depth'], 10)
+        self.assertGreaterEqual(stats['max_latency_s'], stats['mean_latency_s'])
+        self.assertEqual(stats['queue_depth'], 0)
+
+    def test_flush_after_wait(self):
+        network = StubNetwork()
+        max_wait_s = .05
+
+        with InferenceServer(network, max_batch_size=64, max_wait_s=max_wait_s) as server:
+            start = time()
+            value, _ = server.submit(torch.full((3, 8, 8), 1.), chess.Board()).result(timeout=5)
+            elapsed = time() - start
+
+        # The partial batch is evaluated once no more states arrive within max_wait_s
+        self.assertEqual(value, 1)
+        self.assertEqual(network.batch_sizes, [1])
+        self.assertGreaterEqual(elapsed, max_wait_s)
+        self.assertLess(elapsed, 1)
+
+    def test_exceptions_reach_futures(self):
+        error = RuntimeError('Network failed')
+        server = InferenceServer(StubNetwork(error), max_batch_size=8)
+        futures = submit_states(server, 3)
+
+        with self.assertLogs('run.inference_server', level='ERROR'), server:
+            for future in futures:
+                self.assertIs(future.exception(timeout=5), error)
+
+            # The server keeps serving after a failed batch
+            self.assertIs(server.submit(torch.zeros(3, 8, 8), chess.Board()).exception(timeout=5), error)
+
+    def test_stop_serves_pending(self):
+        network = StubNetwork()
+        server = InferenceServer(network, max_batch_size=4, max_wait_s=1)
+        futures = submit_states(server, 6)
+
+        # Requests queued before stop are still evaluated, without waiting for full batches
+        start = time()
+        server.start()
+        server.stop()
+
+        self.assertLess(time() - start, 1)
+        self.assertTrue(all(future.done() for future in futures))
+        self.assertEqual([future.result()[0] for future in futures], list(range(6)))
+        self.assertEqual(network.batch_sizes, [4, 2])
+        self.assertIsNone(server.thread)
+
+    def test_no_request_left_pending(self):
+        network = StubNetwork()
+        server = InferenceServer(network, max_batch_size=4)
+
+        # Requests queued behind a sentinel are still evaluated
+        server.requests.put(None)
+        futures = submit_states(server, 2)
+        with server:
+            pass
+
+        self.assertEqual([future.result(timeout=5)[0] for future in futures], [0, 1])
+
+        # And a stopped server refuses new ones rather than leaving them pending
+        with self.assertRaises(RuntimeError):
+            server.submit(torch.zeros(3, 8, 8), chess.Board())
+
+    def test_concurrent_games(self):
+        network = StubNetwork()
+        game_runner = GameRunner(1, max_trials=16, max_time_s=-1, max_rollout_depth=10)
+
+        # Games end once the white king takes the rook, usually within a few moves
+        start_fen = 'k7/8/K7/8/8/8/8/1r6 b - - 0 1'
+        torch.manual_seed(0)
+        np.random.seed(0)
+        with InferenceServer(network, max_batch_size=4) as server:
+            game_runner.inference_server = server
+            games = game_runner.play_concurrent_games(network, 3, start_fen=start_fen)
+
+        self.assertEqual(len(games), 3)
+        for board, mcts_dist_histories in games:
+            self.assertIsNotNone(board.outcome())
+            self.assertGreater(len(mcts_dist_histories), 0)
+
+        # Every network evaluation of the games went through the server
+        stats = server.get_stats()
+        self.assertEqual(stats['requests'], sum(network.batch_sizes))
+        self.assertEqual(stats['queue_depth'], 0)
@@ -1,20 +1,94 @@
-# Refer here for this code: https://nesi.github.io/perf-training/python-scatter/ctypes
-# Can also skip the build directory and glob by using g++ -o mylib.so -shared rollout.cpp thc.cpp
-# as done here
-import ctypes
-import glob
+import unittest
+import os
+import sys
+sys.path.insert(1, os.path.realpath('../src'))
+from mcts.mcts import rollout_batch, get_static_value, ROLLOUT_STATS, EVAL_SCALE
+from mcts.mcts import ROLLOUT_POLICIES
+from mcts.rollout_lib import get_rollout_lib, LIB_DIR
+import re
+import chess
+import numpy as np
 
-# find the shared library, the path depends on the platform and Python version
-libfile = glob.glob('build/*/*.so')[0]
+MATED_FEN = 'k7/1Q6/1K6/8/8/8/8/8 b - - 0 1' # Black is checkmated
+DRAWN_FEN = 'k7/8/4K3/8/8/8/8/8 b - - 0 1' # Insufficient material
+MATE_IN_ONE_FEN = 'k7/2Q5/1K6/8/8/8/8/8 w - - 0 1'
+HANGING_QUEEN_FEN = 'k7/8/8/3q4/8/8/8/K2R4 w - - 0 1' # Only Rxd5 wins the queen
 
-# 1. open the shared library
-mylib = ctypes.CDLL(libfile)
+class TestStaticValue(unittest.TestCase):
+    def test_material(self):
+        # White is a queen up, as in rollout.cpp's own check of static_value
+        board = chess.Board('rnb1kbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1')
+        self.assertGreater(get_static_value(board, chess.WHITE), 0)
+        self.assertLess(get_static_value(board, chess.BLACK), 0)
+        self.assertEqual(board.fen(), 'rnb1kbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1')
 
-# 2. tell Python the argument and result types of function mysum
-mylib.rollout.restype = ctypes.c_int
-mylib.rollout.argtypes = [ctypes.c_char_p]
+        # Mobility alone is worth less than a pawn
+        self.assertLess(abs(get_static_value(chess.Board(), chess.WHITE)), np.tanh(1 / EVAL_SCALE))
 
-fen = 'k7/1Q6/1K6/8/8/8/8/8 b - - 0 1'.encode('ascii')
-value = mylib.rollout(fen)
+@unittest.skipIf(get_rollout_lib() is None, 'The C++ rollout library has not been built')
+class TestLib(unittest.TestCase):
+    def test_rollout(self):
+        self.assertEqual(get_rollout_lib().rollout(MATED_FEN.encode('ascii')), -1)
 
-print(f'Value should be -1: {value}')
+    def test_rollout_batch(self):
+        fens = [MATED_FEN, DRAWN_FEN, chess.STARTING_FEN]
+        stats = rollout_batch(fens, rollouts_per_position=8, max_depth=20, num_threads=2)
+
+        self.assertEqual(stats.shape, (3, len(ROLLOUT_STATS)))
+        self.assertTrue((np.abs(stats[:, 0]) <= 1).all())
+
+        # Wins, draws and losses are counts of the playouts which ended the game
+        n_finished = stats[:, 1:4].sum(axis=1)
+        self.assertTrue((stats[:, 1:4] >= 0).all())
+        self.assertTrue((n_finished / 8 <= 1).all())
+        self.assertTrue((stats[:, 4] <= 20).all())
+
+        self.assertEqual(stats[0].tolist(), [-1, 0, 0, 8, 0])
+        self.assertEqual(stats[1].tolist(), [0, 0, 8, 0, 0])
+
+        # Statistics can be written into a given array
+        out = np.zeros((1, len(ROLLOUT_STATS)))
+        self.assertIs(rollout_batch([MATED_FEN], out=out), out)
+        self.assertEqual(out[0, 0], -1)
+
+    def test_mate_in_one(self):
+        # The capture/check-first policy always plays the mate
+        stats = rollout_batch([MATE_IN_ONE_FEN], rollouts_per_position=8, policy='capture_check_first')
+        self.assertEqual(stats[0].tolist(), [1, 8, 0, 0, 1])
+
+    def test_depth_capped(self):
+        # White is far ahead, and can't end the game in a single move
+        fens = ['k7/7p/8/8/8/8/8/4K1QR w - - 0 1', 'k7/7p/8/8/8/8/8/4K1QR b - - 0 1']
+        stats = rollout_batch(fens, rollouts_per_position=8, max_depth=1)
+
+        for fen, (mean_value, wins, draws, losses, mean_length) in zip(fens, stats):
+            board = chess.Board(fen)
+            self.assertEqual(np.sign(mean_value), np.sign(get_static_value(board, board.turn)))
+            self.assertEqual(wins + draws + losses, 0)
+            self.assertEqual(mean_length, 1)
+
+    def test_invalid_arguments(self):
+        for kwargs in [{'rollouts_per_position': 0}, {'num_threads': 0}, {'max_depth': 0}]:
+            with self.subTest(**kwargs), self.assertRaises(AssertionError):
+                rollout_batch([chess.STARTING_FEN], **kwargs)
+
+    def test_policies(self):
+        # ROLLOUT_POLICIES is indexed by the ROLLOUT_POLICY enum of rollout.cpp
+        with open(os.path.join(LIB_DIR, 'rollout.cpp')) as f:
+            enum = re.search(r'enum ROLLOUT_POLICY \{(.*?)\};', f.read(), re.DOTALL).group(1)
+        enum_names = re.findall(r'POLICY_(\w+)', enum)
+        self.assertEqual([name.lower() for name in enum_names], ROLLOUT_POLICIES)
+
+        # Each policy name selects its own behavior
+        mates = {}
+        queen_values = {}
+        for policy in ROLLOUT_POLICIES:
+            mates[policy] = rollout_batch([MATE_IN_ONE_FEN], 64, max_depth=1, policy=policy)[0, 1]
+            queen_values[policy] = rollout_batch([HANGING_QUEEN_FEN], 64, max_depth=1, policy=policy)[0, 0]
+
+        self.assertEqual(mates['capture_check_first'], 64)
+        self.assertLess(mates['uniform'], 64)
+        self.assertGreater(queen_values['see_weighted'], queen_values['uniform'])
+
+        with self.assertRaises(AssertionError):
+            rollout_batch([chess.STARTING_FEN], policy='greedy')
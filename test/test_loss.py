@@ -0,0 +1,68 @@
+import unittest
+import os
+import sys
+sys.path.insert(1, os.path.realpath('../src'))
+from network.loss import MCTSLoss
+from network.encode_dist import MCTSPolicyEncoder, MCTSDist, MoveData
+from network.mask_policy import move_to_flat_index
+import chess
+import torch
+import torch.nn.functional as F
+
+class FakeEdge:
+    def __init__(self, uci, n_visits):
+        self.uci = uci
+        self.n_visits = n_visits
+
+def build_mcts_dist(board, temp):
+    mcts_dist = MCTSDist.__new__(MCTSDist)
+    mcts_dist.fen = board.fen()
+    mcts_dist.value = .5
+    mcts_dist.move_data = [MoveData(FakeEdge(move.uci(), i + 1)) for i, move in enumerate(board.legal_moves)]
+    mcts_dist.temp = temp
+
+    return mcts_dist
+
+class TestMCTSLoss(unittest.TestCase):
+    def test_sparse_policy(self):
+        board = chess.Board()
+        mcts_dist = build_mcts_dist(board, temp=.5)
+        indices, probs = MCTSPolicyEncoder().get_sparse_mcts_policy(mcts_dist)
+
+        moves = list(board.legal_moves)
+        scores = torch.arange(1, len(moves) + 1, dtype=torch.float64) ** 2 # n_visits ** (1 / temp)
+
+        self.assertEqual(indices.shape, (len(moves),))
+        self.assertEqual(list(indices), [move_to_flat_index(move) for move in moves])
+        self.assertTrue(torch.allclose(torch.from_numpy(probs).double(), scores / scores.sum()))
+
+    def test_encode_examples_pads_policies(self):
+        boards = [chess.Board(), chess.Board('k7/8/1K6/8/8/8/8/8 w - - 0 1')]
+        mcts_dists = [build_mcts_dist(board, temp=1) for board in boards]
+        _, policy_indices, policy_probs, _ = MCTSLoss(T=1).encode_examples([[mcts_dist] for mcts_dist in mcts_dists])
+
+        # Padded to the 20 moves of the starting position
+        self.assertEqual(policy_indices.shape, (2, 20))
+        self.assertEqual((policy_probs > 0).sum(axis=1).tolist(), [20, boards[1].legal_moves.count()])
+        self.assertTrue((policy_indices[1, boards[1].legal_moves.count():] == 0).all())
+
+    def test_gather_cross_entropy(self):
+        torch.manual_seed(0)
+        batch_size = 4
+        net_log_probs = F.log_softmax(torch.randn(batch_size, 8*8*73), dim=1).reshape(batch_size, 8, 8, 73)
+        net_vals = torch.zeros(batch_size, 1)
+        network = lambda states: (net_vals, net_log_probs)
+
+        policy_indices = torch.randint(8*8*73, (batch_size, 40))
+        policy_probs = torch.zeros(batch_size, 40)
+        policy_probs[:, :30] = torch.softmax(torch.randn(batch_size, 30), dim=1)
+        mcts_vals = torch.zeros(batch_size)
+        states = torch.zeros(batch_size, 1, 8, 8, dtype=torch.uint8)
+
+        loss = MCTSLoss(T=1).get_batch_loss(network, states, policy_indices, policy_probs, mcts_vals)
+
+        # Same as the cross-entropy with the dense policies
+        dense_policies = torch.zeros(batch_size, 8*8*73)
+        dense_policies.scatter_add_(1, policy_indices, policy_probs)
+        dense_ce = -(dense_policies * net_log_probs.flatten(1)).sum() / batch_size
+        self.assertTrue(torch.isclose(loss, dense_ce))
@@ -178,3 +178,33 @@ class TestMaskPolicy(unittest.TestCase):
 
         self.assertEqual(policy.sum(), 1)
         self.assertTrue((expected == policy).all())
+
+    def test_move_index_table(self):
+        # The table agrees with square_move_to_index on every legal move of these positions
+        fens = [
+            'rnbqkb1r/ppp1pppp/3p4/3nP3/3P4/5N2/PPP2PPP/RNBQKB1R b KQkq - 1 4',
+            '8/2k5/8/8/8/8/1K3p2/8 b - - 0 1',
+            'r3k2r/1P6/8/8/8/8/6p1/R3K2R w KQkq - 0 1'
+        ]
+        for fen in fens:
+            board = chess.Board(fen)
+            for move in board.legal_moves:
+                row, col = utils.square_to_n_n(move.from_square)
+                index = square_move_to_index(move.from_square, move.to_square, move.promotion)
+
+                self.assertEqual(move_to_flat_index(move), (row * 8 + col) * 73 + index)
+
+    def test_mask_invalid_moves_batch(self):
+        boards = [
+            chess.Board('8/3k4/8/8/8/4Q3/2K5/8 w - - 0 1'),
+            chess.Board('8/2k5/8/8/8/8/1K3p2/8 b - - 0 1')
+        ]
+
+        expected = torch.rand(2, 8, 8, 73)
+        policies = expected.clone()
+        for policy, board in zip(expected, boards):
+            mask_invalid_moves(policy, board)
+
+        mask_invalid_moves_batch(policies, boards)
+
+        self.assertTrue(torch.allclose(policies, expected))
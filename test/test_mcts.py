@@ -1,16 +1,199 @@
+import unittest
 import os
 import sys
 sys.path.insert(1, os.path.realpath('../src'))
 import chess
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 from mcts.mcts import MCTSEvaluator
+from mcts.tree import NodeArena, COMPACT_RATIO
 import coloredlogs
 
 #coloredlogs.DEFAULT_LEVEL_STYLES['info'] = 'blue'
 coloredlogs.install(level='INFO', fmt='%(asctime)s %(name)s %(levelname)s %(message)s')
 
-if __name__ == '__main__':
+prior_func_builder = lambda board, keys: lambda moves: np.full(len(moves), .5, dtype=np.float32)
+
+def record_backups(evaluator):
+    '''
+        Makes evaluator record the visits and scores backed up to each edge.
+    '''
+    backups = {'visits': {}, 'scores': {}}
+    backup = evaluator.backup
+
+    def recording_backup(path, value):
+        for edge in path[1::2]:
+            backups['visits'][edge.edge_id] = backups['visits'].get(edge.edge_id, 0) + 1
+            backups['scores'][edge.edge_id] = backups['scores'].get(edge.edge_id, 0) + value
+        backup(path, value)
+
+    evaluator.backup = recording_backup
+
+    return backups
+
+class TestMCTS(unittest.TestCase):
+    def assert_stats_match_backups(self, root, backups):
+        arena = root.arena
+        expected_visits = np.zeros(arena.n_edges)
+        expected_scores = np.zeros(arena.n_edges)
+        for edge_id, n_visits in backups['visits'].items():
+            expected_visits[edge_id] = n_visits
+            expected_scores[edge_id] = backups['scores'][edge_id]
+
+        # No virtual loss is left on any edge
+        self.assertTrue((arena.edge_visits[:arena.n_edges] == expected_visits).all())
+        self.assertTrue(np.allclose(arena.edge_scores[:arena.n_edges], expected_scores, atol=1e-4))
+
+    def test_batch_reverts_virtual_loss(self):
+        np.random.seed(0)
+        evaluator = MCTSEvaluator(chess.STARTING_FEN, prior_func_builder, max_rollout_depth=10)
+        backups = record_backups(evaluator)
+        root = evaluator.mcts(max_trials=64, max_time_s=-1, batch_size=8)
+
+        self.assertEqual(sum(edge.n_visits for edge in root.out_edges), 64)
+        self.assertAlmostEqual(sum(edge.score for edge in root.out_edges), root.score, places=4)
+        self.assert_stats_match_backups(root, backups)
+
+    def test_batch_with_repeated_leaves(self):
+        # White only has 4 moves, so batches of 12 descents reach the same leaves several times
+        np.random.seed(0)
+        evaluator = MCTSEvaluator('k7/8/8/8/8/8/P7/K7 w - - 0 1', prior_func_builder, max_rollout_depth=10)
+        backups = record_backups(evaluator)
+        root = evaluator.mcts(max_trials=48, max_time_s=-1, batch_size=12)
+
+        self.assertEqual(len(root.out_edges), 4)
+        self.assertEqual(root.n_visits, 48)
+        self.assertEqual(sum(edge.n_visits for edge in root.out_edges), 48)
+        self.assert_stats_match_backups(root, backups)
+
+        # Leaves selected several times were only expanded once
+        arena = root.arena
+        self.assertEqual(arena.node_n_edges[:arena.n_nodes].sum(), arena.n_edges)
+
+    def test_threaded_search(self):
+        np.random.seed(0)
+        evaluator = MCTSEvaluator(chess.STARTING_FEN, prior_func_builder, max_rollout_depth=10)
+        backups = record_backups(evaluator)
+        root = evaluator.mcts(max_trials=200, max_time_s=-1, num_threads=4)
+
+        # Virtual loss added along each descent was reverted
+        self.assertEqual(root.n_visits, 200)
+        self.assertEqual(sum(edge.n_visits for edge in root.out_edges), 200)
+        self.assert_stats_match_backups(root, backups)
+
+        # Threads evaluate a single leaf per trial
+        with self.assertRaises(AssertionError):
+            evaluator.mcts(max_trials=8, num_threads=2, batch_size=4)
+
+    def test_threaded_errors(self):
+        n_calls = 0
+        def failing_prior_func_builder(board, keys):
+            nonlocal n_calls
+            n_calls += 1
+            if n_calls == 20:
+                raise ValueError('Prior failed')
 
-    prior_func_builder = lambda l: lambda m: .5
+            return prior_func_builder(board, keys)
+
+        np.random.seed(0)
+        root = NodeArena(chess.Board()).root
+        evaluator = MCTSEvaluator(chess.STARTING_FEN, failing_prior_func_builder, subtree=root,
+                                  max_rollout_depth=10)
+        backups = record_backups(evaluator)
+        with self.assertRaises(ValueError):
+            evaluator.mcts(max_trials=300, max_time_s=-1, num_threads=4)
+
+        # The failed trial left the tree consistent
+        self.assertEqual(evaluator.expanding, set())
+        self.assertLess(root.n_visits, 300)
+        self.assertEqual(sum(edge.n_visits for edge in root.out_edges), root.n_visits)
+        self.assert_stats_match_backups(root, backups)
+
+    def test_root_parallel_merge(self):
+        # Reuse a root that was already searched, as play_game does
+        np.random.seed(0)
+        evaluator = MCTSEvaluator(chess.STARTING_FEN, prior_func_builder, max_rollout_depth=10)
+        root = evaluator.mcts(max_trials=20, max_time_s=-1)
+        prior_visits = root.n_visits
+        prior_edge_visits = root.edge_visits.copy()
+        self.assertEqual(sum(prior_edge_visits), 20)
+
+        evaluator = MCTSEvaluator(chess.STARTING_FEN, prior_func_builder, subtree=root, max_rollout_depth=10)
+        root = evaluator.mcts(max_trials=16, max_time_s=-1, num_processes=2)
+
+        # The prior visits are counted once, not once per worker
+        self.assertEqual(sum(edge.n_visits for edge in root.out_edges), 2*16 + 20)
+        self.assertEqual(root.n_visits, 2*16 + prior_visits)
+        self.assertTrue((root.edge_visits >= prior_edge_visits).all())
+        self.assertAlmostEqual(sum(edge.score for edge in root.out_edges), root.score, places=4)
+
+    def test_concurrent_root_parallel(self):
+        # Two searches at once, as under play_concurrent_games, each merge their own workers' statistics
+        fens = [chess.STARTING_FEN, 'k7/8/8/8/8/8/P7/K7 w - - 0 1']
+        evaluators = [MCTSEvaluator(fen, prior_func_builder, max_rollout_depth=10) for fen in fens]
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            futures = [executor.submit(evaluator.mcts, max_trials=40, max_time_s=-1, num_processes=2)
+                       for evaluator in evaluators]
+            roots = [future.result() for future in futures]
+
+        for fen, root in zip(fens, roots):
+            self.assertEqual(root.fen, fen)
+            self.assertEqual(len(root.out_edges), chess.Board(fen).legal_moves.count())
+            self.assertEqual(sum(edge.n_visits for edge in root.out_edges), 2*40)
+
+    def test_subtree_reuse_frees_previous_tree(self):
+        # Play a few moves reusing the subtree of the move played, as play_game does
+        np.random.seed(0)
+        board = chess.Board()
+        subtree = None
+        for _ in range(4):
+            evaluator = MCTSEvaluator(board.fen(), prior_func_builder, subtree=subtree, max_rollout_depth=10)
+            root = evaluator.mcts(max_trials=50, max_time_s=-1)
+
+            # Only the subtree of the current position is left
+            arena = root.arena
+            self.assertEqual(root.node_id, 0)
+            self.assertEqual(root.fen, board.fen())
+            self.assertEqual(len(arena.table), arena.n_nodes)
+            self.assertLessEqual(arena.n_nodes, root.n_visits + 1)
+
+            edge = root.get_best_move()
+            board.push(edge.move)
+            subtree = edge.to_node
+
+    def test_arena_within_table_budget(self):
+        max_entries = 50
+        for search_kwargs in [{}, {'batch_size': 8}, {'num_threads': 4}]:
+            with self.subTest(**search_kwargs):
+                np.random.seed(0)
+                evaluator = MCTSEvaluator(chess.STARTING_FEN, prior_func_builder, max_table_entries=max_entries,
+                                          max_rollout_depth=10)
+
+                # Track the largest the arena gets during the search
+                peak_nodes = 0
+                backup = evaluator.backup
+                def tracking_backup(path, value):
+                    nonlocal peak_nodes
+                    backup(path, value)
+                    peak_nodes = max(peak_nodes, path[0].arena.n_nodes)
+
+                evaluator.backup = tracking_backup
+                root = evaluator.mcts(max_trials=1000, max_time_s=-1, **search_kwargs)
+
+                # Evicted nodes were freed, without losing the statistics of the root's edges
+                arena = root.arena
+                self.assertGreater(arena.table.get_stats()['evictions'], 0)
+                self.assertLessEqual(peak_nodes, COMPACT_RATIO * max_entries + 8)
+                self.assertLessEqual(len(arena.node_visits), 2 * (COMPACT_RATIO * max_entries + 8))
+                self.assertEqual(sum(edge.n_visits for edge in root.out_edges), 1000)
+
+                # Only the edges of the nodes still indexed are kept
+                arena.compact()
+                self.assertLessEqual(arena.n_nodes, max_entries)
+                self.assertEqual(arena.n_edges, arena.node_n_edges[:arena.n_nodes].sum())
+                self.assertLessEqual(len(arena.edge_visits), 2 * arena.n_edges)
+
+if __name__ == '__main__':
 
     # Black checkmates white on white turn; should return -1
     # https://lichess.org/editor/8/8/8/8/8/8/5kq1/7K_w_-_-_0_1
@@ -0,0 +1,42 @@
+import unittest
+import os
+import sys
+sys.path.insert(1, os.path.realpath('../src'))
+from run.model_store import ModelStore
+from run.checkpoint_writer import CheckpointWriter
+import torch
+import tempfile
+
+class TestModelStore(unittest.TestCase):
+    def test_publish(self):
+        with tempfile.TemporaryDirectory() as store_dir:
+            store = ModelStore(store_dir, keep_versions=2)
+            self.assertEqual(store.load_latest(), (-1, None))
+
+            for version in range(4):
+                store.publish({'weight': torch.full((2,), version)}, version)
+
+            # Only the most recent versions are kept
+            self.assertEqual(store.get_versions(), [2, 3])
+
+            version, state_dict = ModelStore(store_dir).load_latest()
+            self.assertEqual(version, 3)
+            self.assertTrue((state_dict['weight'] == 3).all())
+
+            with self.assertRaises(AssertionError):
+                store.publish({}, 3)
+
+    def test_writer(self):
+        with tempfile.TemporaryDirectory() as store_dir:
+            writer = CheckpointWriter()
+            store = ModelStore(store_dir, checkpoint_writer=writer)
+
+            # Versions waiting to be written are replaced by newer ones
+            store.publish({'weight': torch.zeros(2)}, 0)
+            store.publish({'weight': torch.ones(2)}, 1)
+            self.assertEqual(store.get_latest_version(), -1)
+
+            writer.start()
+            writer.stop()
+            self.assertEqual(store.get_versions(), [1])
+            self.assertTrue((store.load_latest()[1]['weight'] == 1).all())
@@ -0,0 +1,191 @@
+import unittest
+import os
+import sys
+sys.path.insert(1, os.path.realpath('../src'))
+from run.replay_mem import ReplayMemory, ReplayDataset, POLICY_MOVES_PER_POSITION
+from network.encode_state import M, L
+import numpy as np
+import torch
+import pickle
+import tempfile
+from torch.utils.data import DataLoader
+
+T = 1
+
+def build_examples(n_positions, fill, policy_width=5):
+    states = np.zeros((n_positions, M*T+L, 8, 8), dtype=np.uint8)
+    states[:, fill] = 1
+
+    # Two moves with visits, padded to policy_width
+    policy_indices = np.zeros((n_positions, policy_width), dtype=np.int64)
+    policy_probs = np.zeros((n_positions, policy_width), dtype=np.float32)
+    policy_indices[:, :2] = [fill, fill + 100]
+    policy_probs[:, :2] = .5
+
+    values = np.full(n_positions, fill, dtype=np.float32)
+
+    return states, policy_indices, policy_probs, values
+
+def get_values(replay_mem):
+    positions = np.arange(replay_mem.n_positions - len(replay_mem), replay_mem.n_positions)
+    return sorted(replay_mem.get_records(positions)['value'])
+
+class TestReplayMemory(unittest.TestCase):
+    def assert_consistent(self, states, policy_indices, policy_probs, values):
+        # Tensors of a position are sampled together
+        fills = values.long()
+        self.assertTrue((states.flatten(1).sum(dim=1) == 64).all())
+        self.assertTrue((states[range(len(fills)), fills] == 1).all())
+
+        self.assertTrue((policy_indices[:, 0] == fills).all())
+        self.assertTrue((policy_indices[:, 1] == fills + 100).all())
+        self.assertTrue((policy_probs[:, :2] == .5).all())
+        self.assertTrue((policy_probs.sum(dim=1) == 1).all())
+
+    def test_save_and_sample(self):
+        replay_mem = ReplayMemory(T, capacity=5)
+        for game in range(4):
+            self.assertEqual(replay_mem.save(build_examples(game + 1, game)), game)
+
+        # The oldest positions were overwritten
+        self.assertEqual(len(replay_mem), 5)
+        self.assertEqual(get_values(replay_mem), [2, 3, 3, 3, 3])
+
+        states, policy_indices, policy_probs, values = replay_mem.sample(20)
+
+        self.assertEqual(states.shape, (20, M*T+L, 8, 8))
+        # Only the moves with visits are stored
+        self.assertEqual(replay_mem.n_moves, 2 * (1 + 2 + 3 + 4))
+        self.assertEqual(policy_indices.shape, (20, 2))
+        self.assertEqual(policy_indices.dtype, torch.int64)
+        self.assertEqual(policy_probs.shape, (20, 2))
+        self.assertTrue(((values == 2) | (values == 3)).all())
+        self.assert_consistent(states, policy_indices, policy_probs, values)
+
+    def test_long_game(self):
+        replay_mem = ReplayMemory(T, capacity=3)
+        replay_mem.save(build_examples(2, 1))
+        replay_mem.save(build_examples(5, 2), model_versions=np.arange(5))
+
+        self.assertEqual(len(replay_mem), 3)
+        records = replay_mem.get_records([2, 3, 4])
+        self.assertTrue((records['value'] == 2).all())
+        self.assertTrue((records['game_id'] == 1).all())
+        self.assertEqual(list(records['model_version']), [2, 3, 4])
+
+    def test_overwritten_policies(self):
+        replay_mem = ReplayMemory(T, capacity=4)
+        n_moves = 4 * POLICY_MOVES_PER_POSITION
+        replay_mem.save(build_examples(2, 0))
+
+        # Two positions with longer policies fill the rest of the moves
+        policy_width = (n_moves - 4) // 2
+        states, policy_indices, policy_probs, values = build_examples(2, 1, policy_width)
+        policy_indices[:] = np.arange(policy_width)
+        policy_probs[:] = 1 / policy_width
+        replay_mem.save((states, policy_indices, policy_probs, values))
+        self.assertEqual(replay_mem.n_moves, n_moves)
+        self.assertEqual(get_values(replay_mem), [0, 0, 1, 1])
+
+        # The moves of the next position overwrite those of the two oldest ones,
+        # which aren't sampled anymore
+        states, policy_indices, policy_probs, values = build_examples(1, 2)
+        policy_probs[:, :4] = .25
+        replay_mem.save((states, policy_indices, policy_probs, values))
+        self.assertEqual(len(replay_mem), 3)
+        self.assertEqual(get_values(replay_mem), [1, 1, 2])
+
+        _, policy_indices, policy_probs, values = replay_mem.sample(20)
+        self.assertEqual(policy_indices.shape, (20, policy_width))
+        self.assertTrue(torch.allclose(policy_probs.sum(dim=1), torch.ones(20)))
+        self.assertTrue((policy_indices[values == 1] == torch.arange(policy_width)).all())
+
+    def test_capacity_bytes(self):
+        replay_mem = ReplayMemory(T, capacity_bytes=10 * ReplayMemory(T, capacity=1).record_bytes())
+        self.assertEqual(replay_mem.capacity, 10)
+
+    def test_pickle(self):
+        replay_mem = ReplayMemory(T, capacity=4)
+        for game in range(3):
+            replay_mem.save(build_examples(2, game))
+
+        loaded = pickle.loads(pickle.dumps(replay_mem))
+        self.assertEqual(len(loaded), 4)
+        self.assertEqual(len(loaded.records.shards[0]), 4)
+        self.assertEqual(get_values(loaded), [1, 1, 2, 2])
+
+        # New positions overwrite the oldest ones
+        loaded.save(build_examples(2, 3))
+        self.assertEqual(get_values(loaded), [2, 2, 3, 3])
+        self.assert_consistent(*loaded.sample(10))
+
+    def test_shards(self):
+        with tempfile.TemporaryDirectory() as shard_dir:
+            replay_mem = ReplayMemory(T, capacity=100, shard_dir=shard_dir, shard_positions=3)
+            for game in range(4):
+                replay_mem.save(build_examples(game + 1, game))
+
+            # Games are split across shards of 3 positions
+            self.assertEqual(len(replay_mem), 10)
+            self.assertEqual(len(replay_mem.records.shards), 4)
+            self.assertEqual(get_values(replay_mem), [0, 1, 1, 2, 2, 2, 3, 3, 3, 3])
+            self.assert_consistent(*replay_mem.sample(20))
+
+            # Other processes can read the shards while they are written to
+            reader = ReplayMemory(T, capacity=5, shard_dir=shard_dir, read_only=True)
+            self.assertEqual(reader.shard_positions, 3)
+            self.assertEqual(get_values(reader), [2, 3, 3, 3, 3])
+
+            replay_mem.save(build_examples(3, 4))
+            self.assertEqual(reader.n_positions, 10)
+            reader.refresh()
+            self.assertEqual(get_values(reader), [3, 3, 4, 4, 4])
+            self.assert_consistent(*reader.sample(20))
+
+            # Pickles only reference the shards
+            self.assertLess(len(pickle.dumps(replay_mem)), 1000)
+            loaded = pickle.loads(pickle.dumps(replay_mem))
+            self.assertEqual(loaded.save(build_examples(1, 5)), 5)
+            self.assertEqual(get_values(loaded)[-2:], [4, 5])
+
+            # Opening the directory again resumes from the index
+            reopened = ReplayMemory(T, capacity=100, shard_dir=shard_dir)
+            self.assertEqual(reopened.n_positions, 14)
+            self.assertEqual(reopened.n_games, 6)
+
+    def test_rewind(self):
+        with tempfile.TemporaryDirectory() as shard_dir:
+            replay_mem = ReplayMemory(T, shard_dir=shard_dir, shard_positions=3)
+            replay_mem.save(build_examples(2, 0))
+            offset = replay_mem.get_offset()
+            replay_mem.save(build_examples(4, 1))
+            self.assertEqual(len(replay_mem.records.shards), 2)
+
+            # Resuming from the offset drops the later game from the shards
+            replay_mem = ReplayMemory(T, shard_dir=shard_dir)
+            replay_mem.rewind(**offset)
+            self.assertEqual(len(replay_mem), 2)
+            self.assertEqual(len(replay_mem.records.shards), 1)
+
+            replay_mem.save(build_examples(2, 2))
+            self.assertEqual(get_values(ReplayMemory(T, shard_dir=shard_dir, read_only=True)), [0, 0, 2, 2])
+
+    def test_dataset(self):
+        with tempfile.TemporaryDirectory() as shard_dir:
+            replay_mem = ReplayMemory(T, capacity=2, shard_dir=shard_dir)
+            replay_mem.save(build_examples(2, 0))
+
+            loader = DataLoader(ReplayDataset(replay_mem, batch_size=8), batch_size=None, num_workers=1)
+            batches = iter(loader)
+            states, _, _, values = next(batches)
+            self.assertEqual(states.shape, (8, M*T+L, 8, 8))
+            self.assertTrue((values == 0).all())
+
+            # The worker sees games saved after it started, once its prefetched batches are used
+            replay_mem.save(build_examples(2, 1))
+            for _ in range(20):
+                batch = next(batches)
+                if (batch[3] == 1).all():
+                    break
+            self.assertTrue((batch[3] == 1).all())
+            self.assert_consistent(*batch)
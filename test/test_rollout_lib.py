@@ -0,0 +1,69 @@
+import unittest
+import os
+import sys
+sys.path.insert(1, os.path.realpath('../src'))
+import _ctypes
+import glob
+import shutil
+import tempfile
+import mcts.rollout_lib as rollout_lib
+
+# A shared library which loads but has none of the rollout functions, like a stale build
+STALE_LIB_FILE = _ctypes.__file__
+BUILT_LIB_FILES = glob.glob(os.path.join(rollout_lib.LIB_DIR, 'rollout*.so'))
+
+class TestRolloutLib(unittest.TestCase):
+    def setUp(self):
+        lib_dir = rollout_lib.LIB_DIR
+        find_lib_file = rollout_lib.find_lib_file
+        def restore():
+            rollout_lib.LIB_DIR = lib_dir
+            rollout_lib.find_lib_file = find_lib_file
+            rollout_lib._lib = None
+            rollout_lib._lib_loaded = False
+
+        self.addCleanup(restore)
+
+        self.lib_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.lib_dir)
+        rollout_lib.LIB_DIR = self.lib_dir
+        rollout_lib._lib = None
+        rollout_lib._lib_loaded = False
+
+    def add_lib(self, src_file, *path):
+        lib_file = os.path.join(self.lib_dir, *path)
+        os.makedirs(os.path.dirname(lib_file), exist_ok=True)
+        shutil.copy(src_file, lib_file)
+
+        return lib_file
+
+    def test_ignores_build_dir(self):
+        # Left by an older `setup.py build`
+        self.add_lib(STALE_LIB_FILE, 'build', 'lib.linux-x86_64-cpython-311', 'rollout.so')
+
+        self.assertIsNone(rollout_lib.find_lib_file())
+        with self.assertLogs('mcts.rollout_lib', 'WARNING') as logs:
+            self.assertIsNone(rollout_lib.get_rollout_lib())
+        self.assertIn('not found', logs.output[0])
+
+    def test_prefers_in_place_lib(self):
+        if not BUILT_LIB_FILES:
+            self.skipTest('C++ rollout library not built')
+
+        self.add_lib(STALE_LIB_FILE, 'build', 'lib.linux-x86_64-cpython-311', 'rollout.so')
+        lib_file = self.add_lib(BUILT_LIB_FILES[0], os.path.basename(BUILT_LIB_FILES[0]))
+
+        self.assertEqual(rollout_lib.find_lib_file(), lib_file)
+        self.assertIsNotNone(rollout_lib.get_rollout_lib())
+
+    def test_out_of_date_lib(self):
+        self.add_lib(STALE_LIB_FILE, 'rollout.so')
+
+        with self.assertLogs('mcts.rollout_lib', 'WARNING') as logs:
+            self.assertIsNone(rollout_lib.get_rollout_lib())
+        self.assertIn('out of date', logs.output[0])
+
+        # The failure is cached rather than retried
+        self.assertTrue(rollout_lib._lib_loaded)
+        rollout_lib.find_lib_file = lambda: self.fail('Loaded the library again')
+        self.assertIsNone(rollout_lib.get_rollout_lib())
@@ -0,0 +1,77 @@
+import unittest
+import os
+import sys
+sys.path.insert(1, os.path.realpath('../src'))
+from run.self_play import SelfPlayActorPool, ActorError
+from run.model_store import ModelStore
+from run.play import GameRunner
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+import tempfile
+from time import time
+
+# White's only move takes the rook, leaving a draw by insufficient material
+ONE_MOVE_FEN = 'k7/8/8/8/8/8/1r6/K7 w - - 0 1'
+
+class StubNetwork(nn.Module):
+    '''
+        Stands in for Network with uniform policies, for actors to load versions into.
+    '''
+    def __init__(self):
+        super().__init__()
+        self.weight = nn.Parameter(torch.zeros(1))
+
+    def forward(self, states):
+        values = self.weight.expand(len(states))
+        log_probs = F.log_softmax(torch.zeros(len(states), 8*8*73), dim=1).reshape(-1, 8, 8, 73)
+
+        return values, log_probs
+
+def get_game_runner():
+    return GameRunner(1, max_trials=4, max_time_s=-1, max_rollout_depth=10)
+
+class TestSelfPlay(unittest.TestCase):
+    def test_actor_pool(self):
+        with tempfile.TemporaryDirectory() as store_dir:
+            net = StubNetwork()
+            pool = SelfPlayActorPool(net, get_game_runner(), 2, ModelStore(store_dir), start_fen=ONE_MOVE_FEN)
+            with pool:
+                self.assertEqual(pool.version, 0)
+
+                games = []
+                while len(games) < 4:
+                    games += pool.get_games(block=True)
+
+                for mcts_dist_histories, model_versions in games:
+                    self.assertEqual(len(mcts_dist_histories), 1)
+                    self.assertEqual(model_versions, [0])
+                    self.assertEqual(pool.get_staleness(model_versions), 0)
+
+                # Games played after a new version is published use it
+                pool.publish_weights(net)
+                start_time = time()
+                while True:
+                    self.assertLess(time() - start_time, 30)
+
+                    model_versions = [versions for _, versions in pool.get_games(block=True)]
+                    if [1] in model_versions:
+                        break
+
+                    # Older games were played before the actors loaded the new version
+                    for versions in model_versions:
+                        self.assertEqual(pool.get_staleness(versions), 1)
+
+                self.assertEqual(pool.get_staleness([1]), 0)
+
+    def test_failed_actors(self):
+        with tempfile.TemporaryDirectory() as store_dir:
+            pool = SelfPlayActorPool(StubNetwork(), get_game_runner(), 2, ModelStore(store_dir),
+                                     start_fen='not a FEN')
+
+            # The learner raises the actors' error rather than waiting for games forever
+            with pool:
+                with self.assertRaises(ActorError) as context:
+                    pool.get_games(block=True)
+
+            self.assertIn('ValueError', str(context.exception))
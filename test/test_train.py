@@ -1,11 +1,47 @@
+import unittest
 import os
 import sys
 sys.path.insert(1, os.path.realpath('../src'))
 from network.network import Network
-from run.train import train
+from run.train import train, load_state, GAMES_TRAINED_KEY, MODEL_KEY, OPTIMIZER_KEY, REPLAY_OFFSET_KEY
+from test_replay_mem import build_examples
+import torch
+import tempfile
 import coloredlogs
 coloredlogs.install(level='INFO', fmt='%(asctime)s %(name)s %(levelname)s %(message)s')
 
+class TestTrain(unittest.TestCase):
+    def test_load_state_keeps_replay(self):
+        with tempfile.TemporaryDirectory() as run_dir:
+            replay_dir = os.path.join(run_dir, 'replay')
+            chkpt_path = os.path.join(run_dir, 'chkpt.tar')
+
+            net, optimizer, _, replay_mem = load_state(1, None, 'cpu', replay_dir=replay_dir)
+            replay_mem.save(build_examples(2, 0))
+            torch.save({
+                GAMES_TRAINED_KEY: 1,
+                MODEL_KEY: net.state_dict(),
+                OPTIMIZER_KEY: optimizer.state_dict(),
+                REPLAY_OFFSET_KEY: replay_mem.get_offset()
+            }, chkpt_path)
+            replay_mem.save(build_examples(3, 1))
+
+            # A new run doesn't overwrite the shards of another one
+            with self.assertRaises(RuntimeError):
+                load_state(1, None, 'cpu', replay_dir=replay_dir)
+
+            # Resuming reports the positions saved after the checkpoint
+            with self.assertLogs('run.replay_mem', 'WARNING') as logs:
+                _, _, games_trained, replay_mem = load_state(1, chkpt_path, 'cpu', replay_dir=replay_dir)
+            self.assertIn('Dropping the last 3 positions (1 games)', logs.output[0])
+            self.assertEqual(games_trained, 1)
+            self.assertEqual(len(replay_mem), 2)
+
+            _, _, games_trained, replay_mem = load_state(1, None, 'cpu', replay_dir=replay_dir,
+                                                         overwrite_replay=True)
+            self.assertEqual(games_trained, 0)
+            self.assertEqual(len(replay_mem), 0)
+
 if __name__ == '__main__':
     device = 'cpu'
     T = 2
@@ -0,0 +1,108 @@
+import unittest
+import os
+import sys
+sys.path.insert(1, os.path.realpath('../src'))
+from mcts.tree import *
+from mcts.zobrist import zobrist_key
+import chess
+import numpy as np
+
+class TestTree(unittest.TestCase):
+    def test_transposition_table_eviction(self):
+        table = TranspositionTable(max_entries=3)
+        for i in range(3):
+            table.put(i, i)
+
+        # Visiting 0 makes 1 the least recently visited entry
+        table.touch(0)
+        table.put(3, 3)
+
+        self.assertEqual(len(table), 3)
+        self.assertIsNone(table.get(1))
+        self.assertEqual(table.get(0), 0)
+
+        # Protected entries aren't evicted even if least recently visited
+        table.protect([2])
+        table.put(4, 4)
+
+        self.assertEqual(table.get(2), 2)
+        self.assertIsNone(table.get(3))
+
+        stats = table.get_stats()
+        self.assertEqual(stats['hits'], 2)
+        self.assertEqual(stats['misses'], 2)
+        self.assertEqual(stats['evictions'], 2)
+
+    def test_transpositions_share_nodes(self):
+        # 1. Nf3 Nf6 2. Nc3 and 1. Nc3 Nf6 2. Nf3 reach the same position
+        arena = NodeArena(chess.Board())
+        root = arena.root
+        root.expand()
+
+        def child(node, uci):
+            if not node.was_expanded():
+                node.expand()
+
+            return next(edge.to_node for edge in node.out_edges if edge.uci == uci)
+
+        node1 = child(child(child(root, 'g1f3'), 'g8f6'), 'b1c3')
+        node2 = child(child(child(root, 'b1c3'), 'g8f6'), 'g1f3')
+
+        self.assertEqual(node1, node2)
+        self.assertEqual(node1.fen, 'rnbqkb1r/pppppppp/5n2/8/8/2N2N2/PPPPPPPP/R1BQKB1R b KQkq - 3 2')
+        self.assertGreater(arena.table.get_stats()['hits'], 0)
+
+    def test_children_materialized_on_selection(self):
+        arena = NodeArena(chess.Board())
+        root = arena.root
+        root.expand(lambda moves: np.array([move.uci() == 'e2e4' for move in moves], dtype=np.float32))
+
+        # Expanding only stores the edges
+        self.assertEqual(arena.n_nodes, 1)
+        self.assertEqual(len(root.out_edges), 20)
+
+        board = chess.Board()
+        edge = root.get_edge_to_explore(0, board=board)
+
+        self.assertEqual(edge.uci, 'e2e4')
+        self.assertEqual(arena.n_nodes, 2)
+        self.assertEqual(board.peek().uci(), 'e2e4')
+        self.assertEqual(edge.to_node.key, zobrist_key(board))
+
+    def test_compact_to_subtree(self):
+        arena = NodeArena(chess.Board())
+        root = arena.root
+        root.expand()
+
+        def child(node, uci):
+            if not node.was_expanded():
+                node.expand()
+
+            return next(edge.to_node for edge in node.out_edges if edge.uci == uci)
+
+        # 1. e4 e5 2. Nf3 and 1. e4 Nf6, plus a sibling of 1. e4 which is freed
+        e4 = child(root, 'e2e4')
+        nf3 = child(child(e4, 'e7e5'), 'g1f3')
+        child(e4, 'g8f6')
+        child(root, 'd2d4')
+        for edge in e4.out_edges[:3]:
+            edge.backup_update(.5)
+        nf3_fen = nf3.fen
+        nf3_key = nf3.key
+        e4_visits = e4.edge_visits.copy()
+
+        arena.compact(e4.node_id)
+        root = arena.root
+
+        # e4, e5, Nf3 and Nf6
+        self.assertEqual(arena.n_nodes, 4)
+        self.assertEqual(arena.n_edges, arena.node_n_edges[:arena.n_nodes].sum())
+        self.assertEqual(root.fen, chess.Board('rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b KQkq - 0 1').fen())
+        self.assertTrue((root.edge_visits == e4_visits).all())
+
+        # Boards are replayed from the new root, and the table points to the new ids
+        nf3 = TreeNode(arena, arena.table.get(nf3_key))
+        self.assertEqual(nf3.fen, nf3_fen)
+        self.assertEqual(len(nf3.board().move_stack), 2)
+        self.assertEqual(len(arena.table), 4)
+        self.assertIsNone(arena.table.get(zobrist_key(chess.Board())))
@@ -37,3 +37,23 @@ class TestUtils(unittest.TestCase):
         expected = chess.parse_square('f4')
 
         self.assertEqual(square, expected)
+
+    def test_lru_cache(self):
+        cache = LRUCache(max_entries=2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+
+        self.assertEqual(cache.get('a'), 1) # 'b' is now least recently used
+        cache.put('c', 3)
+
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(set(cache.entries), {'a', 'c'})
+
+        # Protected entries are skipped when evicting
+        cache.protect(['a'])
+        cache.put('d', 4)
+
+        self.assertEqual(set(cache.entries), {'a', 'd'})
+        self.assertEqual(cache.get_stats(), {
+            'entries': 2, 'hits': 1, 'misses': 1, 'hit_rate': .5, 'evictions': 2
+        })
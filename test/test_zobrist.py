@@ -0,0 +1,51 @@
+import unittest
+import os
+import sys
+sys.path.insert(1, os.path.realpath('../src'))
+from mcts.zobrist import *
+import chess
+import random
+
+class TestZobrist(unittest.TestCase):
+    def test_push_with_key(self):
+        random.seed(0)
+
+        # Random games cover captures, promotions, castling and en passant
+        for _ in range(20):
+            board = chess.Board()
+            key = zobrist_key(board)
+
+            while board.outcome() is None:
+                move = random.choice(list(board.legal_moves))
+                key = push_with_key(board, key, move)
+
+                self.assertEqual(key, zobrist_key(board))
+
+    def test_en_passant_and_castling(self):
+        # https://lichess.org/editor/r3k2r/8/8/8/1p6/8/P7/R3K2R_w_KQkq_-_0_1
+        board = chess.Board('r3k2r/8/8/8/1p6/8/P7/R3K2R w KQkq - 0 1')
+        key = zobrist_key(board)
+
+        for uci in ['a2a4', 'b4a3', 'e1g1', 'e8c8']:
+            key = push_with_key(board, key, chess.Move.from_uci(uci))
+            self.assertEqual(key, zobrist_key(board))
+
+    def test_transpositions_share_keys(self):
+        board1 = chess.Board()
+        board2 = chess.Board()
+        key1 = key2 = zobrist_key(board1)
+
+        for uci in ['g1f3', 'g8f6', 'b1c3']:
+            key1 = push_with_key(board1, key1, chess.Move.from_uci(uci))
+        for uci in ['b1c3', 'g8f6', 'g1f3']:
+            key2 = push_with_key(board2, key2, chess.Move.from_uci(uci))
+
+        self.assertEqual(key1, key2)
+
+        # Repetitions don't share keys with earlier positions
+        board = chess.Board()
+        key = zobrist_key(board)
+        for uci in ['g1f3', 'g8f6', 'f3g1', 'f6g8']:
+            key = push_with_key(board, key, chess.Move.from_uci(uci))
+
+        self.assertNotEqual(key, zobrist_key(chess.Board()))